@@ -0,0 +1,333 @@
+import importlib.util
+import math
+from typing import Dict, List, Optional, Tuple
+from models import RiskNode
+
+# Порядок полей в кэшированных суммах
+FIELDS = ("prob", "loss_min", "loss_max", "severity")
+
+# Начиная с этого числа узлов полный пересчёт, построение кэша и итоги по листьям
+# идут колонками NumPy (columnar.py)
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+COLUMNAR_MIN_NODES = 50_000
+
+
+def column_store(nodes: Dict[int, RiskNode]) -> Optional["ColumnarStore"]:
+    """Колонки узлов для полного пересчёта — если дерево достаточно велико и есть NumPy, иначе None.
+
+    Одни и те же колонки можно отдать RiskAggregator и metrics.LeafTotals, чтобы
+    узлы копировались в массивы один раз.
+    """
+    if not NUMPY_AVAILABLE or len(nodes) < COLUMNAR_MIN_NODES:
+        return None
+    from columnar import ColumnarStore
+    return ColumnarStore(nodes.values())
+
+
+def _values(node: RiskNode) -> Tuple[float, float, float, float]:
+    """Значения узла в том виде, в каком они входят в среднее родителя."""
+    return (node.prob or 0.0, node.loss_min or 0.0, node.loss_max or 0.0, node.severity or 1.0)
+
+
+class RiskAggregator:
+    """Инкрементальный пересчёт средних значений родителей.
+
+    Для каждого родителя хранятся суммы параметров детей и их количество,
+    поэтому изменение одного узла поднимается к корню за O(глубины) по разностям,
+    а не пересканированием всех детей на каждом уровне.
+    """
+
+    def __init__(self, nodes: Dict[int, RiskNode], verify: bool = False, columns=None):
+        self.nodes = nodes
+        # Режим проверки: после каждой операции кэш сверяется с пересчётом с нуля
+        self.verify_each = verify
+        self._sums: Dict[int, List[float]] = {}
+        self._counts: Dict[int, int] = {}
+        self._seen: Dict[int, Tuple[float, float, float, float]] = {}  # вклад узла в сумму родителя
+        self.reindex(columns)
+
+    # ----------------- Построение кэша -----------------
+    def reindex(self, columns=None):
+        """Строит суммы по текущим значениям детей, не меняя сами узлы.
+
+        columns — готовые колонки тех же узлов (column_store); по умолчанию
+        строятся здесь, если дерево велико.
+        """
+        if columns is None:
+            columns = column_store(self.nodes)
+        if columns is not None:
+            self._load_columns(columns, rollup=False)
+            return
+        self._sums.clear()
+        self._counts.clear()
+        self._seen.clear()
+        for node in self.nodes.values():
+            for cid in node.children:
+                self._add(node.id, self.nodes[cid])
+
+    def rebuild(self, columns=None) -> List[int]:
+        """Полный пересчёт всех родителей одним обходом в обратном порядке (сначала дети).
+
+        columns — как в reindex; значения родителей в них тоже пересчитываются.
+        """
+        if columns is None:
+            columns = column_store(self.nodes)
+        if columns is not None:
+            return self._load_columns(columns, rollup=True)
+        self._sums.clear()
+        self._counts.clear()
+        self._seen.clear()
+        order = []
+        stack = [nid for nid, node in self.nodes.items() if node.parent_id is None]
+        while stack:
+            nid = stack.pop()
+            order.append(nid)
+            stack.extend(self.nodes[nid].children)
+        touched = []
+        for nid in reversed(order):
+            node = self.nodes[nid]
+            if node.children:
+                for cid in node.children:
+                    self._add(nid, self.nodes[cid])
+                self._apply_mean(node)
+                touched.append(nid)
+        self._check(touched)
+        return touched
+
+    def _load_columns(self, store, rollup: bool) -> List[int]:
+        """Кэш (и при rollup — средние родителей) по колонкам: уровень дерева за одну векторную операцию."""
+        touched = store.write_back(self.nodes, store.rollup()) if rollup else []
+        rows, sums, counts = store.parent_sums()
+        parent_ids = store.ids[rows].tolist()
+        self._sums = dict(zip(parent_ids, map(list, zip(*(col.tolist() for col in sums)))))
+        self._counts = dict(zip(parent_ids, counts.tolist()))
+        child = store.parent >= 0
+        self._seen = dict(zip(store.ids[child].tolist(),
+                              zip(*(col[child].tolist() for col in (store.prob, store.loss_min,
+                                                                     store.loss_max, store.severity)))))
+        self._check(touched)
+        return touched
+
+    # ----------------- Операции -----------------
+    def refresh(self, node_id) -> List[int]:
+        """Аналог recalc_tree_up: пересчитывает узел и всех его предков.
+
+        Возвращает id пересчитанных узлов (от node_id до корня).
+        """
+        if node_id is None:
+            return []
+        touched = []
+        node = self.nodes[node_id]
+        while True:
+            if self._counts.get(node.id):
+                self._apply_mean(node)
+            touched.append(node.id)
+            if node.parent_id is None:
+                break
+            new = _values(node)
+            old = self._seen[node.id]
+            sums = self._sums[node.parent_id]
+            for i in range(4):
+                sums[i] += new[i] - old[i]
+            self._seen[node.id] = new
+            node = self.nodes[node.parent_id]
+        self._check(touched)
+        return touched
+
+    def attach(self, node_id) -> List[int]:
+        """Учитывает новый узел (вместе с поддеревом), уже добавленный в children родителя."""
+        node = self.nodes[node_id]
+        stack = [node_id]
+        while stack:
+            nid = stack.pop()
+            for cid in self.nodes[nid].children:
+                self._add(nid, self.nodes[cid])
+                stack.append(cid)
+        if node.parent_id is None:
+            return [node_id]
+        self._add(node.parent_id, node)
+        return self.refresh(node.parent_id)
+
+    def detach(self, node_id) -> List[int]:
+        """Отцепляет узел от родителя и исключает его поддерево из сумм.
+
+        Вызывается до удаления узлов из словаря. Если у родителя не осталось детей,
+        его значения не меняются (как в recalc_tree_up).
+        """
+        node = self.nodes[node_id]
+        stack = [node_id]
+        while stack:
+            nid = stack.pop()
+            self._sums.pop(nid, None)
+            self._counts.pop(nid, None)
+            if nid != node_id:
+                self._seen.pop(nid, None)
+            stack.extend(self.nodes[nid].children)
+        pid = node.parent_id
+        if pid is None:
+            self._seen.pop(node_id, None)
+            return []
+        parent = self.nodes[pid]
+        parent.children = [cid for cid in parent.children if cid != node_id]
+        old = self._seen.pop(node_id)
+        self._counts[pid] -= 1
+        if self._counts[pid]:
+            sums = self._sums[pid]
+            for i in range(4):
+                sums[i] -= old[i]
+        else:
+            del self._counts[pid]
+            del self._sums[pid]
+        return self.refresh(pid)
+
+    def attach_many(self, node_ids) -> List[int]:
+        """Как attach для каждого из node_ids, но за один проход снизу вверх.
+
+        Новые родители внутри поддеревьев получают средние своих детей, а каждый
+        затронутый существующий предок пересчитывается один раз, сколько бы новых
+        узлов под ним ни появилось.
+        """
+        order = []
+        stack = list(node_ids)
+        while stack:
+            nid = stack.pop()
+            order.append(nid)
+            stack.extend(self.nodes[nid].children)
+        touched = []
+        for nid in reversed(order):
+            node = self.nodes[nid]
+            if node.children:
+                for cid in node.children:
+                    self._add(nid, self.nodes[cid])
+                self._apply_mean(node)
+                touched.append(nid)
+        parents = []
+        for nid in node_ids:
+            node = self.nodes[nid]
+            if node.parent_id is not None:
+                self._add(node.parent_id, node)
+                parents.append(node.parent_id)
+        touched.extend(self._refresh_upwards(parents))
+        self._check(touched)
+        return touched
+
+    def detach_many(self, node_ids) -> List[int]:
+        """Как detach для каждого из node_ids: дети каждого родителя фильтруются один раз,
+        предки пересчитываются один раз."""
+        removed = set()
+        for nid in node_ids:
+            stack = [nid]
+            while stack:
+                x = stack.pop()
+                removed.add(x)
+                self._sums.pop(x, None)
+                self._counts.pop(x, None)
+                self._seen.pop(x, None)
+                stack.extend(self.nodes[x].children)
+        parents = dict.fromkeys(self.nodes[nid].parent_id for nid in node_ids)
+        parents.pop(None, None)
+        for pid in list(parents):
+            if pid in removed:
+                del parents[pid]
+                continue
+            parent = self.nodes[pid]
+            parent.children = [cid for cid in parent.children if cid not in removed]
+            self._sums.pop(pid, None)
+            self._counts.pop(pid, None)
+            for cid in parent.children:
+                self._add(pid, self.nodes[cid])
+        touched = self._refresh_upwards(parents)
+        self._check(touched)
+        return touched
+
+    # ----------------- Проверка -----------------
+    def verify(self, node_ids=None, rel_tol: float = 1e-9, abs_tol: float = 1e-9) -> List[str]:
+        """Сверяет кэш и значения родителей с пересчётом с нуля; возвращает список расхождений.
+
+        node_ids ограничивает проверку значений указанными узлами (по умолчанию — все родители).
+        """
+        problems = []
+        expected_counts = {}
+        expected_sums = {}
+        stack = [nid for nid, node in self.nodes.items() if node.parent_id is None]
+        while stack:
+            node = self.nodes[stack.pop()]
+            stack.extend(node.children)
+            if not node.children:
+                continue
+            sums = [0.0, 0.0, 0.0, 0.0]
+            for cid in node.children:
+                for i, v in enumerate(_values(self.nodes[cid])):
+                    sums[i] += v
+            expected_counts[node.id] = len(node.children)
+            expected_sums[node.id] = sums
+
+        if expected_counts != self._counts:
+            problems.append(f"количество детей: кэш {len(self._counts)} родителей, ожидалось {len(expected_counts)}")
+        for pid, sums in expected_sums.items():
+            cached = self._sums.get(pid)
+            if cached is None:
+                continue
+            for name, c, e in zip(FIELDS, cached, sums):
+                if not math.isclose(c, e, rel_tol=rel_tol, abs_tol=abs_tol):
+                    problems.append(f"узел {pid}: сумма {name} {c!r} != {e!r}")
+
+        for pid in (expected_sums if node_ids is None else node_ids):
+            if pid not in expected_sums:
+                continue
+            count = expected_counts[pid]
+            for name, v, s in zip(FIELDS, _values(self.nodes[pid]), expected_sums[pid]):
+                if not math.isclose(v, s / count, rel_tol=rel_tol, abs_tol=abs_tol):
+                    problems.append(f"узел {pid}: {name} {v!r} != {s / count!r}")
+        return problems
+
+    # ----------------- Внутреннее -----------------
+    def _add(self, parent_id, child: RiskNode):
+        vals = _values(child)
+        sums = self._sums.setdefault(parent_id, [0.0, 0.0, 0.0, 0.0])
+        for i in range(4):
+            sums[i] += vals[i]
+        self._counts[parent_id] = self._counts.get(parent_id, 0) + 1
+        self._seen[child.id] = vals
+
+    def _apply_mean(self, node: RiskNode):
+        sums = self._sums[node.id]
+        count = self._counts[node.id]
+        node.prob = sums[0] / count
+        node.loss_min = sums[1] / count
+        node.loss_max = sums[2] / count
+        node.severity = sums[3] / count
+
+    def _refresh_upwards(self, node_ids) -> List[int]:
+        """Пересчитывает узлы и всех их предков по одному разу — сначала самые глубокие."""
+        depth = {}
+        for nid in node_ids:
+            chain = []
+            while nid is not None and nid not in depth:
+                chain.append(nid)
+                nid = self.nodes[nid].parent_id
+            d = -1 if nid is None else depth[nid]
+            for x in reversed(chain):
+                d += 1
+                depth[x] = d
+        order = sorted(depth, key=depth.get, reverse=True)
+        for nid in order:
+            node = self.nodes[nid]
+            if self._counts.get(nid):
+                self._apply_mean(node)
+            if node.parent_id is None:
+                continue
+            new = _values(node)
+            old = self._seen[nid]
+            sums = self._sums[node.parent_id]
+            for i in range(4):
+                sums[i] += new[i] - old[i]
+            self._seen[nid] = new
+        return order
+
+    def _check(self, touched):
+        if not self.verify_each:
+            return
+        problems = self.verify(touched)
+        if problems:
+            raise RuntimeError("Кэш агрегатов расходится с пересчётом: " + "; ".join(problems[:5]))
@@ -1,8 +1,14 @@
 import tkinter as tk
 from tkinter import messagebox
+import perf
 from models import RiskNode
-from storage import save_nodes, load_nodes
-from report import generate_pdf, REPORTLAB_AVAILABLE
+from aggregate import RiskAggregator, column_store
+from metrics import sort_nodes, LeafTotals
+from saver import SaveScheduler
+from history import History
+from report_jobs import ReportJobs
+from storage import save_nodes, NodeLoader
+from report import generate_pdf, warm_up, REPORTLAB_AVAILABLE
 from ui import build_ui, _init_style
 from ui import (
     _refresh_tree,
@@ -17,7 +23,11 @@ from ui import (
     on_rename,
     on_delete,
     on_save_risk,
-    on_report
+    on_report,
+    on_import,
+    cancel_simulation,
+    toggle_perf_panel,
+    _poll_loading
 )
 
 
@@ -34,22 +44,51 @@ class RiskAnalyzerMagnitApp:
         # Инициализация стиля
         _init_style(self)
 
-        # Загрузка сохранённых узлов
-        self.nodes = load_nodes()
-        if not self.nodes:
+        # Загрузка сохранённых узлов — в фоне; окно строится, как только готовы корень
+        # и города, остальное дочитывается, а кэш сумм для пересчёта средних значений
+        # родителей и итоги по листьям строятся там же (до конца загрузки правки недоступны)
+        self.loader = NodeLoader(finish=_build_caches).start()
+        self.loader.first_levels.wait()
+        self.nodes = self.loader.nodes
+        if self.loader.error is not None and 1 not in self.nodes:
+            raise self.loader.error
+        if self.loader.done.is_set() and not self.nodes:
             # Если данных нет — создаём корневой узел
             root_node = RiskNode(id=1, name='ПАО "МАГНИТ"')
             self.nodes[1] = root_node
-
-        self.next_id = max(self.nodes.keys()) + 1
+        self.next_id = self.loader.max_id + 1
+        self.aggregator = None
+        self.leaf_totals = None
+        # Правки сохраняются в фоне, не чаще одного раза за окно
+        self.saver = SaveScheduler(window=0.5)
+        # История правок для Ctrl+Z / Ctrl+Y
+        self.history = History()
+        # Отчёты строятся в отдельных процессах
+        self.report_jobs = ReportJobs()
         self.selected_id = 1
 
         # Построение интерфейса
         build_ui(self)
+        _poll_loading(self)
+        # RISK_PERF=1 — замеры с самого запуска, включая вызовы Tk
+        if perf.is_enabled():
+            perf.count_tk(self.root)
 
         # Привязка хоткеев
         self._bind_shortcuts()
 
+        # Перед выходом дописываем несохранённые правки
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        # ReportLab и шрифты грузим в фоне, когда окно уже показано
+        self.root.after(300, warm_up)
+
+    def _on_close(self):
+        cancel_simulation(self)
+        self.report_jobs.shutdown()
+        self.saver.close()
+        self.root.destroy()
+
     def _bind_shortcuts(self):
         # ----------------- Горячие клавиши -----------------
 
@@ -60,6 +99,7 @@ class RiskAnalyzerMagnitApp:
         self.root.bind('<Control-Shift-Up>', lambda e: ui_on_move_up(self))
         self.root.bind('<Control-Shift-Down>', lambda e: ui_on_move_down(self))
         self.root.bind('<Control-n>', lambda e: on_add(self))
+        self.root.bind('<Control-i>', lambda e: on_import(self))
 
         # Работа с деревом
         self.root.bind('<F2>', lambda e: on_rename(self))
@@ -79,6 +119,12 @@ class RiskAnalyzerMagnitApp:
         # F1 → справка
         self.root.bind('<F1>', lambda e: show_help())
 
+        # Ctrl+F → строка поиска
+        self.root.bind('<Control-f>', lambda e: self.entry_search.focus_set())
+
+        # F12 → окно замеров производительности
+        self.root.bind('<F12>', lambda e: toggle_perf_panel(self))
+
     def _on_delete_key(self, event=None):
         # Используем уже существующую функцию удаления из ui.py
         from ui import on_delete
@@ -95,7 +141,7 @@ class RiskAnalyzerMagnitApp:
             new_node = RiskNode(id=new_id, name=node.name + " (копия)", parent_id=parent_id)
             app.nodes[new_id] = new_node
             if parent_id:
-                app.nodes[parent_id].children.append(new_id)
+                app.nodes[parent_id].append_child(new_id)
             for cid in node.children:
                 duplicate_rec(app.nodes[cid], new_id)
 
@@ -127,28 +173,20 @@ class RiskAnalyzerMagnitApp:
             # Сортировка перед генерацией PDF
             if sort_column:
                 reverse = sort_order == "Убыванию"
-
-                def get_key(n):
-                    mapping = {
-                        "#0": n.name.lower(),
-                        "Объект": n.name.lower(),
-                        "P": n.prob,
-                        "Lmin": n.loss_min,
-                        "Lmax": n.loss_max,
-                        "ExpectedMin": (n.prob or 0.0) * (n.loss_min or 0.0),
-                        "ExpectedMax": (n.prob or 0.0) * (n.loss_max or 0.0),
-                        "Severity": n.severity,
-                        "Risk": (n.prob or 0.0) * (n.severity or 1.0)
-                    }
-                    return mapping.get(sort_column, 0)
-
-                nodes_list.sort(key=get_key, reverse=reverse)
+                sort_key = "Объект" if sort_column == "#0" else sort_column
+                nodes_list = sort_nodes(nodes_list, sort_key, reverse)
 
             generate_pdf(nodes_list)
             messagebox.showinfo("Готово", "Файл risk_report_magnit.pdf успешно создан.")
         except Exception as e:
             messagebox.showerror("Ошибка", str(e))
 
+def _build_caches(nodes):
+    """Кэши, которые строятся в потоке загрузки: суммы для средних родителей и итоги по листьям
+    (у большого дерева — по одним и тем же колонкам NumPy)."""
+    columns = column_store(nodes)
+    return RiskAggregator(nodes, columns=columns), LeafTotals(nodes, columns)
+
 def show_help():
     messagebox.showinfo(
         "Справка по программе",
@@ -159,13 +197,17 @@ def show_help():
         "  - Delete      : Удалить узел\n"
         "  - Ctrl+D      : Дублировать узел\n"
         "  - Ctrl+Shift+Up/Down : Переместить узел вверх/вниз\n"
-        "  - Ctrl+N      : Добавить новый узел\n\n"
+        "  - Ctrl+N      : Добавить новый узел\n"
+        "  - Ctrl+I       : Импорт узлов из CSV/JSON\n\n"
         "Работа с деревом:\n"
-        "  - Стрелки   : Навигация по дереву\n\n"
+        "  - Стрелки   : Навигация по дереву\n"
+        "  - Ctrl+F      : Поиск (Enter — следующее, Shift+Enter — предыдущее)\n\n"
         "Отчёты и анализ:\n"
         "  - Ctrl+P      : Создать PDF отчёт\n"
         "  - Ctrl+Shift+R  : Пересчитать родителей\n\n"
         "Отмена/Повтор:\n"
         "  - Ctrl+Z      : Отмена действия\n"
-        "  - Ctrl+Y      : Повтор действия"
+        "  - Ctrl+Y      : Повтор действия\n\n"
+        "Отладка:\n"
+        "  - F12          : Замеры производительности"
     )
@@ -0,0 +1,437 @@
+"""Замеры производительности на синтетических деревьях и сравнение с прошлым замером.
+
+    python -m bench --sizes 1000 10000 100000 -o bench.json
+    python -m bench --sizes 1000 10000 100000 --baseline bench.json   # код возврата 1 при регрессии
+    python -m bench --sizes 1000000 --generate data/big.json          # только записать дерево
+
+Дерево строится как data/nodes.json: компания → «г.» города → магазины (адреса) →
+системы магазина, параметры родителей — средние по детям (RiskAggregator).
+Замеры Treeview идут в настоящем окне: нужен DISPLAY или Xvfb (он запускается сам).
+Запускать из корня проекта — отчёту нужны шрифты из fonts/.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import storage
+from models import RiskNode
+from aggregate import RiskAggregator
+from metrics import leaf_totals, sort_nodes
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+DEFAULT_REPEAT = 3
+# Относительное замедление, после которого замер считается регрессией, и минимальная
+# разница в секундах (короче — шум таймера)
+DEFAULT_TOLERANCE = 0.20
+MIN_DELTA = 0.005
+# PDF больших деревьев строится минутами — выше этого размера замер пропускается
+PDF_MAX_NODES = 100_000
+# Сколько листьев правится в замере recalc_tree_up
+RECALC_SAMPLES = 1000
+
+CITIES = [
+    "Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань", "Нижний Новгород", "Челябинск",
+    "Красноярск", "Самара", "Уфа", "Ростов-на-Дону", "Омск", "Краснодар", "Воронеж", "Пермь", "Волгоград",
+    "Саратов", "Тюмень", "Тольятти", "Барнаул", "Ижевск", "Махачкала", "Хабаровск", "Ульяновск", "Иркутск",
+    "Владивосток", "Ярославль", "Кемерово", "Томск", "Набережные Челны", "Севастополь", "Оренбург",
+    "Новокузнецк", "Балашиха", "Рязань", "Чебоксары", "Калининград", "Пенза", "Липецк", "Киров",
+    "Астрахань", "Тула", "Ставрополь", "Курск", "Улан-Удэ", "Сочи", "Тверь", "Магнитогорск", "Иваново",
+    "Брянск", "Белгород", "Сургут", "Владимир", "Чита", "Архангельск", "Нижний Тагил", "Калуга", "Смоленск",
+    "Волжский", "Курган", "Череповец", "Орёл", "Саранск", "Вологда", "Якутск", "Владикавказ", "Абакан",
+]
+STREETS = [
+    "ул. Ленина", "ул. Гагарина", "ул. Мира", "ул. Советская", "ул. Пушкина", "ул. Гоголя", "ул. Кирова",
+    "ул. Садовая", "ул. Молодёжная", "ул. Лесная", "ул. Школьная", "ул. Набережная", "ул. Победы",
+    "проспект Мира", "проспект Ленина", "проспект Победы", "Спортивный проезд", "Вокзальная магистраль",
+    "Волгоградский проспект", "Алтуфьевское шоссе", "Заводское шоссе", "бульвар Строителей",
+]
+SYSTEMS = [
+    "Кассовая зона", "Холодильное оборудование", "Видеонаблюдение", "Охранно-пожарная сигнализация",
+    "Склад", "Электроснабжение", "Вентиляция и кондиционирование", "IT-инфраструктура",
+]
+
+
+# ----------------- Генератор деревьев -----------------
+def generate_tree(size: int, seed: int = 0) -> Dict[int, RiskNode]:
+    """Дерево ровно из size узлов в форме data/nodes.json; системы магазинов — листья.
+
+    Городов ≈ size^0.4 (не меньше трёх), у магазина 4–8 систем; имена систем
+    повторяются во всех магазинах, как в реальной выгрузке.
+    """
+    rnd = random.Random(seed)
+    nodes = {1: RiskNode(id=1, name='ПАО "МАГНИТ"')}
+    if size <= 1:
+        return nodes
+    n_cities = max(1, min(size - 1, max(3, round(size ** 0.4))))
+    next_id = 2
+
+    def add(name, parent_id, leaf):
+        nonlocal next_id
+        node = RiskNode(id=next_id, name=name, parent_id=parent_id)
+        if leaf:
+            node.prob = round(rnd.uniform(0.01, 0.7), 3)
+            node.loss_min = rnd.randrange(5, 26) * 1000.0
+            node.loss_max = node.loss_min * rnd.randrange(3, 26)
+            node.severity = rnd.randrange(2, 11) / 2
+        nodes[next_id] = node
+        nodes[parent_id].append_child(next_id)
+        next_id += 1
+        return node.id
+
+    cities = []
+    for i in range(n_cities):
+        name = CITIES[i % len(CITIES)] + ("" if i < len(CITIES) else f"-{i // len(CITIES) + 1}")
+        cities.append(add(f"г. {name}", 1, leaf=False))
+    # Магазины с системами раскладываются по городам по кругу, пока не наберётся size
+    store = 0
+    while next_id <= size:
+        city = cities[store % n_cities]
+        store_id = add(f"{rnd.choice(STREETS)}, {rnd.randrange(1, 200)}", city, leaf=next_id + 1 > size)
+        for name in rnd.sample(SYSTEMS, rnd.randrange(4, 9)):
+            if next_id > size:
+                break
+            add(name, store_id, leaf=True)
+        store += 1
+    # Город без магазинов остаётся листом — даём ему параметры, как системе
+    for cid in cities:
+        if not nodes[cid].children:
+            nodes[cid].prob, nodes[cid].loss_min, nodes[cid].loss_max = 0.1, 5000.0, 50000.0
+    RiskAggregator(nodes).rebuild()
+    return nodes
+
+
+def write_tree(nodes: Dict[int, RiskNode], path: str):
+    """Дерево в nodes.json (формат storage) или в .snap (snapshot.py)."""
+    if path.endswith(".snap"):
+        from snapshot import write_snapshot
+        write_snapshot(nodes, path)
+    else:
+        from snapshot import write_json
+        write_json(nodes.values(), path)
+
+
+# ----------------- Замеры -----------------
+class Skip(Exception):
+    """Замер невозможен в этом окружении (нет библиотеки, дисплея или дерево слишком велико)."""
+
+
+def _timed(fn: Callable[[], object], repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return {"seconds": statistics.median(runs), "min": min(runs), "runs": runs}
+
+
+class _Context:
+    """Общие данные замеров одного размера: дерево, файлы во временном каталоге."""
+
+    def __init__(self, size: int, seed: int, workdir: str, repeat: int, pdf_max: int):
+        self.size = size
+        self.seed = seed
+        self.workdir = workdir
+        self.repeat = repeat
+        self.pdf_max = pdf_max
+        self.nodes = generate_tree(size, seed)
+        self.data_file = os.path.join(workdir, f"nodes_{size}.json")
+        storage.DATA_FILE = self.data_file
+        storage.BACKEND = "journal"
+        storage.save_nodes(self.nodes)
+
+
+def bench_load_nodes(ctx: _Context) -> dict:
+    return _timed(storage.load_nodes, ctx.repeat)
+
+
+def bench_save_nodes(ctx: _Context) -> dict:
+    return _timed(lambda: storage.save_nodes(ctx.nodes), ctx.repeat)
+
+
+def bench_recalc_tree_up(ctx: _Context) -> dict:
+    """Правка листа и пересчёт предков (recalc_tree_up) — время одной правки."""
+    aggregator = RiskAggregator(ctx.nodes)
+    rnd = random.Random(ctx.seed)
+    leaves = [node for node in ctx.nodes.values() if not node.children and node.parent_id is not None]
+    sample = [rnd.choice(leaves) for _ in range(min(RECALC_SAMPLES, len(leaves)))]
+
+    def run():
+        for leaf in sample:
+            leaf.prob = round(1.0 - leaf.prob, 3)
+            aggregator.refresh(leaf.id)
+
+    result = _timed(run, ctx.repeat)
+    for key in ("seconds", "min"):
+        result[key] /= max(len(sample), 1)
+    result["runs"] = [t / max(len(sample), 1) for t in result["runs"]]
+    result["per"] = "правка"
+    return result
+
+
+def bench_recalc_parents_only(ctx: _Context) -> dict:
+    """Полный пересчёт родителей (модельная часть _recalc_parents_only)."""
+    aggregator = RiskAggregator(ctx.nodes)
+    return _timed(aggregator.rebuild, ctx.repeat)
+
+
+def bench_leaf_totals(ctx: _Context) -> dict:
+    return _timed(lambda: leaf_totals(ctx.nodes), ctx.repeat)
+
+
+def bench_sort_nodes(ctx: _Context) -> dict:
+    nodes_list = list(ctx.nodes.values())
+    return _timed(lambda: sort_nodes(nodes_list, "Risk", True), ctx.repeat)
+
+
+def bench_generate_pdf(ctx: _Context) -> dict:
+    from report import generate_pdf, REPORTLAB_AVAILABLE
+    if not REPORTLAB_AVAILABLE:
+        raise Skip("ReportLab не установлен")
+    if ctx.size > ctx.pdf_max:
+        raise Skip(f"дерево больше {ctx.pdf_max} узлов (--pdf-max)")
+    nodes_list = sort_nodes(list(ctx.nodes.values()), "Risk", True)
+    filename = os.path.join(ctx.workdir, "report.pdf")
+    return _timed(lambda: generate_pdf(nodes_list, sort_column="Риск", sort_order="Убыванию", filename=filename),
+                  ctx.repeat)
+
+
+@contextlib.contextmanager
+def virtual_display():
+    """DISPLAY для Tk: текущий, а если его нет — временный Xvfb."""
+    if os.environ.get("DISPLAY"):
+        yield os.environ["DISPLAY"]
+        return
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        raise Skip("нет DISPLAY и Xvfb")
+    number = next((n for n in range(99, 200) if not os.path.exists(f"/tmp/.X11-unix/X{n}")), None)
+    if number is None:
+        raise Skip("нет свободного номера дисплея для Xvfb")
+    proc = subprocess.Popen([xvfb, f":{number}", "-screen", "0", "1600x1200x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while not os.path.exists(f"/tmp/.X11-unix/X{number}"):
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise Skip("Xvfb не запустился")
+            time.sleep(0.05)
+        os.environ["DISPLAY"] = f":{number}"
+        yield os.environ["DISPLAY"]
+    finally:
+        os.environ.pop("DISPLAY", None)
+        proc.terminate()
+        proc.wait()
+
+
+def bench_treeview(ctx: _Context) -> Dict[str, dict]:
+    """Окно приложения на дереве ctx: первый показ, полная загрузка, перестройка и пересчёт дерева."""
+    try:
+        import tkinter as tk
+    except ImportError:
+        raise Skip("tkinter не установлен")
+    results = {}
+    with virtual_display():
+        from app import RiskAnalyzerMagnitApp
+        from ui import _refresh_tree, _recalc_parents_only, _materialize_children
+        root = tk.Tk()
+        start = time.perf_counter()
+        app = RiskAnalyzerMagnitApp(root)
+        root.update()
+        results["treeview_first_paint"] = {"seconds": time.perf_counter() - start}
+        while app.loader is not None and not app.loader.error:
+            root.update()
+            time.sleep(0.01)
+        results["treeview_loaded"] = {"seconds": time.perf_counter() - start}
+        try:
+            # Раскрыты корень и все города — как при обычной работе с деревом
+            for nid in [1] + list(app.nodes[1].children):
+                item = app.id_to_item[nid]
+                _materialize_children(app, item)
+                app.tree.item(item, open=True)
+
+            def refresh():
+                _refresh_tree(app)
+                root.update()
+
+            def recalc():
+                _recalc_parents_only(app)
+                root.update()
+
+            results["treeview_refresh"] = _timed(refresh, ctx.repeat)
+            results["treeview_recalc"] = _timed(recalc, ctx.repeat)
+        finally:
+            app._on_close()
+    return results
+
+
+BENCHMARKS = {
+    "load_nodes": bench_load_nodes,
+    "save_nodes": bench_save_nodes,
+    "recalc_tree_up": bench_recalc_tree_up,
+    "recalc_parents_only": bench_recalc_parents_only,
+    "leaf_totals": bench_leaf_totals,
+    "sort_nodes": bench_sort_nodes,
+    "generate_pdf": bench_generate_pdf,
+    "treeview": bench_treeview,
+}
+# Замеры, которые возвращают сразу несколько результатов
+_SEVERAL = {"treeview": ("treeview_first_paint", "treeview_loaded", "treeview_refresh", "treeview_recalc")}
+
+
+def run(sizes=DEFAULT_SIZES, only: Optional[List[str]] = None, repeat: int = DEFAULT_REPEAT, seed: int = 0,
+        pdf_max: int = PDF_MAX_NODES, log=None) -> dict:
+    """Все замеры для каждого размера; результат — словарь для JSON (см. compare)."""
+    log = log or (lambda *a: None)
+    names = only or list(BENCHMARKS)
+    results = {}
+    saved = storage.DATA_FILE, storage.BACKEND
+    try:
+        for size in sizes:
+            with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+                ctx = _Context(size, seed, workdir, repeat, pdf_max)
+                by_name = results[str(size)] = {}
+                for name in names:
+                    try:
+                        result = BENCHMARKS[name](ctx)
+                    except Skip as e:
+                        result = {"skipped": str(e)}
+                        if name in _SEVERAL:
+                            result = {key: dict(result) for key in _SEVERAL[name]}
+                    measured = result if name in _SEVERAL else {name: result}
+                    by_name.update(measured)
+                    for key, value in measured.items():
+                        log(f"{size:>9} {key:<22} " + (f"{value['seconds']:.6f} с" if "seconds" in value
+                                                         else f"пропущено: {value['skipped']}"))
+    finally:
+        storage.DATA_FILE, storage.BACKEND = saved
+    return {"meta": _meta(repeat, seed), "results": results}
+
+
+def _meta(repeat: int, seed: int) -> dict:
+    import importlib.util
+    commit = None
+    with contextlib.suppress(OSError, subprocess.SubprocessError):
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=5).stdout.strip() or None
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": importlib.util.find_spec("numpy") is not None,
+        "reportlab": importlib.util.find_spec("reportlab") is not None,
+        "repeat": repeat,
+        "seed": seed,
+    }
+
+
+# ----------------- Сравнение с базовым замером -----------------
+def compare(current: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE,
+            min_delta: float = MIN_DELTA) -> List[dict]:
+    """Строки сравнения по (размер, замер): status — ok / regression / faster / new / skipped.
+
+    Сравнивается лучший из повторов (min) — он меньше всего зависит от фоновой
+    нагрузки; регрессия — рост больше чем на tolerance и больше чем на min_delta секунд.
+    """
+    rows = []
+    base_results = baseline.get("results", {})
+    for size, by_name in current.get("results", {}).items():
+        for name, result in by_name.items():
+            base = base_results.get(size, {}).get(name)
+            row = {"size": int(size), "name": name, "seconds": _best(result),
+                   "baseline": _best(base) if base else None, "ratio": None}
+            if row["seconds"] is None:
+                row["status"] = "skipped"
+            elif row["baseline"] is None:
+                row["status"] = "new"
+            else:
+                row["ratio"] = row["seconds"] / row["baseline"] if row["baseline"] > 0 else float("inf")
+                delta = row["seconds"] - row["baseline"]
+                if delta > min_delta and row["ratio"] > 1 + tolerance:
+                    row["status"] = "regression"
+                elif -delta > min_delta and row["ratio"] < 1 / (1 + tolerance):
+                    row["status"] = "faster"
+                else:
+                    row["status"] = "ok"
+            rows.append(row)
+    return rows
+
+
+def _best(result: dict) -> Optional[float]:
+    return result.get("min", result.get("seconds"))
+
+
+def format_comparison(rows: List[dict]) -> str:
+    marks = {"regression": "РЕГРЕССИЯ", "faster": "быстрее", "ok": "", "new": "нет в базе", "skipped": "пропущено"}
+    lines = [f"{'узлов':>9} {'замер':<22} {'база, с':>11} {'сейчас, с':>11} {'×':>7}"]
+    for row in rows:
+        base = f"{row['baseline']:.6f}" if row["baseline"] is not None else "—"
+        cur = f"{row['seconds']:.6f}" if row["seconds"] is not None else "—"
+        ratio = f"{row['ratio']:.2f}" if row["ratio"] is not None else ""
+        lines.append(f"{row['size']:>9} {row['name']:<22} {base:>11} {cur:>11} {ratio:>7}  {marks[row['status']]}")
+    return "\n".join(lines)
+
+
+# ----------------- Командная строка -----------------
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench",
+                                     description="Замеры производительности риск-анализатора на синтетических деревьях.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="размеры деревьев в узлах (по умолчанию 1000 10000 100000)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="только эти замеры")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"повторов каждого замера, в результат идёт медиана (по умолчанию {DEFAULT_REPEAT})")
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора деревьев")
+    parser.add_argument("--pdf-max", type=int, default=PDF_MAX_NODES,
+                        help=f"не строить PDF для деревьев больше (по умолчанию {PDF_MAX_NODES})")
+    parser.add_argument("-o", "--output", help="записать результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого замера: сравнить и вернуть 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"допустимое замедление, доля (по умолчанию {DEFAULT_TOLERANCE})")
+    parser.add_argument("--generate", metavar="FILE",
+                        help="только записать дерево первого из --sizes в FILE (.json или .snap) и выйти")
+    parser.add_argument("-q", "--quiet", action="store_true", help="не печатать ход замеров")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    log = (lambda *a: None) if args.quiet else (lambda *a: print(*a, file=sys.stderr))
+    if args.generate:
+        write_tree(generate_tree(args.sizes[0], args.seed), args.generate)
+        log(f"Записано дерево из {args.sizes[0]} узлов: {args.generate}")
+        return 0
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    current = run(args.sizes, args.only, args.repeat, args.seed, args.pdf_max, log)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        log(f"Результаты: {args.output}")
+    if baseline is None:
+        return 0
+    rows = compare(current, baseline, args.tolerance)
+    print(format_comparison(rows))
+    regressions = [row for row in rows if row["status"] == "regression"]
+    if regressions:
+        print(f"Регрессий: {len(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""Запуск без графического интерфейса: пересчёт и отчёт по файлу узлов.
+
+    python -m cli data/nodes.json --recalc --sort Риск --order Убыванию -o data/report.pdf
+    python -m cli data/nodes.snap --total -o data/report.pdf   # снимок не разворачивается целиком
+
+Модуль не импортирует tkinter, поэтому работает на сервере без X.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict
+
+import storage
+from models import RiskNode
+from aggregate import RiskAggregator, column_store
+from metrics import UI_TO_KEY, sort_nodes, LeafTotals
+from snapshot import NUMPY_AVAILABLE as SNAPSHOT_COLUMNS
+from report_cache import REPORT_CACHE_DIR
+from simulation import DEFAULT_SCENARIOS
+
+SORT_ORDERS = ["Возрастанию", "Убыванию"]
+FORMATS = ["pdf", "json", "csv", "xlsx", "parquet", "snap"]
+
+
+# ----------------- Загрузка -----------------
+def load_file(path: str) -> Dict[int, RiskNode]:
+    """Узлы из nodes.json (вместе с журналом правок рядом), из базы SQLite (.db) или двоичного снимка (.snap)."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Файл не найден: {path}")
+    if path.endswith(".snap"):
+        from snapshot import Snapshot
+        with Snapshot(path) as snap:
+            return snap.to_nodes()
+    if path.endswith(".db"):
+        from storage_sqlite import SQLiteStorage
+        db = SQLiteStorage(path)
+        try:
+            return db.load_nodes()
+        finally:
+            db.close()
+    storage.DATA_FILE = path
+    return storage.load_nodes()
+
+
+def _reads_columns(args, outputs) -> bool:
+    """Снимок можно не разворачивать в узлы: нужны только итоги и PDF (без пересчёта и моделирования)."""
+    return (args.nodes.endswith(".snap") and SNAPSHOT_COLUMNS and os.path.exists(args.nodes)
+            and not (args.recalc or args.save or args.scenarios)
+            and all(fmt == "pdf" for _, fmt in outputs))
+
+
+def report_nodes(snap) -> Dict[int, RiskNode]:
+    """Узлы, которые попадут в PDF, — города (названия «г.») и их дети — по колонкам снимка.
+
+    Собираются только эти узлы, по возрастанию id, как в load_file: сортировка
+    и таблицы отчёта выходят те же, что по всему дереву.
+    """
+    import numpy as np
+    cities = snap.rows_with_name_prefix("г.")
+    objects = np.nonzero(np.isin(snap.column("parent_id"), snap.column("id")[cities]))[0]
+    return {node.id: node for node in map(snap.node, np.union1d(cities, objects).tolist())}
+
+
+# ----------------- Вывод -----------------
+def write_pdf(nodes: Dict[int, RiskNode], filename: str, sort_column: str, sort_order: str,
+              workers: int = 1, cache_dir: str = None, simulation=None, large=None):
+    from report import generate_pdf, generate_pdf_parallel, generate_pdf_cached, REPORTLAB_AVAILABLE
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("ReportLab не установлен")
+    # Как в on_report: в отчёт идут все узлы, заранее отсортированные по выбранному столбцу
+    nodes_list = sort_nodes(list(nodes.values()), UI_TO_KEY[sort_column], sort_order == "Убыванию")
+    if cache_dir:
+        from report_cache import ReportCache
+        # Документ верстается целиком в этом процессе — workers здесь не используется
+        generate_pdf_cached(nodes_list, sort_column=sort_column, sort_order=sort_order, filename=filename,
+                            large=large, cache=ReportCache(cache_dir), simulation=simulation)
+    elif workers != 1:
+        generate_pdf_parallel(nodes_list, sort_column=sort_column, sort_order=sort_order,
+                              filename=filename, large=large, workers=workers or None, simulation=simulation)
+    else:
+        generate_pdf(nodes_list, sort_column=sort_column, sort_order=sort_order, filename=filename,
+                     large=large, simulation=simulation)
+
+
+def write_json(nodes: Dict[int, RiskNode], filename: str, sort_column: str, sort_order: str, **options):
+    # Тот же формат, что и data/nodes.json — файл можно открыть в программе
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({nid: storage.node_to_dict(node) for nid, node in nodes.items()},
+                  f, ensure_ascii=False, indent=4)
+
+
+def write_snap(nodes: Dict[int, RiskNode], filename: str, sort_column: str, sort_order: str, **options):
+    from snapshot import write_snapshot
+    write_snapshot(nodes, filename)
+
+
+def write_table(fmt: str):
+    """Выгрузка таблицы рисков (см. export.py) — строки идут потоком, без промежуточного списка."""
+    def write(nodes: Dict[int, RiskNode], filename: str, sort_column: str, sort_order: str, **options):
+        from export import export_table
+        nodes_list = sort_nodes(list(nodes.values()), UI_TO_KEY[sort_column], sort_order == "Убыванию")
+        export_table(nodes_list, filename, fmt)
+    return write
+
+
+WRITERS = {
+    "pdf": write_pdf,
+    "json": write_json,
+    "csv": write_table("csv"),
+    "xlsx": write_table("xlsx"),
+    "parquet": write_table("parquet"),
+    "snap": write_snap,
+}
+
+
+def _format_of(path: str, fmt: str = None) -> str:
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext not in WRITERS:
+        raise ValueError(f"Не удалось определить формат по имени файла: {path} (укажите --format)")
+    return ext
+
+
+# ----------------- Командная строка -----------------
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m cli",
+        description="Риск-анализатор ПАО «МАГНИТ» без графического интерфейса: пересчёт и отчёты.")
+    parser.add_argument("nodes", nargs="?", default=storage.DATA_FILE,
+                        help=f"файл узлов: .json (с журналом правок), .db или .snap (по умолчанию {storage.DATA_FILE})")
+    parser.add_argument("--recalc", action="store_true",
+                        help="пересчитать все родительские узлы как средние по детям")
+    parser.add_argument("--sort", dest="sort_column", default="Риск", choices=list(UI_TO_KEY),
+                        help="столбец сортировки (как в интерфейсе, по умолчанию «Риск»)")
+    parser.add_argument("--order", dest="sort_order", default="Убыванию", choices=SORT_ORDERS,
+                        help="порядок сортировки (по умолчанию «Убыванию»)")
+    parser.add_argument("-o", "--output", action="append", default=[],
+                        help="куда записать результат; можно указать несколько раз")
+    parser.add_argument("-f", "--format", choices=FORMATS,
+                        help="формат вывода (по умолчанию — по расширению файла)")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="число процессов для сборки PDF по частям (0 — по числу ядер, по умолчанию 1)")
+    parser.add_argument("--cache", dest="cache_dir", nargs="?", const=REPORT_CACHE_DIR,
+                        help="строить заново только таблицы PDF изменившихся городов, готовые брать из кэша; "
+                             f"документ верстается целиком, без -j (каталог, по умолчанию {REPORT_CACHE_DIR})")
+    parser.add_argument("--simulate", dest="scenarios", type=int, nargs="?", const=DEFAULT_SCENARIOS,
+                        help="смоделировать потери методом Монте-Карло и добавить VaR/CVaR в PDF "
+                             f"(число сценариев, по умолчанию {DEFAULT_SCENARIOS})")
+    parser.add_argument("--seed", type=int, default=0, help="seed моделирования (по умолчанию 0)")
+    parser.add_argument("--total", action="store_true",
+                        help="напечатать суммы ожидаемых потерь по листьям (ΣLower/ΣUpper), как в окне программы")
+    parser.add_argument("--save", action="store_true",
+                        help="записать пересчитанные значения обратно в файл узлов")
+    parser.add_argument("-q", "--quiet", action="store_true", help="не печатать ход работы")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    log = (lambda *a: None) if args.quiet else (lambda *a: print(*a, file=sys.stderr))
+
+    try:
+        outputs = [(path, _format_of(path, args.format)) for path in args.output]
+        if _reads_columns(args, outputs):
+            return _main_columns(args, outputs, log)
+        start = time.perf_counter()
+        nodes = load_file(args.nodes)
+        log(f"Загружено узлов: {len(nodes)} ({time.perf_counter() - start:.2f} с)")
+
+        if args.recalc:
+            start = time.perf_counter()
+            columns = column_store(nodes)  # у большого дерева колонки строятся один раз на оба прохода
+            touched = RiskAggregator(nodes, columns=columns).rebuild(columns)
+            log(f"Пересчитано родителей: {len(touched)} ({time.perf_counter() - start:.2f} с)")
+
+        if args.save:
+            if args.nodes.endswith(".db"):
+                from storage_sqlite import SQLiteStorage
+                db = SQLiteStorage(args.nodes)
+                try:
+                    db.replace_all(nodes)
+                finally:
+                    db.close()
+            elif args.nodes.endswith(".snap"):
+                from snapshot import write_snapshot
+                write_snapshot(nodes, args.nodes)
+            else:
+                storage.save_nodes(nodes)
+            log(f"Сохранено: {args.nodes}")
+
+        simulation = None
+        if args.scenarios:
+            from simulation import simulate_nodes
+            start = time.perf_counter()
+            simulation = simulate_nodes(nodes, args.scenarios, seed=args.seed, workers=args.workers or None)
+            for q, var, cvar in zip(simulation.quantiles, simulation.total.var, simulation.total.cvar):
+                log(f"VaR {q:.0%}: {var:.2f} руб., CVaR {q:.0%}: {cvar:.2f} руб.")
+            log(f"Смоделировано сценариев: {simulation.scenarios} ({time.perf_counter() - start:.2f} с)")
+
+        for path, fmt in outputs:
+            start = time.perf_counter()
+            WRITERS[fmt](nodes, path, args.sort_column, args.sort_order,
+                         workers=args.workers, cache_dir=args.cache_dir, simulation=simulation)
+            log(f"Записан {fmt}: {path} ({time.perf_counter() - start:.2f} с)")
+
+        if args.total:
+            _print_total(*LeafTotals(nodes).totals())
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _main_columns(args, outputs, log) -> int:
+    """main для снимка, который не нужно разворачивать: итоги — по колонкам, в PDF — только его узлы."""
+    from snapshot import Snapshot
+    from report import LARGE_REPORT_ROWS
+    start = time.perf_counter()
+    with Snapshot(args.nodes) as snap:
+        log(f"Открыт снимок: {len(snap)} узлов ({time.perf_counter() - start:.3f} с)")
+        if outputs:
+            start = time.perf_counter()
+            nodes = report_nodes(snap)
+            log(f"Узлов для отчёта: {len(nodes)} ({time.perf_counter() - start:.2f} с)")
+            # режим больших отчётов — по размеру всего дерева, как при полной загрузке
+            large = len(snap) >= LARGE_REPORT_ROWS
+            for path, fmt in outputs:
+                start = time.perf_counter()
+                write_pdf(nodes, path, args.sort_column, args.sort_order,
+                          workers=args.workers, cache_dir=args.cache_dir, large=large)
+                log(f"Записан {fmt}: {path} ({time.perf_counter() - start:.2f} с)")
+        if args.total:
+            _print_total(*snap.leaf_totals())
+    return 0
+
+
+def _print_total(lower: float, upper: float):
+    print(f"ΣLower: {lower:.2f} руб.\nΣUpper: {upper:.2f} руб.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
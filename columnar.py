@@ -0,0 +1,111 @@
+from typing import Dict, Iterable, List
+from models import RiskNode
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+class ColumnarStore:
+    """Параметры узлов в виде колонок (struct-of-arrays) для полного пересчёта дерева.
+
+    Строки идут в порядке переданных узлов. Хранит непрерывные float64-колонки
+    prob/loss_min/loss_max/severity, индекс строки родителя (-1 — нет родителя)
+    и детей в формате CSR: дети строки i — child_idx[child_ptr[i]:child_ptr[i + 1]].
+    Словарь RiskNode остаётся основным хранилищем: колонки строятся на время
+    полного пересчёта или загрузки (aggregate.column_store) — по ним считаются
+    средние родителей (записываются обратно в узлы), кэш сумм агрегатора и итоги
+    по листьям (metrics.LeafTotals).
+    """
+
+    def __init__(self, nodes: Iterable[RiskNode]):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy не установлен")
+        nodes = nodes if isinstance(nodes, list) else list(nodes)
+        n = len(nodes)
+        self.size = n
+        self.ids = np.fromiter((node.id for node in nodes), dtype=np.int64, count=n)
+        self.prob = np.fromiter((node.prob or 0.0 for node in nodes), dtype=np.float64, count=n)
+        self.loss_min = np.fromiter((node.loss_min or 0.0 for node in nodes), dtype=np.float64, count=n)
+        self.loss_max = np.fromiter((node.loss_max or 0.0 for node in nodes), dtype=np.float64, count=n)
+        self.severity = np.fromiter((node.severity or 1.0 for node in nodes), dtype=np.float64, count=n)
+        parent_ids = np.fromiter((-1 if node.parent_id is None else node.parent_id for node in nodes),
+                                 dtype=np.int64, count=n)
+        self._names = [node.name for node in nodes]
+
+        # id родителя -> номер строки через бинарный поиск по отсортированным id
+        order = np.argsort(self.ids, kind="stable")
+        sorted_ids = self.ids[order]
+        pos = np.searchsorted(sorted_ids, parent_ids)
+        pos = np.minimum(pos, max(n - 1, 0))
+        found = (parent_ids >= 0) & (sorted_ids[pos] == parent_ids)
+        self.parent = np.where(found, order[pos], -1)
+
+        # CSR: дети сгруппированы по строке родителя
+        has_parent = self.parent >= 0
+        child_rows = np.nonzero(has_parent)[0]
+        self.child_idx = child_rows[np.argsort(self.parent[child_rows], kind="stable")]
+        self.child_count = np.bincount(self.parent[child_rows], minlength=n)
+        self.child_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.child_count, out=self.child_ptr[1:])
+
+    def children(self, row: int):
+        return self.child_idx[self.child_ptr[row]:self.child_ptr[row + 1]]
+
+    # ----------------- Агрегация -----------------
+    def depth(self):
+        depth = np.zeros(self.size, dtype=np.int64)
+        cur = self.parent.copy()
+        while True:
+            alive = cur >= 0
+            if not alive.any():
+                return depth
+            depth[alive] += 1
+            cur[alive] = self.parent[cur[alive]]
+
+    def rollup(self) -> "np.ndarray":
+        """Средние значения детей для всех родителей — по уровню за раз, от самых глубоких.
+
+        Возвращает строки, значения которых были пересчитаны.
+        """
+        depth = self.depth()
+        counts = self.child_count.astype(np.float64)
+        for d in range(int(depth.max(initial=0)), 0, -1):
+            rows = np.nonzero(depth == d)[0]
+            targets, slot = np.unique(self.parent[rows], return_inverse=True)
+            for col in (self.prob, self.loss_min, self.loss_max, self.severity):
+                sums = np.bincount(slot, weights=col[rows], minlength=len(targets))
+                col[targets] = sums / counts[targets]
+        return np.nonzero(self.child_count)[0]
+
+    def write_back(self, nodes: Dict[int, RiskNode], rows=None) -> List[int]:
+        """Записывает значения строк (по умолчанию — всех родителей) обратно в RiskNode."""
+        if rows is None:
+            rows = np.nonzero(self.child_count)[0]
+        ids = self.ids[rows].tolist()
+        for nid, p, lmin, lmax, s in zip(ids, self.prob[rows].tolist(), self.loss_min[rows].tolist(),
+                                         self.loss_max[rows].tolist(), self.severity[rows].tolist()):
+            node = nodes[nid]
+            node.prob, node.loss_min, node.loss_max, node.severity = p, lmin, lmax, s
+        return ids
+
+    def leaf_expected(self, size: int):
+        """Ожидаемые мин./макс. потери листьев по id: два float64-массива длины size
+        (у родителей и отсутствующих id — ноль)."""
+        leaf = self.child_count == 0
+        ids = self.ids[leaf]
+        lower = np.zeros(size)
+        upper = np.zeros(size)
+        lower[ids] = self.prob[leaf] * self.loss_min[leaf]
+        upper[ids] = self.prob[leaf] * self.loss_max[leaf]
+        return lower, upper
+
+    def parent_sums(self):
+        """Суммы колонок по детям каждого родителя: (строки родителей, [4 массива сумм], число детей)."""
+        child = self.parent >= 0
+        rows = np.nonzero(self.child_count)[0]
+        sums = [np.bincount(self.parent[child], weights=col[child], minlength=self.size)[rows]
+                for col in (self.prob, self.loss_min, self.loss_max, self.severity)]
+        return rows, sums, self.child_count[rows]
@@ -0,0 +1,163 @@
+import csv
+import importlib.util
+import os
+from typing import Dict, Iterator, List, Optional
+from models import RiskNode
+
+# Необязательные библиотеки для XLSX и Parquet
+OPENPYXL_AVAILABLE = importlib.util.find_spec("openpyxl") is not None
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Колонки выгрузки: группировка как в отчёте, затем те же показатели, что в таблицах PDF
+EXPORT_COLUMNS = ["Таблица", "Город", "Путь", "Родитель", "Объект",
+                  "P", "Lmin", "Lmax", "ExpectedMin", "ExpectedMax", "Severity", "Risk"]
+
+# Разделитель уровней в колонке «Путь»
+PATH_SEP = " / "
+
+# Строк в одном пакете Parquet и на одном листе XLSX (предел Excel — 1 048 576 вместе с заголовком)
+PARQUET_BATCH_ROWS = 65536
+XLSX_SHEET_ROWS = 1048575
+
+# Прогресс сообщается раз в столько строк
+PROGRESS_EVERY = 10000
+
+
+# ----------------- Строки -----------------
+def iter_rows(nodes: List[RiskNode]) -> Iterator[tuple]:
+    """Строки выгрузки в порядке отчёта generate_pdf.
+
+    nodes — все узлы, уже отсортированные по выбранному столбцу (как для
+    generate_pdf). Сначала идут города (таблица 1), затем объекты каждого города
+    (таблицы 2, 3, …). Строки создаются по одной и нигде не накапливаются.
+    """
+    by_id: Dict[int, RiskNode] = {n.id: n for n in nodes}
+    paths: Dict[int, str] = {}
+
+    def path_of(node: RiskNode) -> str:
+        # Пути родителей запоминаются — у объектов одного города они общие
+        parent = by_id.get(node.parent_id)
+        if parent is None:
+            return node.name
+        prefix = paths.get(parent.id)
+        if prefix is None:
+            prefix = paths[parent.id] = path_of(parent)
+        return prefix + PATH_SEP + node.name
+
+    def row(table_no, city, node):
+        prob = node.prob or 0.0
+        parent = by_id.get(node.parent_id)
+        return (table_no, city.name if city else "", path_of(node), parent.name if parent else "", node.name,
+                node.prob, node.loss_min, node.loss_max,
+                prob * (node.loss_min or 0.0), prob * (node.loss_max or 0.0),
+                node.severity, prob * (node.severity or 1.0))
+
+    cities = [n for n in nodes if n.name.startswith("г.")]
+    for city in cities:
+        yield row(1, None, city)
+
+    # Объекты города — в порядке списка; храним только ссылки на узлы
+    objects_of = {city.id: [] for city in cities}
+    for n in nodes:
+        if n.parent_id in objects_of:
+            objects_of[n.parent_id].append(n)
+    table_no = 2
+    for city in cities:
+        objects = objects_of.pop(city.id)
+        if not objects:
+            continue
+        for obj in objects:
+            yield row(table_no, city, obj)
+        table_no += 1
+
+
+def _counted(rows: Iterator[tuple], progress) -> Iterator[tuple]:
+    count = 0
+    for count, r in enumerate(rows, start=1):
+        if progress is not None and count % PROGRESS_EVERY == 0:
+            progress(count)
+        yield r
+    if progress is not None:
+        progress(count)
+
+
+# ----------------- Форматы -----------------
+def write_csv(rows: Iterator[tuple], filename: str):
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        writer.writerows(rows)
+
+
+def write_xlsx(rows: Iterator[tuple], filename: str):
+    """XLSX в потоковом режиме openpyxl; при переполнении листа продолжаем на следующем."""
+    if not OPENPYXL_AVAILABLE:
+        raise RuntimeError("openpyxl не установлен (pip install openpyxl)")
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = None
+    sheet_rows = XLSX_SHEET_ROWS
+    for r in rows:
+        if sheet_rows >= XLSX_SHEET_ROWS:
+            ws = wb.create_sheet(title=f"Риски {len(wb.worksheets) + 1}" if wb.worksheets else "Риски")
+            ws.append(EXPORT_COLUMNS)
+            sheet_rows = 0
+        ws.append(r)
+        sheet_rows += 1
+    if ws is None:
+        wb.create_sheet(title="Риски").append(EXPORT_COLUMNS)
+    wb.save(filename)
+
+
+def write_parquet(rows: Iterator[tuple], filename: str):
+    """Parquet пакетами по PARQUET_BATCH_ROWS строк — в памяти не больше одного пакета."""
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("pyarrow не установлен (pip install pyarrow)")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([("Таблица", pa.int32())]
+                       + [(name, pa.string()) for name in EXPORT_COLUMNS[1:5]]
+                       + [(name, pa.float64()) for name in EXPORT_COLUMNS[5:]])
+    with pq.ParquetWriter(filename, schema) as writer:
+        batch = []
+        for r in rows:
+            batch.append(r)
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(zip(*batch), schema)], schema=schema))
+                batch = []
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(zip(*batch), schema)], schema=schema))
+
+
+WRITERS = {
+    "csv": write_csv,
+    "xlsx": write_xlsx,
+    "parquet": write_parquet,
+}
+
+
+def format_of(filename: str) -> Optional[str]:
+    """Формат по расширению файла (None, если выгрузка в такой формат не поддерживается)."""
+    ext = os.path.splitext(filename)[1].lower().lstrip(".")
+    return ext if ext in WRITERS else None
+
+
+def export_table(nodes: List[RiskNode], filename: str, fmt: Optional[str] = None, progress=None) -> str:
+    """Выгружает таблицу рисков в CSV/XLSX/Parquet; возвращает использованный формат.
+
+    nodes — отсортированный список, как для generate_pdf. progress(rows_done)
+    вызывается каждые PROGRESS_EVERY строк. Файл подменяется целиком после записи.
+    """
+    fmt = fmt or format_of(filename)
+    if fmt not in WRITERS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt or filename}")
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        WRITERS[fmt](_counted(iter_rows(nodes), progress), tmp)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return fmt
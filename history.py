@@ -0,0 +1,232 @@
+from collections import deque
+from typing import List, Optional, Tuple
+from models import RiskNode, ChangeSet
+
+# По умолчанию история правок занимает не больше стольких байт (оценка)
+HISTORY_MAX_BYTES = 16 * 1024 * 1024
+
+# Грубая оценка памяти: объект команды и одна запись узла поддерева
+_COMMAND_BYTES = 200
+_RECORD_BYTES = 400
+
+
+# ----------------- Команды -----------------
+# Каждая команда хранит только разницу (старые/новые значения, удалённое поддерево,
+# позицию среди братьев). apply() выполняет правку, revert() — обратную; обе
+# проходят через app.aggregator и возвращают ChangeSet для точечного обновления дерева.
+
+class EditParams:
+    """Изменение параметров риска одного узла."""
+
+    def __init__(self, node_id: int, old: Tuple[float, ...], new: Tuple[float, ...]):
+        self.node_id = node_id
+        self.old = old
+        self.new = new
+        self.size = _COMMAND_BYTES
+
+    def apply(self, app) -> ChangeSet:
+        return self._set(app, self.new)
+
+    def revert(self, app) -> ChangeSet:
+        return self._set(app, self.old)
+
+    def _set(self, app, values) -> ChangeSet:
+        node = app.nodes[self.node_id]
+        node.prob, node.loss_min, node.loss_max, node.severity = values
+        return ChangeSet(updated=app.aggregator.refresh(self.node_id))
+
+
+class Rename:
+    """Переименование узла."""
+
+    def __init__(self, node_id: int, old: str, new: str):
+        self.node_id = node_id
+        self.old = old
+        self.new = new
+        self.size = _COMMAND_BYTES + 2 * (len(old) + len(new))
+
+    def apply(self, app) -> ChangeSet:
+        app.nodes[self.node_id].name = self.new
+        return ChangeSet(updated=[self.node_id])
+
+    def revert(self, app) -> ChangeSet:
+        app.nodes[self.node_id].name = self.old
+        return ChangeSet(updated=[self.node_id])
+
+
+class InsertSubtree:
+    """Вставка поддерева (новый узел, копия узла) на позицию index среди детей родителя.
+
+    records — записи узлов поддерева (storage.node_to_dict), корень первым.
+    """
+
+    def __init__(self, records: List[dict], index: int):
+        self.records = records
+        self.index = index
+        self._parent_values = None  # значения родителя до вставки (если он был листом)
+        self.size = _COMMAND_BYTES + sum(_RECORD_BYTES + 2 * len(r["name"]) + 8 * len(r["children"])
+                                         for r in records)
+
+    @property
+    def root_id(self) -> int:
+        return self.records[0]["id"]
+
+    def apply(self, app) -> ChangeSet:
+        return self._insert(app)
+
+    def revert(self, app) -> ChangeSet:
+        return self._remove(app)
+
+    def _insert(self, app) -> ChangeSet:
+        for data in self.records:
+            app.nodes[data["id"]] = RiskNode(**data)
+        root = app.nodes[self.root_id]
+        if root.parent_id is not None:
+            parent = app.nodes[root.parent_id]
+            if not parent.children:
+                # лист станет родителем и получит средние значения — запоминаем свои
+                self._parent_values = (parent.prob, parent.loss_min, parent.loss_max, parent.severity)
+            parent.insert_child(self.index, root.id)
+        changed = app.aggregator.attach(root.id)
+        changes = ChangeSet(inserted=[r["id"] for r in self.records], updated=changed)
+        if root.parent_id is not None and self.index < len(app.nodes[root.parent_id].children) - 1:
+            # не в конец — хранилище (SQLite: position) должно получить новый порядок детей
+            changes.reordered.append(root.parent_id)
+        return changes
+
+    def _remove(self, app) -> ChangeSet:
+        # Отцепляем поддерево от родителя и исключаем из сумм — предки пересчитываются сразу
+        changed = app.aggregator.detach(self.root_id)
+        removed = []
+        stack = [self.root_id]
+        while stack:
+            nid = stack.pop()
+            stack.extend(app.nodes[nid].children)
+            del app.nodes[nid]
+            removed.append(nid)
+        parent_id = self.records[0]["parent_id"]
+        if self._parent_values is not None and not app.nodes[parent_id].children:
+            # родитель снова лист — возвращаем его собственные значения
+            parent = app.nodes[parent_id]
+            parent.prob, parent.loss_min, parent.loss_max, parent.severity = self._parent_values
+            changed = app.aggregator.refresh(parent_id)
+        return ChangeSet(removed=removed, updated=changed)
+
+
+class DeleteSubtree(InsertSubtree):
+    """Удаление узла со всеми потомками — обратная операция к вставке."""
+
+    def apply(self, app) -> ChangeSet:
+        return self._remove(app)
+
+    def revert(self, app) -> ChangeSet:
+        return self._insert(app)
+
+
+class ImportNodes:
+    """Массовая вставка из importer: много новых поддеревьев под существующими родителями.
+
+    records — записи новых узлов, родители раньше детей. Узлы, чей родитель не из
+    records, дописываются в конец детей существующего узла. Пересчёт средних —
+    один проход снизу вверх (aggregator.attach_many), а не по узлу за раз.
+    """
+
+    def __init__(self, records: List[dict]):
+        self.records = records
+        ids = {r["id"] for r in records}
+        self.root_ids = [r["id"] for r in records if r["parent_id"] not in ids]
+        self._parent_values = {}  # значения бывших листьев, ставших родителями
+        self.size = _COMMAND_BYTES + sum(_RECORD_BYTES + 2 * len(r["name"]) + 8 * len(r["children"])
+                                         for r in records)
+
+    def apply(self, app) -> ChangeSet:
+        nodes = app.nodes
+        for data in self.records:
+            nodes[data["id"]] = RiskNode(**data)
+        self._parent_values = {}
+        for nid in self.root_ids:
+            parent = nodes[nodes[nid].parent_id]
+            if not parent.children:
+                self._parent_values[parent.id] = (parent.prob, parent.loss_min, parent.loss_max, parent.severity)
+            parent.append_child(nid)
+        changed = app.aggregator.attach_many(self.root_ids)
+        return ChangeSet(inserted=[r["id"] for r in self.records], updated=changed)
+
+    def revert(self, app) -> ChangeSet:
+        # Бывшие листья снова станут листьями — их значения возвращаются до пересчёта предков
+        for pid, values in self._parent_values.items():
+            parent = app.nodes[pid]
+            parent.prob, parent.loss_min, parent.loss_max, parent.severity = values
+        changed = app.aggregator.detach_many(self.root_ids)
+        removed = [r["id"] for r in self.records]
+        for nid in removed:
+            del app.nodes[nid]
+        return ChangeSet(removed=removed, updated=changed)
+
+
+class MoveNode:
+    """Перестановка узла среди братьев."""
+
+    def __init__(self, parent_id: int, old_index: int, new_index: int):
+        self.parent_id = parent_id
+        self.old_index = old_index
+        self.new_index = new_index
+        self.size = _COMMAND_BYTES
+
+    def apply(self, app) -> ChangeSet:
+        return self._move(app, self.old_index, self.new_index)
+
+    def revert(self, app) -> ChangeSet:
+        return self._move(app, self.new_index, self.old_index)
+
+    def _move(self, app, src: int, dst: int) -> ChangeSet:
+        app.nodes[self.parent_id].move_child(src, dst)
+        return ChangeSet(reordered=[self.parent_id])
+
+
+# ----------------- История -----------------
+class History:
+    """Кольцевой буфер команд для отмены/повтора с ограничением по памяти.
+
+    При превышении max_bytes вытесняются самые старые команды.
+    """
+
+    def __init__(self, max_bytes: int = HISTORY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._undo = deque()
+        self._redo = []
+        self.bytes = 0
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def push(self, command):
+        """Запоминает выполненную команду; ветка повтора при этом сбрасывается."""
+        self.bytes -= sum(c.size for c in self._redo)
+        self._redo.clear()
+        self._undo.append(command)
+        self.bytes += command.size
+        while self.bytes > self.max_bytes and self._undo:
+            self.bytes -= self._undo.popleft().size
+
+    def undo(self, app) -> Optional[ChangeSet]:
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        self._redo.append(command)
+        return command.revert(app)
+
+    def redo(self, app) -> Optional[ChangeSet]:
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        self._undo.append(command)
+        return command.apply(app)
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self.bytes = 0
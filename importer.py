@@ -0,0 +1,322 @@
+"""Массовый импорт магазинов и систем из CSV/JSON: одна проверка потоком, один пересчёт, одно сохранение.
+
+    python -m importer data/region.csv                              # в data/nodes.json
+    python -m importer data/region.csv --strict --rejected data/rejected.csv
+
+Строка — один новый узел: path (путь к родителю от корня через «/»; недостающие
+уровни создаются) или parent (название существующего узла), name, prob,
+loss_min, loss_max, severity. Заголовки можно писать и как в выгрузке таблицы
+(«Объект», «Родитель», P, Lmin, Lmax, Severity). Формат — по расширению:
+.json (список объектов), .jsonl (объект в строке), остальное — CSV с
+разделителем «,», «;» или табуляцией. Все форматы читаются потоком. В программе — «Импорт из файла…» (Ctrl+I),
+весь импорт отменяется одним Ctrl+Z.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import types
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from models import RiskNode
+from storage import node_to_dict, iter_json_list
+
+FIELDS = ("path", "parent", "name", "prob", "loss_min", "loss_max", "severity")
+# Заголовки выгрузки (export.EXPORT_COLUMNS) и подписи колонок интерфейса
+HEADER_ALIASES = {
+    "объект": "name", "название": "name", "родитель": "parent", "путь к родителю": "path",
+    "p": "prob", "вероятность": "prob",
+    "lmin": "loss_min", "мин. потери": "loss_min",
+    "lmax": "loss_max", "макс. потери": "loss_max",
+    "вес": "severity",
+}
+DEFAULTS = {"prob": 0.0, "loss_min": 0.0, "loss_max": 0.0, "severity": 1.0}
+PATH_SEP = "/"
+# Сколько начала CSV смотреть, чтобы угадать разделитель
+SNIFF_CHARS = 64 * 1024
+
+# Ключ строки, которую не удалось прочитать (текст ошибки вместо полей)
+_ERROR = "_error"
+
+
+@dataclass
+class RejectedRow:
+    line: int    # номер строки файла (для .json — номер объекта в списке)
+    reason: str
+    row: dict
+
+
+@dataclass
+class ImportResult:
+    records: List[dict] = field(default_factory=list)  # новые узлы (node_to_dict), родители раньше детей
+    rejected: List[RejectedRow] = field(default_factory=list)
+    rows: int = 0      # прочитано строк
+    created: int = 0   # из новых узлов — промежуточных уровней, созданных по path
+    next_id: int = 1   # первый свободный id после импорта
+
+
+# ----------------- Чтение -----------------
+def read_rows(path: str) -> Iterator[Tuple[int, dict]]:
+    """(номер строки, поля) по одной строке; ключи приведены к FIELDS, лишние колонки отброшены."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".jsonl":
+        with open(path, encoding="utf-8-sig") as f:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_no, _json_row(line)
+    elif ext == ".json":
+        for i, obj in enumerate(iter_json_list(path), start=1):
+            yield i, _normalize(obj) if isinstance(obj, dict) else {_ERROR: "не объект"}
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            sample = f.read(SNIFF_CHARS)
+            f.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.DictReader(f, dialect=dialect)
+            columns = _columns(reader.fieldnames or [])
+            if "name" not in columns.values():
+                raise ValueError(f"{path}: нет колонки name (или «Объект»)")
+            for row in reader:
+                yield reader.line_num, {columns[k]: v for k, v in row.items() if k in columns}
+
+
+def _columns(headers: Iterable[str]) -> Dict[str, str]:
+    columns = {}
+    for header in headers:
+        key = (header or "").strip().lower()
+        key = key if key in FIELDS else HEADER_ALIASES.get(key)
+        if key is not None and key not in columns.values():
+            columns[header] = key
+    return columns
+
+
+def _normalize(obj: dict) -> dict:
+    columns = _columns(obj)
+    return {columns[k]: v for k, v in obj.items() if k in columns}
+
+
+def _json_row(line: str) -> dict:
+    try:
+        obj = json.loads(line)
+    except ValueError as e:
+        return {_ERROR: f"не JSON: {e}"}
+    return _normalize(obj) if isinstance(obj, dict) else {_ERROR: "не объект"}
+
+
+# ----------------- Проверка -----------------
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _number(row: dict, key: str) -> float:
+    text = _text(row.get(key))
+    if not text:
+        return DEFAULTS[key]
+    try:
+        value = float(text.replace(",", ".").replace(" ", "").replace("\u00a0", ""))
+    except ValueError:
+        value = math.nan
+    if not math.isfinite(value):
+        raise ValueError(f"{key}: не число «{text}»")
+    return value
+
+
+def _values(row: dict) -> Tuple[float, float, float, float]:
+    prob, lmin, lmax, sev = (_number(row, key) for key in ("prob", "loss_min", "loss_max", "severity"))
+    if not 0.0 <= prob <= 1.0:
+        raise ValueError(f"prob вне [0, 1]: {prob:g}")
+    if lmin < 0 or lmax < 0:
+        raise ValueError("отрицательные потери")
+    if lmin > lmax:
+        raise ValueError(f"loss_min больше loss_max: {lmin:g} > {lmax:g}")
+    if not 1.0 <= sev <= 5.0:
+        raise ValueError(f"severity вне [1, 5]: {sev:g}")
+    return prob, lmin, lmax, sev
+
+
+# ----------------- Раскладка по дереву -----------------
+class _Planner:
+    """Раскладывает строки по дереву, не трогая его: новые узлы копятся в added."""
+
+    def __init__(self, nodes: Dict[int, RiskNode], next_id: int, root_id: int, create_missing: bool):
+        self.nodes = nodes
+        self.root = nodes[root_id]
+        self.create_missing = create_missing
+        self.next_id = next_id  # первый ещё не выданный id
+        self.added: Dict[int, RiskNode] = {}
+        self.explicit = set()  # новые узлы, заданные своей строкой, а не созданные по path
+        self.by_parent: Dict[int, Dict[str, int]] = {}  # родитель -> {название ребёнка: id}
+        self.by_name: Optional[Dict[str, List[int]]] = None  # строится при первой колонке parent
+        self.result = ImportResult()
+
+    def node(self, nid: int) -> RiskNode:
+        node = self.added.get(nid)
+        return self.nodes[nid] if node is None else node
+
+    def add(self, line: int, row: dict):
+        self.result.rows += 1
+        reason = self._add(row)
+        if reason is not None:
+            self.result.rejected.append(RejectedRow(line, reason, row))
+
+    def finish(self) -> ImportResult:
+        self.result.records = [node_to_dict(node) for node in self.added.values()]
+        self.result.next_id = self.next_id
+        return self.result
+
+    def _add(self, row: dict) -> Optional[str]:
+        if _ERROR in row:
+            return row[_ERROR]
+        name = _text(row.get("name"))
+        if not name:
+            return "пустое название"
+        try:
+            values = _values(row)
+        except ValueError as e:
+            return str(e)
+
+        path, parent = _text(row.get("path")), _text(row.get("parent"))
+        if path:
+            pid, reason = self._resolve_path(path)
+        elif parent:
+            pid, reason = self._resolve_parent(parent)
+        else:
+            pid, reason = self.root.id, None
+        if reason is not None:
+            return reason
+
+        existing = self._children_of(pid).get(name)
+        if existing is None:
+            node = self._new(name, pid)
+        elif existing in self.added and existing not in self.explicit:
+            node = self.added[existing]  # уровень, созданный по path раньше, получает свою строку
+        else:
+            return f"«{name}» уже есть в «{self.node(pid).name}»"
+        node.prob, node.loss_min, node.loss_max, node.severity = values
+        self.explicit.add(node.id)
+        return None
+
+    def _resolve_path(self, path: str):
+        parts = [p.strip() for p in path.split(PATH_SEP) if p.strip()]
+        if parts and parts[0] == self.root.name:
+            parts = parts[1:]
+        pid = self.root.id
+        for part in parts:
+            cid = self._children_of(pid).get(part)
+            if cid is None:
+                if not self.create_missing:
+                    return None, f"нет узла «{part}» (путь «{path}»)"
+                cid = self._new(part, pid).id
+                self.result.created += 1
+            pid = cid
+        return pid, None
+
+    def _resolve_parent(self, name: str):
+        if self.by_name is None:
+            self.by_name = {}
+            for node in list(self.nodes.values()) + list(self.added.values()):
+                self.by_name.setdefault(node.name, []).append(node.id)
+        ids = self.by_name.get(name)
+        if not ids:
+            return None, f"нет узла «{name}»"
+        if len(ids) > 1:
+            return None, f"узлов «{name}» несколько ({len(ids)}) — укажите path"
+        return ids[0], None
+
+    def _children_of(self, pid: int) -> Dict[str, int]:
+        index = self.by_parent.get(pid)
+        if index is None:
+            index = self.by_parent[pid] = {}
+            for cid in self.node(pid).children:
+                index.setdefault(self.node(cid).name, cid)
+        return index
+
+    def _new(self, name: str, pid: int) -> RiskNode:
+        siblings = self._children_of(pid)
+        node = RiskNode(id=self.next_id, name=name, parent_id=pid)
+        self.next_id += 1
+        self.added[node.id] = node
+        if pid in self.added:
+            # существующим родителям дети добавятся при применении (history.ImportNodes)
+            self.added[pid].append_child(node.id)
+        siblings.setdefault(name, node.id)
+        if self.by_name is not None:
+            self.by_name.setdefault(name, []).append(node.id)
+        return node
+
+
+def plan_import(nodes: Dict[int, RiskNode], rows: Iterable[Tuple[int, dict]], next_id: int,
+                root_id: int = 1, create_missing: bool = True) -> ImportResult:
+    """Проверяет строки одним проходом и раскладывает их по дереву; nodes не меняются.
+
+    Результат применяется командой history.ImportNodes(result.records).
+    create_missing=False — строки с несуществующим уровнем пути отклоняются.
+    """
+    planner = _Planner(nodes, next_id, root_id, create_missing)
+    for line, row in rows:
+        planner.add(line, row)
+    return planner.finish()
+
+
+# ----------------- Отклонённые строки -----------------
+def rejected_path(source: str) -> str:
+    return os.path.splitext(source)[0] + ".rejected.csv"
+
+
+def write_rejected(rejected: List[RejectedRow], path: str):
+    """Отчёт об отклонённых строках: номер строки, причина и исходные поля."""
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("line", "reason") + FIELDS)
+        for r in rejected:
+            writer.writerow((r.line, r.reason) + tuple(_text(r.row.get(k)) for k in FIELDS))
+
+
+# ----------------- Командная строка -----------------
+def main(argv=None) -> int:
+    import storage
+    from aggregate import RiskAggregator
+    from history import ImportNodes
+
+    parser = argparse.ArgumentParser(prog="python -m importer", description="Массовый импорт узлов из CSV/JSON")
+    parser.add_argument("source", help="файл .csv, .json или .jsonl")
+    parser.add_argument("--nodes", default=storage.DATA_FILE, help=f"файл узлов (по умолчанию {storage.DATA_FILE})")
+    parser.add_argument("--rejected", help="куда записать отклонённые строки (по умолчанию рядом с source)")
+    parser.add_argument("--strict", action="store_true", help="не создавать недостающие уровни path")
+    args = parser.parse_args(argv)
+
+    try:
+        storage.DATA_FILE = args.nodes
+        nodes = storage.load_nodes()
+        new_root = not nodes
+        if new_root:
+            nodes[1] = RiskNode(id=1, name='ПАО "МАГНИТ"')
+        result = plan_import(nodes, read_rows(args.source), max(nodes) + 1, create_missing=not args.strict)
+        if result.records:
+            model = types.SimpleNamespace(nodes=nodes, aggregator=RiskAggregator(nodes))
+            changes = ImportNodes(result.records).apply(model)
+            if new_root:
+                changes.inserted.append(1)  # корень создан здесь же — сохраняется вместе с импортом
+            storage.save_changes(nodes, changes)
+        rejected = None
+        if result.rejected:
+            rejected = args.rejected or rejected_path(args.source)
+            write_rejected(result.rejected, rejected)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Строк: {result.rows}, добавлено узлов: {len(result.records)} "
+          f"(из них уровней по path: {result.created}), отклонено: {len(result.rejected)}", file=sys.stderr)
+    if rejected:
+        print(f"Отклонённые строки: {rejected}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,50 @@
+import time
+_START = time.perf_counter()  # отсчёт времени запуска — до всех остальных импортов
+
+import argparse
+import json
+import sys
 import tkinter as tk
 from app import RiskAnalyzerMagnitApp
 
-def main():
+_IMPORTED = time.perf_counter()
+
+
+def measure_startup(root, app, log_file=None):
+    """Замер запуска: импорты, создание окна и первая отрисовка; пишет строку JSON."""
+    created = time.perf_counter()
+    root.update()  # дожидаемся первой отрисовки окна
+    shown = time.perf_counter()
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "nodes": len(app.nodes),
+        "imports_s": round(_IMPORTED - _START, 4),
+        "init_s": round(created - _IMPORTED, 4),
+        "first_paint_s": round(shown - created, 4),
+        "total_s": round(shown - _START, 4),
+    }
+    line = json.dumps(result, ensure_ascii=False)
+    print(line)
+    if log_file:
+        # Файл пополняется от запуска к запуску — удобно сравнивать версии
+        with open(log_file, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Риск-анализатор ПАО "МАГНИТ"')
+    parser.add_argument("--measure-startup", nargs="?", const="", metavar="FILE",
+                        help="замерить время запуска, дописать результат в FILE (если указан) и выйти")
+    args = parser.parse_args(argv)
+
     root = tk.Tk()
     app = RiskAnalyzerMagnitApp(root)
+    if args.measure_startup is not None:
+        measure_startup(root, app, args.measure_startup or None)
+        app._on_close()
+        return
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+from array import array
+from itertools import chain
+from typing import Dict, List, Tuple
+from models import RiskNode, ChangeSet
+
+# Сопоставление русских названий из UI с ключами для сортировки
+UI_TO_KEY = {
+    "Объект": "Объект",
+    "Вероятность": "P",
+    "Мин. потери": "Lmin",
+    "Макс. потери": "Lmax",
+    "Ожидаемый мин. потери": "ExpectedMin",
+    "Ожидаемый макс. потери": "ExpectedMax",
+    "Вес": "Severity",
+    "Риск": "Risk"
+}
+
+# Значение узла для каждого ключа сортировки
+KEY_FUNCS = {
+    "Объект": lambda n: n.name.lower(),
+    "P": lambda n: n.prob,
+    "Lmin": lambda n: n.loss_min,
+    "Lmax": lambda n: n.loss_max,
+    "ExpectedMin": lambda n: (n.prob or 0.0) * (n.loss_min or 0.0),
+    "ExpectedMax": lambda n: (n.prob or 0.0) * (n.loss_max or 0.0),
+    "Severity": lambda n: n.severity,
+    "Risk": lambda n: (n.prob or 0.0) * (n.severity or 1.0)
+}
+
+
+def sort_nodes(nodes: List[RiskNode], sort_key: str, reverse: bool = False) -> List[RiskNode]:
+    """Сортирует узлы по ключу (устойчиво)."""
+    if sort_key not in KEY_FUNCS:
+        return list(nodes)
+    return sorted(nodes, key=KEY_FUNCS[sort_key], reverse=reverse)
+
+
+def derived_columns(nodes: List[RiskNode]) -> Tuple[List[float], List[float], List[float]]:
+    """ExpectedMin, ExpectedMax и Risk для каждого узла списка (в том же порядке)."""
+    lower = [(n.prob or 0.0) * (n.loss_min or 0.0) for n in nodes]
+    upper = [(n.prob or 0.0) * (n.loss_max or 0.0) for n in nodes]
+    risk = [(n.prob or 0.0) * (n.severity or 1.0) for n in nodes]
+    return lower, upper, risk
+
+
+def leaf_totals(nodes: Dict[int, RiskNode], root_id: int = 1) -> Tuple[float, float]:
+    """Суммы ожидаемых мин./макс. потерь по листьям дерева с корнем root_id.
+
+    Все узлы словаря должны принадлежать этому дереву (как app.nodes).
+    """
+    total_lower = total_upper = 0.0
+    stack = [root_id]
+    while stack:
+        node = nodes[stack.pop()]
+        if node.children:
+            stack.extend(node.children)
+        else:
+            total_lower += (node.prob or 0.0) * (node.loss_min or 0.0)
+            total_upper += (node.prob or 0.0) * (node.loss_max or 0.0)
+    return total_lower, total_upper
+
+
+class LeafTotals:
+    """Суммы ожидаемых мин./макс. потерь по листьям, обновляемые по ChangeSet.
+
+    Вклад каждого узла хранится в массивах по id (у родителей — ноль), поэтому
+    правка меняет итоги за O(размера правки), а не обходом всего дерева.
+    """
+
+    def __init__(self, nodes: Dict[int, RiskNode], columns=None):
+        self.nodes = nodes
+        self.rebuild(columns)
+
+    def rebuild(self, columns=None):
+        """Итоги с нуля; columns — колонки тех же узлов (aggregate.column_store), если уже построены."""
+        size = max(self.nodes, default=0) + 1
+        if columns is not None:
+            lower, upper = columns.leaf_expected(size)
+            self._lower = array("d", lower.tobytes())
+            self._upper = array("d", upper.tobytes())
+            self.lower, self.upper = float(lower.sum()), float(upper.sum())
+            return
+        self._lower = array("d", bytes(8 * size))
+        self._upper = array("d", bytes(8 * size))
+        self.lower = self.upper = 0.0
+        for node in self.nodes.values():
+            if not node.children:
+                self._set(node.id, *_expected(node))
+
+    def totals(self) -> Tuple[float, float]:
+        return self.lower, self.upper
+
+    def apply(self, changes: ChangeSet):
+        """Учитывает правку; вызывается после изменения модели. Узлы, ставшие родителями
+        или листьями, приходят в updated (их пересчитывает агрегатор)."""
+        for nid in changes.removed:
+            if nid < len(self._lower):
+                self._set(nid, 0.0, 0.0)
+        for nid in chain(changes.inserted, changes.updated):
+            node = self.nodes.get(nid)
+            if node is not None:
+                self._set(nid, *((0.0, 0.0) if node.children else _expected(node)))
+
+    def _set(self, nid: int, lower: float, upper: float):
+        if nid >= len(self._lower):
+            grow = bytes(8 * max(nid + 1 - len(self._lower), len(self._lower)))
+            self._lower.frombytes(grow)
+            self._upper.frombytes(grow)
+        self.lower += lower - self._lower[nid]
+        self.upper += upper - self._upper[nid]
+        self._lower[nid] = lower
+        self._upper[nid] = upper
+
+
+def _expected(node: RiskNode) -> Tuple[float, float]:
+    prob = node.prob or 0.0
+    return prob * (node.loss_min or 0.0), prob * (node.loss_max or 0.0)
@@ -1,13 +1,97 @@
+import sys
+from array import array
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import Iterable, List, Optional
+
+# Тип элементов массива детей: 64-битные id
+CHILD_TYPECODE = "q"
+_NO_CHILDREN = ()
+
 
-@dataclass
 class RiskNode:
-    id: int
-    name: str
-    prob: float = 0.0
-    loss_min: float = 0.0
-    loss_max: float = 0.0
-    severity: float = 1.0
-    parent_id: Optional[int] = None
-    children: List[int] = field(default_factory=list)
+    """Узел дерева рисков; создаётся как прежний dataclass: RiskNode(id, name, prob=..., children=[...]).
+
+    Узлов бывают миллионы, поэтому экземпляры без __dict__ (__slots__), id детей
+    лежат в array('q') (8 байт на ребёнка вместо ссылки и отдельного int), а у
+    листа массива нет вовсе — children отдаёт пустой кортеж. Названия интернируются:
+    одинаковые названия систем во всех магазинах — одна строка в памяти.
+    Детей меняют через append_child / insert_child / move_child или присваиванием
+    children (любой итерируемый объект id).
+    """
+    __slots__ = ("id", "name", "prob", "loss_min", "loss_max", "severity", "parent_id", "_children")
+
+    def __init__(self, id: int, name: str, prob: float = 0.0, loss_min: float = 0.0, loss_max: float = 0.0,
+                 severity: float = 1.0, parent_id: Optional[int] = None, children: Iterable[int] = ()):
+        self.id = id
+        self.name = sys.intern(name)
+        self.prob = prob
+        self.loss_min = loss_min
+        self.loss_max = loss_max
+        self.severity = severity
+        self.parent_id = parent_id
+        self.children = children
+
+    @property
+    def children(self):
+        """id детей по порядку: array('q') у родителя, () у листа."""
+        children = self._children
+        return _NO_CHILDREN if children is None else children
+
+    @children.setter
+    def children(self, ids: Iterable[int]):
+        children = array(CHILD_TYPECODE, ids)
+        self._children = children if children else None
+
+    def append_child(self, child_id: int):
+        if self._children is None:
+            self._children = array(CHILD_TYPECODE)
+        self._children.append(child_id)
+
+    def insert_child(self, index: int, child_id: int):
+        if self._children is None:
+            self._children = array(CHILD_TYPECODE)
+        self._children.insert(index, child_id)
+
+    def move_child(self, src: int, dst: int):
+        children = self._children
+        children.insert(dst, children.pop(src))
+
+    def __getstate__(self):
+        return (self.id, self.name, self.prob, self.loss_min, self.loss_max, self.severity, self.parent_id,
+                self._children)
+
+    def __setstate__(self, state):
+        (self.id, name, self.prob, self.loss_min, self.loss_max, self.severity, self.parent_id,
+         self._children) = state
+        self.name = sys.intern(name)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.__getstate__()[:-1] == other.__getstate__()[:-1]
+                and list(self.children) == list(other.children))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"RiskNode(id={self.id!r}, name={self.name!r}, prob={self.prob!r}, loss_min={self.loss_min!r}, "
+                f"loss_max={self.loss_max!r}, severity={self.severity!r}, parent_id={self.parent_id!r}, "
+                f"children={list(self.children)!r})")
+
+@dataclass
+class ChangeSet:
+    """Изменения модели после операции — по ним дерево обновляется точечно."""
+    inserted: List[int] = field(default_factory=list)   # новые узлы (родители раньше детей)
+    removed: List[int] = field(default_factory=list)    # удалённые узлы вместе с потомками
+    reordered: List[int] = field(default_factory=list)  # родители, у которых изменился порядок детей
+    updated: List[int] = field(default_factory=list)    # узлы с новыми значениями или именем
+
+    def merge(self, other: "ChangeSet") -> "ChangeSet":
+        self.inserted.extend(other.inserted)
+        self.removed.extend(other.removed)
+        self.reordered.extend(other.reordered)
+        self.updated.extend(other.updated)
+        return self
+
+    def __bool__(self):
+        return bool(self.inserted or self.removed or self.reordered or self.updated)
@@ -0,0 +1,276 @@
+"""Замеры времени обработчиков: счётчики, гистограммы задержек, вызовы Tk, профиль одного действия.
+
+    @instrument
+    def on_add(app): ...
+
+    perf.enable()              # или RISK_PERF=1 в окружении; F12 в программе — панель замеров
+    perf.profile_next()        # следующее действие целиком пойдёт в cProfile (data/profiles/*.prof)
+    perf.export("perf.json")
+
+Пока замеры выключены, обёртка только проверяет флаг и вызывает функцию.
+Операции, идущие в других процессах (отчёты report_jobs), замеряются там и
+передаются сюда через record().
+Модуль не импортирует tkinter: его подключают storage и report_jobs, которые
+работают и без окна.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+ENABLED = os.environ.get("RISK_PERF") == "1"
+
+# Сколько последних операций хранится для панели
+RECENT = 200
+# Верхние границы корзин гистограммы задержек, мс (последняя корзина — всё, что дольше)
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+PROFILE_DIR = "data/profiles"
+# Строк сводки профиля (по cumulative)
+PROFILE_LINES = 30
+
+
+@dataclass
+class OpStats:
+    """Итоги по одному обработчику."""
+    name: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    tk_calls: int = 0
+    errors: int = 0
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(BUCKETS_MS) + 1))
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Оценка квантиля по гистограмме — верхняя граница корзины, но не больше max."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS_MS[i], self.max_ms) if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+
+@dataclass
+class OpRecord:
+    """Одна выполненная операция (для списка последних)."""
+    name: str
+    started: float   # time.time() начала
+    ms: float
+    tk_calls: int    # вызовов Tk из потока операции за её время, включая вложенные операции
+    depth: int       # 0 — операция верхнего уровня, больше — вызвана из другой замеряемой
+    thread: str
+    error: Optional[str] = None
+
+
+_lock = threading.Lock()
+_local = threading.local()  # стек вложенности и счётчик вызовов Tk текущего потока
+_stats: Dict[str, OpStats] = {}
+_recent: deque = deque(maxlen=RECENT)
+_tk_calls = 0  # всего, по всем потокам
+_profile_armed: Optional[str] = None  # каталог для профиля следующего действия
+last_profile: Optional[dict] = None   # {"name", "path", "summary"} последнего профиля
+
+
+# ----------------- Включение -----------------
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def is_enabled() -> bool:
+    return ENABLED
+
+
+def reset():
+    global _tk_calls
+    with _lock:
+        _stats.clear()
+        _recent.clear()
+        _tk_calls = 0
+
+
+# ----------------- Обёртка -----------------
+def instrument(func=None, *, name: str = None):
+    """Декоратор замера: @instrument или @instrument(name="...")."""
+    def wrap(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            return _measure(label, func, args, kwargs)
+        return wrapper
+    return wrap(func) if func is not None else wrap
+
+
+def _measure(label, func, args, kwargs):
+    global _profile_armed
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    profile_dir = None
+    if _profile_armed is not None and not stack:
+        with _lock:
+            profile_dir, _profile_armed = _profile_armed, None
+
+    depth = len(stack)
+    stack.append(label)
+    tk_before = getattr(_local, "tk_calls", 0)
+    error = None
+    start = time.perf_counter()
+    started = time.time()
+    try:
+        if profile_dir is not None:
+            return _profiled(label, profile_dir, func, args, kwargs)
+        return func(*args, **kwargs)
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        stack.pop()
+        _record(OpRecord(label, started, ms, getattr(_local, "tk_calls", 0) - tk_before, depth,
+                         threading.current_thread().name, error))
+
+
+def record(name: str, started: float, ms: float, thread: str, error: Optional[str] = None):
+    """Операция, замеренная вне instrument (например, в процессе отчёта); вызовов Tk у неё нет."""
+    if ENABLED:
+        _record(OpRecord(name, started, ms, 0, 0, thread, error))
+
+
+def _record(rec: OpRecord):
+    with _lock:
+        stats = _stats.get(rec.name)
+        if stats is None:
+            stats = _stats[rec.name] = OpStats(rec.name)
+        stats.count += 1
+        stats.total_ms += rec.ms
+        stats.max_ms = max(stats.max_ms, rec.ms)
+        stats.tk_calls += rec.tk_calls
+        stats.errors += rec.error is not None
+        stats.buckets[_bucket(rec.ms)] += 1
+        _recent.append(rec)
+
+
+def _bucket(ms: float) -> int:
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+
+# ----------------- Вызовы Tk -----------------
+class _CountingTk:
+    """Обёртка интерпретатора Tk виджета: считает tk.call (всего и по потоку вызова),
+    остальное пропускает как есть. Операция в фоновом потоке не получает вызовы Tk,
+    сделанные за это время главным потоком."""
+
+    def __init__(self, tk):
+        self._tk = tk
+
+    def call(self, *args):
+        global _tk_calls
+        _tk_calls += 1
+        _local.tk_calls = getattr(_local, "tk_calls", 0) + 1
+        return self._tk.call(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._tk, name)
+
+
+def count_tk(widget):
+    """Считать вызовы Tk виджета и всех его потомков (новые дочерние виджеты наследуют счётчик)."""
+    if not isinstance(widget.tk, _CountingTk):
+        widget.tk = _CountingTk(widget.tk)
+    for child in widget.winfo_children():
+        count_tk(child)
+
+
+def uncount_tk(widget):
+    if isinstance(widget.tk, _CountingTk):
+        widget.tk = widget.tk._tk
+    for child in widget.winfo_children():
+        uncount_tk(child)
+
+
+def tk_calls() -> int:
+    return _tk_calls
+
+
+# ----------------- Профиль одного действия -----------------
+def profile_next(directory: str = PROFILE_DIR):
+    """Следующая замеряемая операция верхнего уровня (в любом потоке) выполнится под cProfile."""
+    global _profile_armed
+    with _lock:
+        _profile_armed = directory
+
+
+def profile_armed() -> bool:
+    return _profile_armed is not None
+
+
+def _profiled(label, directory, func, args, kwargs):
+    global last_profile
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        last_profile = {"name": label, "path": path, "summary": out.getvalue()}
+
+
+# ----------------- Чтение и выгрузка -----------------
+def stats() -> List[OpStats]:
+    """Копии итогов, по убыванию суммарного времени."""
+    with _lock:
+        copies = [OpStats(s.name, s.count, s.total_ms, s.max_ms, s.tk_calls, s.errors, list(s.buckets))
+                  for s in _stats.values()]
+    return sorted(copies, key=lambda s: s.total_ms, reverse=True)
+
+
+def recent(limit: int = RECENT) -> List[OpRecord]:
+    """Последние операции, новые первыми."""
+    with _lock:
+        records = list(_recent)
+    return records[:-limit - 1:-1]
+
+
+def export(path: str):
+    """Итоги, гистограммы и последние операции в JSON."""
+    data = {
+        "exported": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "enabled": ENABLED,
+        "tk_calls": _tk_calls,
+        "buckets_ms": list(BUCKETS_MS),
+        "stats": [dict(asdict(s), mean_ms=s.mean_ms, p50_ms=s.percentile(0.5), p95_ms=s.percentile(0.95))
+                  for s in stats()],
+        "recent": [asdict(r) for r in recent()],
+        "last_profile": {k: v for k, v in last_profile.items() if k != "summary"} if last_profile else None,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
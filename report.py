@@ -1,43 +1,231 @@
+import importlib.util
+import os
+import threading
 from models import RiskNode
+from metrics import UI_TO_KEY, derived_columns
 
-try:
-    from reportlab.lib.pagesizes import A4
-    from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
+# ReportLab и шрифты загружаются при первом отчёте (или заранее в фоне — warm_up),
+# чтобы не замедлять запуск программы
+REPORTLAB_AVAILABLE = importlib.util.find_spec("reportlab") is not None
+
+# Все варианты Times New Roman
+FONTS = {
+    "Times-Roman": "fonts/times.ttf",          # обычный
+    "Times-Bold": "fonts/timesbd.ttf",         # жирный
+    "Times-Italic": "fonts/timesi.ttf",        # курсив
+    "Times-BoldItalic": "fonts/timesbi.ttf",   # жирный курсив
+}
+
+_load_lock = threading.Lock()
+_loaded = False
+
+# Куда по умолчанию пишется отчёт
+REPORT_FILE = "data/risk_report_magnit.pdf"
+
+# Стиль для ячеек с переносом текста (создаётся в load_reportlab)
+cell_style = None
+
+
+# ----------------- Шрифты -----------------
+def load_reportlab():
+    """Импортирует ReportLab и регистрирует шрифты — один раз, из любого потока."""
+    global _loaded, cell_style
+    if _loaded:
+        return
+    with _load_lock:
+        if _loaded:
+            return
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.lib.styles import ParagraphStyle
+
+        for name, path in FONTS.items():
+            pdfmetrics.registerFont(TTFont(name, path))
+
+        cell_style = ParagraphStyle(
+            name="Cell",
+            fontName="Times-Roman",
+            fontSize=9,
+            leading=11,  # расстояние между строками
+            wordWrap="CJK"
+        )
+        _loaded = True
+
+
+def warm_up():
+    """Загружает ReportLab и шрифты в фоновом потоке, пока пользователь работает с окном."""
+    if not REPORTLAB_AVAILABLE or _loaded:
+        return None
+
+    def run():
+        try:
+            load_reportlab()
+        except Exception:
+            pass  # ошибка повторится и будет показана при построении отчёта
+
+    thread = threading.Thread(target=run, name="report-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+# ----------------- Таблицы -----------------
+# Колонки с русскими названиями
+COLUMN_NAMES = ["Объект", "P", "Lmin", "Lmax", "ExpectedMin", "ExpectedMax", "Severity", "Risk"]
+
+# С этого числа узлов отчёт строится в режиме больших отчётов
+LARGE_REPORT_ROWS = 5000
+# Наибольшее число строк в одной таблице режима больших отчётов
+LARGE_TABLE_ROWS = 500
+
+
+def _risk_color(risk: float):
+    """Цвет ячейки Risk — по значению, округлённому как в таблице."""
     from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-
-    # Регистрируем все варианты Times New Roman
-    pdfmetrics.registerFont(TTFont("Times-Roman", "fonts/times.ttf"))        # обычный
-    pdfmetrics.registerFont(TTFont("Times-Bold", "fonts/timesbd.ttf"))        # жирный
-    pdfmetrics.registerFont(TTFont("Times-Italic", "fonts/timesi.ttf"))       # курсив
-    pdfmetrics.registerFont(TTFont("Times-BoldItalic", "fonts/timesbi.ttf"))  # жирный курсив
-
-    REPORTLAB_AVAILABLE = True
-except ImportError:
-    REPORTLAB_AVAILABLE = False
-
-# Стиль для ячеек с переносом текста
-cell_style = ParagraphStyle(
-    name="Cell",
-    fontName="Times-Roman",
-    fontSize=9,
-    leading=11,  # расстояние между строками
-    wordWrap="CJK"
-)
+    risk = round(risk, 2)
+    if 1 <= risk < 2.5:
+        return colors.lightgreen
+    elif 2.5 <= risk < 4:
+        return colors.yellow
+    elif 4 <= risk <= 5:
+        return colors.red
+    return None
 
-def generate_pdf(
-        nodes: list[RiskNode],
-        sort_column="Risk",
-        sort_order="Убыванию",
-        filename="data/risk_report_magnit.pdf"
-):
-    if not REPORTLAB_AVAILABLE:
-        raise RuntimeError("ReportLab не установлен")
 
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+def _table_rows(items: list) -> list:
+    """Строки таблицы по узлам items: [название, тексты 7 числовых колонок, риск].
+
+    Ожидаемые потери и риск считаются одним пакетом для всех строк. Строки —
+    простые списки строк и чисел: в таком виде их хранит кэш generate_pdf_cached.
+    """
+    lower_col, upper_col, risk_col = derived_columns(items)
+    rows = []
+    for node, lower, upper, risk in zip(items, lower_col, upper_col, risk_col):
+        values = [f"{node.prob:.3f}", f"{node.loss_min:.2f}", f"{node.loss_max:.2f}",
+                  f"{lower:.2f}", f"{upper:.2f}", f"{node.severity:.1f}", f"{risk:.2f}"]
+        rows.append([node.name, values, risk])
+    return rows
+
+
+def _risk_tables(rows: list, col_widths: list, large: bool) -> list:
+    """Таблица (или несколько) по строкам _table_rows с колонками отчёта.
+
+    В обычном режиме каждая ячейка — Paragraph. В режиме больших отчётов числа
+    идут простыми строками, Paragraph остаётся только у длинных названий, которым
+    нужен перенос, а таблица режется на куски по LARGE_TABLE_ROWS строк, каждый
+    со своей строкой заголовка, — вёрстка LongTable остаётся быстрой.
+    """
+    from reportlab.platypus import LongTable, TableStyle, Paragraph
+    from reportlab.pdfbase.pdfmetrics import stringWidth
     from reportlab.lib import colors
+
+    name_width = col_widths[0] - 12  # без внутренних отступов ячейки
+
+    def cell(text):
+        return Paragraph(text, cell_style)
+
+    def name_cell(name):
+        if stringWidth(name, cell_style.fontName, cell_style.fontSize) <= name_width:
+            return name
+        return Paragraph(name, cell_style)
+
+    chunk = LARGE_TABLE_ROWS if large else max(len(rows), 1)
+    tables = []
+    for start in range(0, len(rows), chunk) or [0]:  # пустая таблица — только заголовок
+        data = [COLUMN_NAMES]
+        table_style = [("FONTNAME", (0,0), (-1,-1), "Times-Roman"),
+                       ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
+                       ("GRID", (0,0), (-1,-1), 0.5, colors.grey)]
+        if large:
+            table_style += [("FONTSIZE", (0,1), (-1,-1), cell_style.fontSize),
+                            ("LEADING", (0,1), (-1,-1), cell_style.leading),
+                            ("VALIGN", (0,1), (-1,-1), "TOP")]
+        for r, (name, values, risk) in enumerate(rows[start:start + chunk], start=1):
+            if large:
+                data.append([name_cell(name)] + values)
+            else:
+                data.append([cell(name)] + [cell(v) for v in values])
+            color = _risk_color(risk)
+            if color is not None:
+                table_style.append(("BACKGROUND", (7,r), (7,r), color))
+
+        table = LongTable(data, colWidths=col_widths, repeatRows=1, hAlign="LEFT")
+        table.setStyle(TableStyle(table_style))
+        tables.append(table)
+    return tables
+
+
+def _report_sections(nodes: list[RiskNode], sort_column: str, sort_order: str) -> list:
+    """Таблицы отчёта по порядку: [(заголовок, узлы строк)], первая — сводная по городам."""
+    sort_key = UI_TO_KEY.get(sort_column, "Risk")
+    reverse = sort_order == "Убыванию"
+
+    # Для отображения в заголовках таблиц используем исходное название из combobox
+    KEY_TO_UI = {v: k for k, v in UI_TO_KEY.items()}
+    header_sort_name = KEY_TO_UI.get(sort_key, sort_column)
+    order_name = "убыв." if reverse else "возр."
+
+    # Объекты каждого города одним проходом, в порядке сортировки списка
+    cities = [n for n in nodes if n.name.startswith("г.")]
+    objects_of = {city.id: [] for city in cities}
+    for n in nodes:
+        if n.parent_id in objects_of:
+            objects_of[n.parent_id].append(n)
+
+    # --- Таблица 1 — города ---
+    sections = [(f'Таблица № 1 — Средние значения в ПАО "МАГНИТ" по городам ({header_sort_name}, {order_name})',
+                 cities)]
+    # --- Таблицы объектов в городах ---
+    for city in cities:
+        objects = objects_of[city.id]
+        if objects:
+            sections.append((f"Таблица № {len(sections) + 1} — Средние значения в {city.name} ({header_sort_name}, {order_name})",
+                             objects))
+    return sections
+
+
+def _simulation_table(simulation, width: float, styles) -> list:
+    """Таблица VaR/CVaR по результату simulation.simulate: группа целиком и города."""
+    from reportlab.platypus import LongTable, TableStyle, Paragraph, Spacer
+    from reportlab.lib import colors
+
+    header = ["Группа / город", "Среднее"]
+    for q in simulation.quantiles:
+        header += [f"VaR {q:.0%}", f"CVaR {q:.0%}"]
+    data = [header]
+    for stats in [simulation.total] + simulation.cities:
+        row = [Paragraph(stats.name, cell_style), f"{stats.mean:.2f}"]
+        for var, cvar in zip(stats.var, stats.cvar):
+            row += [f"{var:.2f}", f"{cvar:.2f}"]
+        data.append(row)
+
+    name_width = width * 0.24
+    col_widths = [name_width] + [(width - name_width) / (len(header) - 1)] * (len(header) - 1)
+    table = LongTable(data, colWidths=col_widths, repeatRows=1, hAlign="LEFT")
+    table.setStyle(TableStyle([("FONTNAME", (0,0), (-1,-1), "Times-Roman"),
+                               ("FONTNAME", (0,1), (-1,1), "Times-Bold"),
+                               ("FONTSIZE", (0,0), (-1,-1), cell_style.fontSize),
+                               ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
+                               ("GRID", (0,0), (-1,-1), 0.5, colors.grey)]))
+
+    elems = [Paragraph(f"Распределение потерь (Монте-Карло, сценариев: {simulation.scenarios}, "
+                       f"seed {simulation.seed})", styles["NormalTimes"]),
+             Spacer(1, 6), table]
+    city_scenarios = min((c.scenarios for c in simulation.cities), default=simulation.scenarios)
+    if city_scenarios < simulation.scenarios:
+        elems.append(Paragraph(f"VaR/CVaR городов — по первым {city_scenarios} сценариям", cell_style))
+    elems.append(Spacer(1, 12))
+    return elems
+
+
+def _render_pdf(filename: str, sections: list, intro: bool, large: bool, progress=None, simulation=None,
+                tables=None) -> int:
+    """Вёрстка готовых таблиц в PDF; intro — с заголовком отчёта (и таблицей VaR/CVaR,
+    если передан simulation). Возвращает число страниц.
+
+    tables(index, items, col_widths) -> flowables, если задана, заменяет построение
+    таблиц раздела (так generate_pdf_cached берёт строки таблиц из кэша).
+    """
+    load_reportlab()
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     from reportlab.lib.pagesizes import A4
 
@@ -69,147 +257,271 @@ def generate_pdf(
 
     elems = []
 
-    # Заголовок
-    elems.append(Paragraph("Отчёт ПАО 'МАГНИТ'", styles["TitleTimes"]))
-    elems.append(Spacer(1, 6))
-    elems.append(Paragraph("Модель: Lmin/Lmax × P, Risk = P × Severity", styles["NormalTimes"]))
-    elems.append(Spacer(1, 6))
-
-    # Пояснение переменных
-    elems.append(Paragraph("Обозначения переменных:", styles["NormalTimes"]))
-    elems.append(Paragraph(
-        "<b>P</b> — вероятность, "
-        "<b>Lmin/Lmax</b> — мин/макс потери, "
-        "<b>ExpectedMin/ExpectedMax</b> — ожидаемые мин/макс потери, "
-        "<b>Severity</b> — тяжесть, ",
-        cell_style
-    ))
-    elems.append(Paragraph(
-        "<b>Risk</b> — риск = P × Severity",
-        cell_style
-    ))
-    elems.append(Spacer(1, 12))
+    if intro:
+        # Заголовок
+        elems.append(Paragraph("Отчёт ПАО 'МАГНИТ'", styles["TitleTimes"]))
+        elems.append(Spacer(1, 6))
+        elems.append(Paragraph("Модель: Lmin/Lmax × P, Risk = P × Severity", styles["NormalTimes"]))
+        elems.append(Spacer(1, 6))
 
-    # Колонки с русскими названиями
-    COLUMN_NAMES = ["Объект", "P", "Lmin", "Lmax", "ExpectedMin", "ExpectedMax", "Severity", "Risk"]
-
-    # Сопоставление русских названий из UI с ключами для сортировки
-    UI_TO_KEY = {
-        "Объект": "Объект",
-        "Вероятность": "P",
-        "Мин. потери": "Lmin",
-        "Макс. потери": "Lmax",
-        "Ожидаемый мин. потери": "ExpectedMin",
-        "Ожидаемый макс. потери": "ExpectedMax",
-        "Вес": "Severity",
-        "Риск": "Risk"
-    }
+        # Пояснение переменных
+        elems.append(Paragraph("Обозначения переменных:", styles["NormalTimes"]))
+        elems.append(Paragraph(
+            "<b>P</b> — вероятность, "
+            "<b>Lmin/Lmax</b> — мин/макс потери, "
+            "<b>ExpectedMin/ExpectedMax</b> — ожидаемые мин/макс потери, "
+            "<b>Severity</b> — тяжесть, ",
+            cell_style
+        ))
+        elems.append(Paragraph(
+            "<b>Risk</b> — риск = P × Severity",
+            cell_style
+        ))
+        elems.append(Spacer(1, 12))
+        if simulation is not None:
+            elems.extend(_simulation_table(simulation, table_width, styles))
 
-    sort_key = UI_TO_KEY.get(sort_column, "Risk")
-    reverse = sort_order == "Убыванию"
+    tables_done = 0
+    pages_done = 0
 
-    # Для отображения в заголовках таблиц используем исходное название из combobox
-    KEY_TO_UI = {v: k for k, v in UI_TO_KEY.items()}
-    header_sort_name = KEY_TO_UI.get(sort_key, sort_column)
+    def report_progress():
+        if progress is not None:
+            progress(tables_done, len(sections), pages_done)
+
+    for index, (title, items) in enumerate(sections):
+        elems.append(Paragraph(title, styles["NormalTimes"]))
+        elems.append(Spacer(1, 6))
+        if tables is None:
+            elems.extend(_risk_tables(_table_rows(items), col_widths, large))
+        else:
+            elems.extend(tables(index, items, col_widths))
+        elems.append(Spacer(1, 12))
+        tables_done += 1
+        report_progress()
+
+    def on_page(canvas, doc):
+        nonlocal pages_done
+        pages_done = canvas.getPageNumber()
+        report_progress()
 
-    def get_key(n):
-        mapping = {
-            "P": n.prob,
-            "Lmin": n.loss_min,
-            "Lmax": n.loss_max,
-            "ExpectedMin": (n.prob or 0.0)*(n.loss_min or 0.0),
-            "ExpectedMax": (n.prob or 0.0)*(n.loss_max or 0.0),
-            "Severity": n.severity,
-            "Risk": (n.prob or 0.0)*(n.severity or 1.0)
+    doc.build(elems, onFirstPage=on_page, onLaterPages=on_page)
+    return pages_done
+
+
+def generate_pdf(
+        nodes: list[RiskNode],
+        sort_column="Risk",
+        sort_order="Убыванию",
+        filename=REPORT_FILE,
+        progress=None,
+        large=None,
+        simulation=None
+):
+    """Строит PDF-отчёт по узлам (в порядке списка).
+
+    progress(tables_done, tables_total, pages_done) вызывается по мере построения
+    таблиц и вёрстки страниц. large — режим больших отчётов (см. _risk_tables);
+    по умолчанию включается с LARGE_REPORT_ROWS узлов. simulation — результат
+    simulation.simulate, его VaR/CVaR выводятся после заголовка отчёта.
+    """
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("ReportLab не установлен")
+    if large is None:
+        large = len(nodes) >= LARGE_REPORT_ROWS
+    _render_pdf(filename, _report_sections(nodes, sort_column, sort_order), True, large, progress, simulation)
+
+
+# ----------------- Параллельная сборка -----------------
+# Фрагменты отчёта склеиваются через pypdf; без него отчёт строится последовательно
+PYPDF_AVAILABLE = importlib.util.find_spec("pypdf") is not None
+
+
+def _shard_sections(sections: list, workers: int) -> list:
+    """Делит таблицы на части: сводная таблица отдельно, города — пачками примерно равного размера."""
+    rows = sum(len(items) for _, items in sections[1:])
+    target = max(1, rows // (workers * 4))  # по нескольку частей на процесс — для выравнивания
+    shards = [sections[:1]]
+    batch, batch_rows = [], 0
+    for section in sections[1:]:
+        batch.append(section)
+        batch_rows += len(section[1])
+        if batch_rows >= target:
+            shards.append(batch)
+            batch, batch_rows = [], 0
+    if batch:
+        shards.append(batch)
+    return shards
+
+
+def _render_shard(filename: str, sections: list, intro: bool, large: bool, simulation=None) -> int:
+    """Тело процесса: вёрстка одной части отчёта (узлы приходят словарями)."""
+    sections = [(title, [RiskNode(**data) for data in records]) for title, records in sections]
+    return _render_pdf(filename, sections, intro, large, simulation=simulation)
+
+
+def _render_parts(parts: list, large: bool, workers: int, progress=None, tables_total: int = 0,
+                  simulation=None) -> int:
+    """Вёрстка частей отчёта [(файл, таблицы, с заголовком?)] — в пуле процессов или здесь же.
+
+    simulation попадает только в часть с заголовком. Возвращает общее число страниц.
+    """
+    tables_done = pages_done = 0
+
+    def part_done(pages, tables):
+        nonlocal tables_done, pages_done
+        pages_done += pages
+        tables_done += tables
+        if progress is not None:
+            progress(tables_done, tables_total, pages_done)
+
+    if workers < 2 or len(parts) < 2:
+        for path, sections, intro in parts:
+            part_done(_render_pdf(path, sections, intro, large, simulation=simulation if intro else None),
+                      len(sections))
+        return pages_done
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from storage import node_to_dict
+
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(parts)),
+                               mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {
+            pool.submit(_render_shard, path,
+                        [(title, [node_to_dict(n) for n in items]) for title, items in sections],
+                        intro, large, simulation if intro else None): len(sections)
+            for path, sections, intro in parts
         }
-        return mapping.get(sort_key, 0)
+        for future in as_completed(futures):
+            part_done(future.result(), futures[future])
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return pages_done
 
-    # --- Таблица 1 — города ---
-    cities = cities = [n for n in nodes if n.name.startswith("г.")]
-    elems.append(Paragraph(
-        f'Таблица № 1 — Средние значения в ПАО "МАГНИТ" по городам ({header_sort_name}, {"убыв." if reverse else "возр."})',
-        styles["NormalTimes"]
-    ))
-    elems.append(Spacer(1, 6))
-
-    city_data = [COLUMN_NAMES]
-    for city in cities:
-        lower = (city.prob or 0.0)*(city.loss_min or 0.0)
-        upper = (city.prob or 0.0)*(city.loss_max or 0.0)
-        risk = (city.prob or 0.0)*(city.severity or 1.0)
-        city_data.append([
-            Paragraph(city.name, cell_style),
-            Paragraph(f"{city.prob:.3f}", cell_style),
-            Paragraph(f"{city.loss_min:.2f}", cell_style),
-            Paragraph(f"{city.loss_max:.2f}", cell_style),
-            Paragraph(f"{lower:.2f}", cell_style),
-            Paragraph(f"{upper:.2f}", cell_style),
-            Paragraph(f"{city.severity:.1f}", cell_style),
-            Paragraph(f"{risk:.2f}", cell_style)
-        ])
-
-    table_style = [("FONTNAME", (0,0), (-1,-1), "Times-Roman"),
-                   ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
-                   ("GRID", (0,0), (-1,-1), 0.5, colors.grey)]
-    for i, row in enumerate(city_data[1:], start=1):
-        risk_val = float(row[7].text)
-        if 1 <= risk_val < 2.5:
-            table_style.append(("BACKGROUND", (7,i), (7,i), colors.lightgreen))
-        elif 2.5 <= risk_val < 4:
-            table_style.append(("BACKGROUND", (7,i), (7,i), colors.yellow))
-        elif 4 <= risk_val <= 5:
-            table_style.append(("BACKGROUND", (7,i), (7,i), colors.red))
-
-    table = LongTable(city_data, colWidths=col_widths, repeatRows=1, hAlign="LEFT")
-    table.setStyle(TableStyle(table_style))
-    elems.append(table)
-    elems.append(Spacer(1, 12))
 
-    # --- Таблицы объектов в городах ---
-    table_idx = 2
-    for city in cities:
-        objects = [n for n in nodes if n.id in city.children]
-        if not objects:
-            continue
+def _merge_pdfs(paths: list, filename: str):
+    """Склейка фрагментов по порядку; итоговый файл подменяется целиком."""
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        writer.write(f)
+    os.replace(tmp, filename)
 
-        elems.append(Paragraph(
-            f"Таблица № {table_idx} — Средние значения в {city.name} ({header_sort_name}, {'убыв.' if reverse else 'возр.'})",
-            styles["NormalTimes"]
-        ))
-        elems.append(Spacer(1, 6))
-        table_idx += 1
 
-        data = [COLUMN_NAMES]
-        for obj in objects:
-            lower = (obj.prob or 0.0)*(obj.loss_min or 0.0)
-            upper = (obj.prob or 0.0)*(obj.loss_max or 0.0)
-            risk = (obj.prob or 0.0)*(obj.severity or 1.0)
-            data.append([
-                Paragraph(obj.name, cell_style),
-                Paragraph(f"{obj.prob:.3f}", cell_style),
-                Paragraph(f"{obj.loss_min:.2f}", cell_style),
-                Paragraph(f"{obj.loss_max:.2f}", cell_style),
-                Paragraph(f"{lower:.2f}", cell_style),
-                Paragraph(f"{upper:.2f}", cell_style),
-                Paragraph(f"{obj.severity:.1f}", cell_style),
-                Paragraph(f"{risk:.2f}", cell_style)
-            ])
+def generate_pdf_parallel(
+        nodes: list[RiskNode],
+        sort_column="Risk",
+        sort_order="Убыванию",
+        filename=REPORT_FILE,
+        progress=None,
+        large=None,
+        workers=None,
+        simulation=None
+):
+    """То же, что generate_pdf, но части отчёта верстаются параллельно в нескольких процессах.
 
-        table_style = [("FONTNAME", (0,0), (-1,-1), "Times-Roman"),
-                       ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
-                       ("GRID", (0,0), (-1,-1), 0.5, colors.grey)]
-        for i,row in enumerate(data[1:], start=1):
-            risk_val = float(row[7].text)
-            if 1 <= risk_val < 2.5:
-                table_style.append(("BACKGROUND", (7,i), (7,i), colors.lightgreen))
-            elif 2.5 <= risk_val < 4:
-                table_style.append(("BACKGROUND", (7,i), (7,i), colors.yellow))
-            elif 4 <= risk_val <= 5:
-                table_style.append(("BACKGROUND", (7,i), (7,i), colors.red))
+    Сводная таблица и пачки городов становятся отдельными PDF-фрагментами, которые
+    затем склеиваются по порядку. Нумерация таблиц и повтор строк заголовка
+    сохраняются; каждая часть начинается с новой страницы.
+    """
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("ReportLab не установлен")
+    workers = workers or os.cpu_count() or 1
+    if large is None:
+        large = len(nodes) >= LARGE_REPORT_ROWS
+    sections = _report_sections(nodes, sort_column, sort_order)
+    if not PYPDF_AVAILABLE or workers < 2 or len(sections) < 2:
+        _render_pdf(filename, sections, True, large, progress, simulation)
+        return
 
-        table = LongTable(data, colWidths=col_widths, repeatRows=1, hAlign="LEFT")
-        table.setStyle(TableStyle(table_style))
-        elems.append(table)
-        elems.append(Spacer(1, 12))
+    import tempfile
+    shards = _shard_sections(sections, workers)
+    with tempfile.TemporaryDirectory(prefix="risk_report_") as tmp_dir:
+        parts = [(os.path.join(tmp_dir, f"part{i:05d}.pdf"), shard, i == 0) for i, shard in enumerate(shards)]
+        _render_parts(parts, large, workers, progress, len(sections), simulation)
+        _merge_pdfs([path for path, _, _ in parts], filename)
+
+
+# ----------------- Кэш таблиц отчёта -----------------
+# Увеличивается при изменении вёрстки или формата строк — старые записи кэша перестают подходить
+REPORT_LAYOUT_VERSION = 3
+
+
+def _section_key(items: list, large: bool) -> str:
+    """Ключ строк раздела: данные узлов и параметры вёрстки. Заголовок с номером таблицы
+    в ключ не входит — он ставится при сборке документа, поэтому новый город
+    не сбрасывает кэш таблиц, идущих после него."""
+    from reportlab import Version
+    from report_cache import content_key
+    rows = [(n.name, n.prob, n.loss_min, n.loss_max, n.severity) for n in items]
+    return content_key(REPORT_LAYOUT_VERSION, Version, sorted(FONTS.items()), large, rows)
+
+
+def generate_pdf_cached(
+        nodes: list[RiskNode],
+        sort_column="Risk",
+        sort_order="Убыванию",
+        filename=REPORT_FILE,
+        progress=None,
+        large=None,
+        cache=None,
+        simulation=None
+):
+    """То же, что generate_pdf, но готовые строки таблиц разделов берутся из кэша.
+
+    В кэше лежат только данные строк (JSON: название, тексты колонок, риск), сами
+    таблицы всегда собираются заново. Ключ раздела — хэш его узлов, поэтому заново
+    считаются только строки изменившихся городов; документ верстается целиком, как в generate_pdf, с теми же
+    номерами таблиц и разрывами страниц. Если не изменилось ничего (вместе с
+    заголовками и моделированием), сразу копируется прошлый отчёт.
+    cache — report_cache.ReportCache.
+    """
+    if not REPORTLAB_AVAILABLE:
+        raise RuntimeError("ReportLab не установлен")
+
+    import json
+    import shutil
+    from report_cache import ReportCache, content_key, PDF_SUFFIX, ROWS_SUFFIX
+
+    cache = cache or ReportCache()
+    if large is None:
+        large = len(nodes) >= LARGE_REPORT_ROWS
+    sections = _report_sections(nodes, sort_column, sort_order)
+    keys = [_section_key(items, large) for _, items in sections]
+    report_key = content_key("report", REPORT_LAYOUT_VERSION, [title for title, _ in sections], keys,
+                             large, simulation)
+
+    cached = cache.get(report_key, PDF_SUFFIX)
+    if cached is None:
+        def tables(index, items, col_widths):
+            key = keys[index]
+            rows = None
+            path = cache.get(key, ROWS_SUFFIX)
+            if path is not None:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        rows = json.load(f)
+                except (OSError, ValueError):
+                    rows = None  # запись повреждена — считаем строки заново
+            if rows is None:
+                rows = _table_rows(items)
+                tmp = f"{cache.path(key, ROWS_SUFFIX)}.{os.getpid()}.build"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(rows, f, ensure_ascii=False, separators=(",", ":"))
+                cache.put(key, tmp, suffix=ROWS_SUFFIX)
+            return _risk_tables(rows, col_widths, large)
+
+        tmp = os.path.join(cache.directory, f"{report_key}.{os.getpid()}.build")
+        _render_pdf(tmp, sections, True, large, progress, simulation, tables)
+        cached = cache.put(report_key, tmp, suffix=PDF_SUFFIX)
+        cache.evict(keep=keys + [report_key])
+    elif progress is not None:
+        progress(len(sections), len(sections), 0)
 
-    doc.build(elems)
+    tmp = filename + ".tmp"
+    shutil.copyfile(cached, tmp)
+    os.replace(tmp, filename)
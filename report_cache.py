@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+import threading
+from typing import Optional
+
+# Каталог и предельный размер кэша готовых частей отчёта
+REPORT_CACHE_DIR = "data/report_cache"
+REPORT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Собранные отчёты и строки таблиц разделов (JSON)
+PDF_SUFFIX = ".pdf"
+ROWS_SUFFIX = ".rows"
+# Недописанные файлы (put и сборка отчёта пишут через такие имена) — не части кэша
+_PARTIAL = (".tmp", ".build")
+
+
+def content_key(*parts) -> str:
+    """Ключ по содержимому: sha256 от строкового представления частей."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(repr(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ReportCache:
+    """Готовые части отчёта на диске по ключу содержимого (тип части — суффикс файла).
+
+    Вытеснение — по размеру, самые давно использованные первыми (время
+    использования хранится в mtime файла и обновляется при каждом попадании).
+    """
+
+    def __init__(self, directory: str = REPORT_CACHE_DIR, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str, suffix: str = PDF_SUFFIX) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key: str, suffix: str = PDF_SUFFIX) -> Optional[str]:
+        """Путь к части или None; попадание отмечается как свежее использование."""
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, src: str, move: bool = True, suffix: str = PDF_SUFFIX) -> str:
+        """Кладёт файл в кэш атомарно (через временное имя) и возвращает его путь в кэше."""
+        path = self.path(key, suffix)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if move:
+            shutil.move(src, tmp)
+        else:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, path)
+        return path
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self, keep=()) -> int:
+        """Удаляет самые старые части, пока кэш больше max_bytes; возвращает число удалённых.
+
+        keep — ключи, части которых (любого типа) не удаляются."""
+        keep = set(keep)
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, _, size in entries)
+            removed = 0
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if os.path.splitext(os.path.basename(path))[0] in keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            return removed
+
+    def clear(self):
+        for _, path, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        # (время использования, путь, размер) для всех частей кэша, в том числе
+        # оставшихся от прежних форматов — они вытесняются как самые старые
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(_PARTIAL):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    yield st.st_mtime, entry.path, st.st_size
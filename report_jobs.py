@@ -0,0 +1,212 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+import perf
+from models import RiskNode
+from storage import node_to_dict
+from report import REPORT_FILE
+
+# Состояния задания
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+class ReportJob:
+    """Одно задание на построение PDF (или выгрузку таблицы) и его текущий прогресс.
+
+    kind — "pdf" либо формат выгрузки из export.WRITERS; options — доп. параметры
+    generate_pdf (например, simulation).
+    """
+
+    def __init__(self, job_id: int, records: List[dict], sort_column: str, sort_order: str, filename: str,
+                 on_done: Optional[Callable] = None, on_progress: Optional[Callable] = None, kind: str = "pdf",
+                 options: Optional[dict] = None):
+        self.id = job_id
+        self.kind = kind
+        self.options = options or {}
+        self.records = records  # снимок узлов на момент запроса
+        self.sort_column = sort_column
+        self.sort_order = sort_order
+        self.filename = filename
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.status = JOB_QUEUED
+        self.tables_done = 0
+        self.tables_total = 0
+        self.pages_done = 0
+        self.rows_done = 0
+        self.error = None
+        self.started = None  # time.time() запуска процесса
+        self.ms = None       # время построения в процессе-исполнителе
+        self.process = None
+        self.events = None  # своя очередь у каждого процесса: прерванный процесс не портит чужие
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    @property
+    def tmp_file(self) -> str:
+        # Каждое задание пишет в свой файл и подменяет итоговый только в конце
+        return f"{self.filename}.{os.getpid()}-{self.id}.tmp"
+
+
+def _run_job(kind: str, records: List[dict], sort_column: str, sort_order: str,
+             tmp_file: str, filename: str, events, options: dict):
+    """Тело процесса-исполнителя: строит отчёт и сообщает о ходе работы через очередь.
+
+    Время построения уходит вместе с итогом: замеры perf этого процесса
+    окну не видны, поэтому операцию учитывает poll (см. ReportJobs._poll_job).
+    """
+    start = time.perf_counter()
+
+    def pdf_progress(tables_done, tables_total, pages_done):
+        events.put(("progress", {"tables_done": tables_done, "tables_total": tables_total, "pages_done": pages_done}))
+
+    def export_progress(rows_done):
+        events.put(("progress", {"rows_done": rows_done}))
+
+    try:
+        nodes = [RiskNode(**data) for data in records]
+        if kind == "pdf":
+            from report import generate_pdf
+            generate_pdf(nodes, sort_column=sort_column, sort_order=sort_order,
+                         filename=tmp_file, progress=pdf_progress, **options)
+        else:
+            from export import export_table
+            export_table(nodes, tmp_file, kind, progress=export_progress)
+        os.replace(tmp_file, filename)
+        events.put(("done", {"ms": (time.perf_counter() - start) * 1000}))
+    except Exception as e:
+        events.put(("error", {"ms": (time.perf_counter() - start) * 1000, "error": str(e) or type(e).__name__,
+                              "type": type(e).__name__}))
+
+
+class ReportJobs:
+    """Очередь заданий на отчёты, которые строятся в отдельных процессах.
+
+    Каждое задание получает неизменяемую копию узлов, поэтому дерево можно
+    править во время сборки. Одновременно выполняется до max_workers заданий,
+    остальные ждут. poll() вызывается из потока Tk (через after): он принимает
+    прогресс, запускает ожидающие задания и вызывает on_progress/on_done.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # spawn: дочерний процесс не наследует Tk и фоновые потоки родителя
+        self._ctx = multiprocessing.get_context("spawn")
+        self._ids = itertools.count(1)
+        self._pending = deque()
+        self.jobs: Dict[int, ReportJob] = {}
+
+    def submit(self, nodes: List[RiskNode], sort_column: str, sort_order: str, filename: str = REPORT_FILE,
+               on_done: Optional[Callable] = None, on_progress: Optional[Callable] = None,
+               kind: str = "pdf", options: Optional[dict] = None) -> ReportJob:
+        """Ставит отчёт в очередь; nodes — уже отсортированный список, как для generate_pdf."""
+        job = ReportJob(next(self._ids), [node_to_dict(n) for n in nodes], sort_column, sort_order,
+                        filename, on_done, on_progress, kind, options)
+        self.jobs[job.id] = job
+        self._pending.append(job)
+        self._start_pending()
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """Отменяет задание (ожидающее или уже идущее); False, если оно уже завершено."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        if job.status == JOB_QUEUED:
+            self._pending.remove(job)
+        else:
+            job.process.terminate()
+            job.process.join()
+        self._remove_tmp(job)
+        self._finish(job, JOB_CANCELLED)
+        self._start_pending()
+        return True
+
+    def cancel_all(self) -> int:
+        return sum(self.cancel(job.id) for job in self.active())
+
+    def active(self) -> List[ReportJob]:
+        """Задания, которые ещё ждут или выполняются (в порядке запроса)."""
+        return list(self.jobs.values())
+
+    def poll(self):
+        """Разбирает сообщения исполнителей и запускает ожидающие задания (поток Tk)."""
+        for job in self.active():
+            if job.status == JOB_RUNNING:
+                self._poll_job(job)
+        self._start_pending()
+
+    def shutdown(self):
+        """Останавливает все задания (при закрытии программы)."""
+        self.cancel_all()
+
+    # ----------------- Внутреннее -----------------
+    def _running(self) -> int:
+        return sum(1 for job in self.jobs.values() if job.status == JOB_RUNNING)
+
+    def _poll_job(self, job: ReportJob):
+        while True:
+            try:
+                kind, payload = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                for field, value in payload.items():
+                    setattr(job, field, value)
+                if job.on_progress is not None:
+                    job.on_progress(job)
+            else:
+                job.process.join()
+                job.ms = payload["ms"]
+                if kind == "error":
+                    job.error = payload["error"]
+                    self._remove_tmp(job)
+                perf.record("generate_pdf" if job.kind == "pdf" else f"export_{job.kind}",
+                            job.started, job.ms, job.process.name, payload.get("type"))
+                self._finish(job, JOB_DONE if kind == "done" else JOB_FAILED)
+                return
+        # Процесс мог упасть, не успев ничего сообщить
+        if job.process.exitcode not in (None, 0):
+            job.error = f"процесс построения завершился с кодом {job.process.exitcode}"
+            self._remove_tmp(job)
+            self._finish(job, JOB_FAILED)
+
+    def _start_pending(self):
+        while self._pending and self._running() < self.max_workers:
+            job = self._pending.popleft()
+            job.events = self._ctx.Queue()
+            job.process = self._ctx.Process(
+                target=_run_job, name=f"report-{job.id}", daemon=True,
+                args=(job.kind, job.records, job.sort_column, job.sort_order,
+                      job.tmp_file, job.filename, job.events, job.options))
+            job.started = time.time()
+            job.process.start()
+            job.records = None  # снимок уже передан процессу
+            job.status = JOB_RUNNING
+
+    def _finish(self, job: ReportJob, status: str):
+        job.status = status
+        job.records = None
+        if job.events is not None:
+            job.events.close()
+            job.events = None
+        del self.jobs[job.id]
+        if job.on_done is not None:
+            job.on_done(job)
+
+    @staticmethod
+    def _remove_tmp(job: ReportJob):
+        try:
+            os.remove(job.tmp_file)
+        except OSError:
+            pass
@@ -0,0 +1,139 @@
+import atexit
+import threading
+import time
+from typing import Dict
+from models import RiskNode, ChangeSet
+from storage import snapshot_changes, save_records
+
+# Состояния сохранения для строки статуса в интерфейсе
+STATUS_SAVED = "saved"
+STATUS_PENDING = "pending"
+STATUS_SAVING = "saving"
+STATUS_ERROR = "error"
+
+
+class SaveScheduler:
+    """Отложенное сохранение правок в фоновом потоке.
+
+    mark() сразу снимает копию только изменённых узлов и складывает её в очередь;
+    правки, пришедшие в пределах окна window (сек.), объединяются, и поток пишет
+    их одной записью — не чаще одного раза за окно, как бы часто ни шли правки.
+    """
+
+    def __init__(self, window: float = 0.5, write=save_records):
+        self.window = window
+        self._write = write
+        self._cond = threading.Condition()
+        self._upserts: Dict[int, dict] = {}
+        self._deletes = []
+        self._reorders: Dict[int, list] = {}
+        self._first_mark = None
+        self._writing = False
+        self._completed = 0  # число завершённых попыток записи
+        self._flush_now = False
+        self._closed = False
+        self.status = STATUS_SAVED
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="save-worker", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def mark(self, nodes: Dict[int, RiskNode], changes: ChangeSet):
+        """Ставит правку в очередь на сохранение (вызывается из потока Tk)."""
+        upserts, deletes, reorders = snapshot_changes(nodes, changes)
+        with self._cond:
+            for nid in deletes:
+                self._upserts.pop(nid, None)
+                self._reorders.pop(nid, None)
+                self._deletes.append(nid)
+            for nid, data in upserts.items():
+                self._upserts[nid] = data
+                # порядок детей в очереди должен совпадать с более свежим upsert
+                if nid in self._reorders:
+                    self._reorders[nid] = list(data["children"])
+            self._reorders.update(reorders)
+            if self._first_mark is None:
+                self._first_mark = time.monotonic()
+            self.status = STATUS_PENDING
+            self._cond.notify_all()
+
+    def flush(self, timeout=None) -> bool:
+        """Записывает очередь немедленно и ждёт окончания записи.
+
+        Возвращает False, если запись не удалась или не уложилась в timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_now = True
+            self._cond.notify_all()
+            started = self._completed
+            try:
+                while self._has_pending() or self._writing:
+                    if self._completed > started and self.error is not None:
+                        return False
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_now = False
+        return True
+
+    def close(self):
+        """Сбрасывает очередь и останавливает поток (при выходе из программы)."""
+        if self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _requeue(self, upserts, deletes, reorders):
+        # Неудачная запись возвращается в очередь под более свежими правками и повторяется через окно
+        for nid, data in upserts.items():
+            if nid not in self._deletes:
+                self._upserts.setdefault(nid, data)
+        self._deletes[:0] = deletes
+        for pid, children in reorders.items():
+            self._reorders.setdefault(pid, children)
+        self._first_mark = time.monotonic()
+
+    def _has_pending(self):
+        return bool(self._upserts or self._deletes or self._reorders)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._has_pending() and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._has_pending():
+                    return
+                # Ждём конца окна, собирая правки в одну запись
+                while not (self._closed or self._flush_now):
+                    remaining = self._first_mark + self.window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = (self._upserts, self._deletes, self._reorders)
+                self._upserts, self._deletes, self._reorders = {}, [], {}
+                self._first_mark = None
+                self._writing = True
+                self.status = STATUS_SAVING
+            try:
+                self._write(*batch)
+                error = None
+            except Exception as e:
+                error = e
+            with self._cond:
+                self._writing = False
+                self._completed += 1
+                self.error = error
+                if error is not None:
+                    self._requeue(*batch)
+                    self.status = STATUS_ERROR
+                elif not self._has_pending():
+                    self.status = STATUS_SAVED
+                self._cond.notify_all()
+                if error is not None and self._closed:
+                    return
@@ -0,0 +1,254 @@
+"""Пакетная оценка сценариев «что если» без изменения дерева.
+
+    engine = ScenarioEngine(app.nodes)
+    moscow = engine.find("г. Москва")
+    results = engine.evaluate([Scenario("P ×1.2", [Override(moscow, "prob", "mul", 1.2)])]
+                              + grid(moscow, "severity", [1, 2, 3, 4, 5]))
+    results.group["risk"], results.city("г. Москва")["risk"]
+
+Параметры родителей в программе — средние по детям (см. aggregate.py), поэтому
+значение города или группы — взвешенная сумма значений листьев. Сценарий меняет
+только листья выбранных поддеревьев, и каждый сценарий считается как разность
+с исходным деревом: работа пропорциональна числу затронутых листьев, а все
+сценарии сводятся одним np.bincount.
+"""
+import importlib.util
+import itertools
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Sequence
+from models import RiskNode
+
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+# Изменяемые параметры листьев и их допустимые границы (как в on_save_risk)
+FIELDS = ("prob", "loss_min", "loss_max", "severity")
+BOUNDS = {"prob": (0.0, 1.0), "loss_min": (0.0, None), "loss_max": (0.0, None), "severity": (1.0, 5.0)}
+OPS = ("set", "mul", "add")
+
+# Показатели результата: параметры (средние, как у узлов в дереве) и производные
+METRICS = FIELDS + ("expected_min", "expected_max", "risk")
+
+
+@dataclass(frozen=True)
+class Override:
+    """Изменение параметра field у всех листьев поддерева node_id: set / mul / add на value."""
+    node_id: int
+    field: str
+    op: str = "set"
+    value: float = 0.0
+
+
+@dataclass
+class Scenario:
+    name: str
+    overrides: List[Override] = field(default_factory=list)
+
+
+def grid(node_id: int, field: str, values: Iterable[float], op: str = "set",
+         base: Sequence[Override] = ()) -> List[Scenario]:
+    """Сценарии по сетке значений одного параметра (поверх общих изменений base)."""
+    return [Scenario(f"{field} {op} {value}", list(base) + [Override(node_id, field, op, value)])
+            for value in values]
+
+
+def grid_product(*axes, base: Sequence[Override] = ()) -> List[Scenario]:
+    """Все сочетания нескольких сеток; ось — (node_id, field, values) или (node_id, field, values, op)."""
+    expanded = [[Override(axis[0], axis[1], axis[3] if len(axis) > 3 else "set", value) for value in axis[2]]
+                for axis in axes]
+    return [Scenario(", ".join(f"{o.field} {o.op} {o.value}" for o in combo), list(base) + list(combo))
+            for combo in itertools.product(*expanded)]
+
+
+class ScenarioResults:
+    """Результаты по сценариям: group[metric] — массив (сценарии,), cities[metric] — (сценарии, города).
+
+    Итоги группы expected_min/expected_max — суммы по листьям, как в итоговой
+    панели (leaf_totals); остальные показатели — значения корня и городов
+    в том виде, в каком они были бы в дереве после пересчёта.
+    """
+
+    def __init__(self, names: List[str], city_names: List[str], group: dict, cities: dict, base: dict):
+        self.names = names
+        self.city_names = city_names
+        self.group = group
+        self.cities = cities
+        self.base = base  # те же показатели для дерева без изменений: {"group": {...}, "cities": {...}}
+
+    def __len__(self):
+        return len(self.names)
+
+    def city(self, name: str) -> dict:
+        i = self.city_names.index(name)
+        return {metric: values[:, i] for metric, values in self.cities.items()}
+
+    def rows(self) -> Iterable[dict]:
+        """Сводка по сценариям: имя и показатели группы."""
+        for s, name in enumerate(self.names):
+            yield {"scenario": name, **{metric: float(values[s]) for metric, values in self.group.items()}}
+
+
+class ScenarioEngine:
+    """Снимок дерева для оценки сценариев; сам словарь узлов не меняется.
+
+    Листья хранятся в порядке обхода в глубину, поэтому листья любого
+    поддерева — непрерывный диапазон.
+    """
+
+    def __init__(self, nodes: Dict[int, RiskNode], root_id: int = 1):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy не установлен")
+        import numpy as np
+
+        self.nodes = nodes
+        self.root_id = root_id
+        self._range: Dict[int, tuple] = {}
+        self._by_name: Dict[str, int] = {}
+        leaves: List[RiskNode] = []
+        root_weight: List[float] = []
+        city_weight: List[float] = []
+        city_of: List[int] = []
+        city_names: List[str] = []
+
+        # Вес листа в среднем предка — произведение 1/(число детей) на пути вниз
+        stack = [(root_id, 1.0, -1, 1.0, False)]
+        while stack:
+            nid, w_root, city, w_city, leave = stack.pop()
+            node = nodes[nid]
+            if leave:
+                self._range[nid] = (self._range[nid], len(leaves))
+                continue
+            self._by_name.setdefault(node.name, nid)
+            if node.name.startswith("г."):
+                city, w_city = len(city_names), 1.0
+                city_names.append(node.name)
+            self._range[nid] = len(leaves)
+            stack.append((nid, 0.0, 0, 0.0, True))
+            if node.children:
+                k = len(node.children)
+                stack.extend((cid, w_root / k, city, w_city / k, False) for cid in reversed(node.children))
+            else:
+                leaves.append(node)
+                root_weight.append(w_root)
+                city_weight.append(w_city if city >= 0 else 0.0)
+                city_of.append(max(city, 0))
+
+        n = len(leaves)
+        self.leaves = leaves
+        self.city_names = city_names
+        self.values = {
+            "prob": np.fromiter((x.prob or 0.0 for x in leaves), dtype=np.float64, count=n),
+            "loss_min": np.fromiter((x.loss_min or 0.0 for x in leaves), dtype=np.float64, count=n),
+            "loss_max": np.fromiter((x.loss_max or 0.0 for x in leaves), dtype=np.float64, count=n),
+            "severity": np.fromiter((x.severity or 1.0 for x in leaves), dtype=np.float64, count=n),
+        }
+        self.root_weight = np.array(root_weight, dtype=np.float64)
+        self.city_weight = np.array(city_weight, dtype=np.float64)
+        self.city_of = np.array(city_of, dtype=np.intp)
+        self._base = self._aggregate(self.values)
+
+    def find(self, name: str) -> int:
+        """id узла по имени (первый при обходе дерева)."""
+        if name not in self._by_name:
+            raise KeyError(f"Узел не найден: {name}")
+        return self._by_name[name]
+
+    def leaf_range(self, node_id: int) -> tuple:
+        """Диапазон [start, stop) листьев поддерева в порядке обхода."""
+        if node_id not in self._range:
+            raise KeyError(f"Узел {node_id} не входит в дерево")
+        return self._range[node_id]
+
+    # ----------------- Расчёт -----------------
+    def _aggregate(self, values: dict) -> dict:
+        """Показатели корня и городов для полного набора значений листьев."""
+        import numpy as np
+        n_cities = len(self.city_names)
+        group = {f: float(self.root_weight @ values[f]) for f in FIELDS}
+        cities = {f: np.bincount(self.city_of, weights=self.city_weight * values[f], minlength=n_cities)
+                  for f in FIELDS}
+        group["expected_min"] = float(values["prob"] @ values["loss_min"])
+        group["expected_max"] = float(values["prob"] @ values["loss_max"])
+        group["risk"] = group["prob"] * group["severity"]
+        cities["expected_min"] = cities["prob"] * cities["loss_min"]
+        cities["expected_max"] = cities["prob"] * cities["loss_max"]
+        cities["risk"] = cities["prob"] * cities["severity"]
+        return {"group": group, "cities": cities}
+
+    def _touched(self, scenario: Scenario):
+        """Затронутые листья сценария и их значения после всех изменений (по порядку)."""
+        import numpy as np
+        ranges = [self.leaf_range(o.node_id) for o in scenario.overrides]
+        # Поддеревья либо вложены, либо не пересекаются — сливаем диапазоны без сортировки листьев
+        merged = []
+        for a, b in sorted(ranges):
+            if merged and a <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], b)
+            else:
+                merged.append([a, b])
+        idx = np.concatenate([np.arange(a, b) for a, b in merged]) if merged else np.zeros(0, np.intp)
+        new = {f: self.values[f][idx] for f in FIELDS}
+        for o, (a, b) in zip(scenario.overrides, ranges):
+            if o.field not in FIELDS:
+                raise ValueError(f"Неизвестный параметр: {o.field}")
+            lo, hi = np.searchsorted(idx, a), np.searchsorted(idx, b)
+            column = new[o.field][lo:hi]
+            if o.op == "set":
+                column[:] = o.value
+            elif o.op == "mul":
+                column *= o.value
+            elif o.op == "add":
+                column += o.value
+            else:
+                raise ValueError(f"Неизвестная операция: {o.op}")
+            low, high = BOUNDS[o.field]
+            np.clip(column, low, high, out=column)
+        # Как в on_save_risk: мин. потери не больше макс.
+        lmin, lmax = new["loss_min"], new["loss_max"]
+        new["loss_min"], new["loss_max"] = np.minimum(lmin, lmax), np.maximum(lmin, lmax)
+        return idx, new
+
+    def evaluate(self, scenarios: Sequence[Scenario]) -> ScenarioResults:
+        """Показатели группы и городов для каждого сценария одним пакетом."""
+        import numpy as np
+        n_scen, n_cities = len(scenarios), len(self.city_names)
+
+        # Плоский список (сценарий, лист, новые значения) по всем сценариям
+        scen_parts, idx_parts, new_parts = [], [], {f: [] for f in FIELDS}
+        for s, scenario in enumerate(scenarios):
+            idx, new = self._touched(scenario)
+            scen_parts.append(np.full(len(idx), s, dtype=np.intp))
+            idx_parts.append(idx)
+            for f in FIELDS:
+                new_parts[f].append(new[f])
+        scen = np.concatenate(scen_parts) if scen_parts else np.zeros(0, np.intp)
+        idx = np.concatenate(idx_parts) if idx_parts else np.zeros(0, np.intp)
+        new = {f: np.concatenate(new_parts[f]) if idx_parts else np.zeros(0) for f in FIELDS}
+        old = {f: self.values[f][idx] for f in FIELDS}
+
+        def delta(weights):
+            return np.bincount(scen, weights=weights, minlength=n_scen)
+
+        city_key = scen * n_cities + self.city_of[idx]
+
+        def city_delta(weights):
+            return np.bincount(city_key, weights=weights, minlength=n_scen * n_cities).reshape(n_scen, n_cities)
+
+        base_group, base_cities = self._base["group"], self._base["cities"]
+        group, cities = {}, {}
+        for f in FIELDS:
+            d = new[f] - old[f]
+            group[f] = base_group[f] + delta(self.root_weight[idx] * d)
+            cities[f] = base_cities[f] + (city_delta(self.city_weight[idx] * d) if n_cities else
+                                          np.zeros((n_scen, 0)))
+        group["expected_min"] = base_group["expected_min"] + delta(new["prob"] * new["loss_min"] - old["prob"] * old["loss_min"])
+        group["expected_max"] = base_group["expected_max"] + delta(new["prob"] * new["loss_max"] - old["prob"] * old["loss_max"])
+        group["risk"] = group["prob"] * group["severity"]
+        cities["expected_min"] = cities["prob"] * cities["loss_min"]
+        cities["expected_max"] = cities["prob"] * cities["loss_max"]
+        cities["risk"] = cities["prob"] * cities["severity"]
+        return ScenarioResults([s.name for s in scenarios], self.city_names, group, cities, self._base)
+
+
+def evaluate(nodes: Dict[int, RiskNode], scenarios: Sequence[Scenario], root_id: int = 1) -> ScenarioResults:
+    """Разовая оценка: снимок дерева и все сценарии одним вызовом."""
+    return ScenarioEngine(nodes, root_id).evaluate(scenarios)
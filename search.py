@@ -0,0 +1,268 @@
+import bisect
+import importlib.util
+from dataclasses import dataclass
+from itertools import accumulate, islice
+from typing import Dict, List, Optional, Set
+from models import RiskNode, ChangeSet
+
+# Основной индекс строится колонками NumPy; без него все n-граммы лежат в множествах
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+# Длина n-граммы; запросы короче ищутся как начало названия
+GRAM = 3
+PAGE_SIZE = 50
+# Новые названия копятся в дополнительном индексе; когда их становится больше
+# четверти основного (но не меньше этого числа), основной индекс перестраивается
+OVERLAY_MIN_REBUILD = 50_000
+# Меньше этого числа названий основной индекс на NumPy не строится
+NUMPY_MIN_NAMES = 2_000
+# Пересечение списков останавливается, когда кандидатов осталось столько — дальше дешевле проверить строкой
+CANDIDATES_ENOUGH = 64
+
+# Символы, после которых совпадение считается началом слова
+_WORD_BREAKS = set(" .,;:-–—/\\\"'«»()№#")
+
+
+@dataclass
+class SearchPage:
+    ids: List[int]  # id узлов на странице, в порядке ранжирования
+    total: int      # всего совпадений
+    page: int
+    pages: int
+
+
+def _gram_key(gram: str) -> int:
+    # Три кода Unicode по 21 биту — одно целое на n-грамму
+    return (ord(gram[0]) << 42) | (ord(gram[1]) << 21) | ord(gram[2])
+
+
+def _rank(query: str, name: str) -> tuple:
+    """Порядок выдачи: точное совпадение, начало названия, начало слова, остальное;
+    внутри — раньше совпадение, короче название."""
+    pos = name.find(query)
+    if name == query:
+        tier = 0
+    elif pos == 0:
+        tier = 1
+    elif name[pos - 1] in _WORD_BREAKS:
+        tier = 2
+    else:
+        tier = 3
+    return tier, pos, len(name), name
+
+
+class SearchIndex:
+    """Поиск узлов по названию: подстрока (по n-граммам) и начало названия.
+
+    Индексируются различные названия (без учёта регистра), а не узлы: одинаковые
+    названия систем в разных магазинах занимают одну запись. Основная часть
+    n-грамм хранится в отсортированных массивах NumPy, новые названия — в
+    небольшом дополнительном индексе на множествах, поэтому правки (apply)
+    обходятся без перестройки. Названия, у которых не осталось узлов, не
+    удаляются из n-грамм, а отсеиваются при поиске.
+    """
+
+    def __init__(self, nodes: Optional[Dict[int, RiskNode]] = None):
+        self._reset()
+        if nodes is not None:
+            self.rebuild(nodes)
+
+    def _reset(self):
+        self.built = False  # пока False, названия не идут в n-граммы по одному (см. _new_name)
+        self._name_of: Dict[int, str] = {}          # id узла -> название в нижнем регистре
+        self._ids: Dict[str, Dict[int, None]] = {}  # название -> id узлов (по порядку добавления)
+        self._slot: Dict[str, int] = {}             # название -> номер в _names
+        self._names: List[str] = []
+        self._sorted: List[str] = []                # различные названия по алфавиту — для коротких запросов
+        self._base = None                           # (ключи n-грамм, границы, номера названий)
+        self._base_slots = 0
+        self._overlay: Dict[str, Set[int]] = {}     # n-граммы названий с номерами от _base_slots
+        self._cache = None                          # (запрос, названия по рангу, накопленные числа узлов)
+
+    def __len__(self):
+        return len(self._name_of)
+
+    # ----------------- Построение и правки -----------------
+    def rebuild(self, nodes: Dict[int, RiskNode]):
+        self._reset()
+        for node in nodes.values():
+            self._add_node(node.id, node.name.lower())
+        self._build_base()
+        self.built = True
+
+    def add(self, node_id: int, name: str):
+        if node_id in self._name_of:
+            self.remove(node_id)
+        self._add_node(node_id, name.lower())
+        self._after_change()
+
+    def remove(self, node_id: int):
+        name = self._name_of.pop(node_id, None)
+        if name is None:
+            return
+        ids = self._ids[name]
+        ids.pop(node_id, None)
+        if not ids:
+            del self._ids[name]
+        self._cache = None
+
+    def rename(self, node_id: int, name: str):
+        self.add(node_id, name)
+
+    def apply(self, nodes: Dict[int, RiskNode], changes: ChangeSet):
+        """Обновляет индекс по изменениям модели (как SaveScheduler.mark); до rebuild ничего не делает."""
+        if not self.built:
+            return
+        for nid in changes.removed:
+            if nid not in nodes:
+                self.remove(nid)
+        for nid in list(changes.inserted) + list(changes.updated):
+            node = nodes.get(nid)
+            if node is not None and self._name_of.get(nid) != node.name.lower():
+                self.add(nid, node.name)
+
+    def _add_node(self, node_id: int, name: str):
+        self._name_of[node_id] = name
+        ids = self._ids.get(name)
+        if ids is None:
+            ids = self._ids[name] = {}
+            if name not in self._slot:
+                self._new_name(name)
+        ids[node_id] = None
+        self._cache = None
+
+    def _new_name(self, name: str):
+        slot = self._slot[name] = len(self._names)
+        self._names.append(name)
+        if not self.built:
+            return  # при rebuild n-граммы строит _build_base
+        bisect.insort(self._sorted, name)
+        for i in range(len(name) - GRAM + 1):
+            self._overlay.setdefault(name[i:i + GRAM], set()).add(slot)
+
+    def _after_change(self):
+        overlay = len(self._names) - self._base_slots
+        if overlay > max(OVERLAY_MIN_REBUILD, self._base_slots // 4):
+            self._build_base()
+
+    def _build_base(self):
+        """Переносит все живые названия в основной индекс (мёртвые выбрасываются)."""
+        names = list(self._ids)
+        self._slot = {name: i for i, name in enumerate(names)}
+        self._names = names
+        self._sorted = sorted(names)
+        self._overlay = {}
+        self._base = None
+        self._base_slots = 0
+        self._cache = None
+        if not NUMPY_AVAILABLE or len(names) < NUMPY_MIN_NAMES:
+            for slot, name in enumerate(names):
+                for i in range(len(name) - GRAM + 1):
+                    self._overlay.setdefault(name[i:i + GRAM], set()).add(slot)
+            return
+
+        import numpy as np
+        # Все названия одной строкой через \0; n-граммы, задевающие разделитель, отбрасываются
+        codes = np.frombuffer("\0".join(names).encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+        lengths = np.fromiter(map(len, names), dtype=np.int64, count=len(names))
+        slot_of = np.repeat(np.arange(len(names), dtype=np.int32), lengths + 1)[:len(codes)]
+        sep = codes == 0
+        valid = ~(sep[:-2] | sep[1:-1] | sep[2:])
+        keys = ((codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:])[valid]
+        slots = slot_of[:-2][valid]
+
+        order = np.lexsort((slots, keys))
+        keys, slots = keys[order], slots[order]
+        if len(keys):
+            fresh = np.ones(len(keys), dtype=bool)
+            fresh[1:] = (keys[1:] != keys[:-1]) | (slots[1:] != slots[:-1])
+            keys, slots = keys[fresh], slots[fresh]
+        uniq, starts = np.unique(keys, return_index=True)
+        self._base = (uniq, np.append(starts, len(keys)), slots)
+        self._base_slots = len(names)
+
+    # ----------------- Поиск -----------------
+    def _candidates(self, query: str):
+        """Номера названий, содержащих все n-граммы запроса (надмножество совпадений)."""
+        grams = {query[i:i + GRAM] for i in range(len(query) - GRAM + 1)}
+        found = []
+        if self._base is not None:
+            import numpy as np
+            keys, bounds, slots = self._base
+            lists = []
+            for gram in grams:
+                k = _gram_key(gram)
+                i = np.searchsorted(keys, k)
+                if i == len(keys) or keys[i] != k:
+                    lists = None
+                    break
+                lists.append(slots[bounds[i]:bounds[i + 1]])
+            if lists is not None:
+                lists.sort(key=len)
+                result = lists[0]
+                for other in lists[1:]:
+                    if len(result) <= CANDIDATES_ENOUGH:
+                        break
+                    # Оба списка отсортированы: ищем элементы меньшего в большем
+                    pos = np.searchsorted(other, result)
+                    result = result[other[np.minimum(pos, len(other) - 1)] == result]
+                found.extend(result.tolist())
+
+        sets = [self._overlay.get(gram) for gram in grams]
+        if sets and all(sets):
+            sets.sort(key=len)
+            result = sets[0]
+            for other in sets[1:]:
+                if len(result) <= CANDIDATES_ENOUGH:
+                    break
+                result = result & other
+            found.extend(result)
+        return found
+
+    def _matches(self, query: str) -> List[str]:
+        """Живые названия, подходящие под запрос."""
+        if len(query) < GRAM:
+            # Короткий запрос — начало названия, по алфавитному списку
+            i = bisect.bisect_left(self._sorted, query)
+            names = []
+            for name in islice(self._sorted, i, None):
+                if not name.startswith(query):
+                    break
+                names.append(name)
+        else:
+            names = [self._names[slot] for slot in self._candidates(query)]
+            names = [name for name in names if query in name]
+        return [name for name in names if name in self._ids]
+
+    def _ranked(self, query: str):
+        query = query.strip().lower()
+        if self._cache is None or self._cache[0] != query:
+            names = sorted(self._matches(query), key=lambda name: _rank(query, name)) if query else []
+            counts = list(accumulate(len(self._ids[name]) for name in names))
+            self._cache = (query, names, counts)
+        return self._cache
+
+    def count(self, query: str) -> int:
+        _, _, counts = self._ranked(query)
+        return counts[-1] if counts else 0
+
+    def result_at(self, query: str, position: int) -> Optional[int]:
+        """id узла на позиции position выдачи (None, если совпадений меньше)."""
+        ids = self.search(query, page=position, page_size=1).ids
+        return ids[0] if ids else None
+
+    def search(self, query: str, page: int = 0, page_size: int = PAGE_SIZE) -> SearchPage:
+        """Страница выдачи. Ранжирование и подсчёт делаются один раз на запрос и
+        запоминаются до следующей правки, поэтому листание страниц дёшево."""
+        _, names, counts = self._ranked(query)
+        total = counts[-1] if counts else 0
+        start, stop = page * page_size, min((page + 1) * page_size, total)
+        ids = []
+        i = bisect.bisect_right(counts, start)
+        while start < stop:
+            before = counts[i - 1] if i else 0
+            take = min(stop, counts[i]) - start
+            ids.extend(islice(self._ids[names[i]], start - before, start - before + take))
+            start += take
+            i += 1
+        return SearchPage(ids, total, page, (total + page_size - 1) // page_size)
@@ -0,0 +1,356 @@
+"""Двоичный снимок дерева (.snap): открывается через mmap за O(1), без разбора всего файла.
+
+    python -m snapshot data/nodes.json data/nodes.snap   # и обратно: nodes.snap nodes.json
+
+    with Snapshot("data/nodes.snap") as snap:
+        root = snap[1]                      # RiskNode собирается только для запрошенного узла
+        snap.column("prob")                 # колонка NumPy прямо поверх файла, без копии
+
+Раскладка (little-endian, разделы выровнены по 8 байт):
+    заголовок  HEADER: сигнатура, версия, число узлов / детей / названий, смещения разделов
+    записи     RECORD на узел, по возрастанию id: id, parent_id (NO_PARENT — корень),
+               prob, loss_min, loss_max, severity, номер названия
+    child_ptr  (узлы + 1) × uint64: дети строки i — children[child_ptr[i]:child_ptr[i + 1]]
+    children   int64, id детей по порядку
+    name_ptr   (названия + 1) × uint64: границы названия в строковой таблице
+    names      UTF-8 различных названий подряд (одинаковые названия систем — одна запись)
+"""
+import importlib.util
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from models import RiskNode
+
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+MAGIC = b"RMSNAP\0\0"
+VERSION = 1
+NO_PARENT = -1
+
+# сигнатура, версия; число узлов, детей, названий, байт строк; смещения пяти разделов
+HEADER = struct.Struct("<8sI4x4Q5Q")
+# id, parent_id, prob, loss_min, loss_max, severity, номер названия (+4 байта выравнивания)
+RECORD = struct.Struct("<qqddddI4x")
+_ID = struct.Struct("<q")
+FIELDS = ("id", "parent_id", "prob", "loss_min", "loss_max", "severity", "name")
+
+
+def _record_dtype():
+    import numpy as np
+    return np.dtype({"names": list(FIELDS),
+                     "formats": ["<i8", "<i8", "<f8", "<f8", "<f8", "<f8", "<u4"],
+                     "offsets": [0, 8, 16, 24, 32, 40, 48],
+                     "itemsize": RECORD.size})
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _check_byteorder():
+    # Разделы читаются memoryview.cast в родном порядке байт
+    if sys.byteorder != "little":
+        raise RuntimeError("Двоичный снимок поддерживается только на little-endian платформах")
+
+
+# ----------------- Запись -----------------
+def write_snapshot(nodes: Dict[int, RiskNode], path: str):
+    """Пишет снимок через временный файл и rename, как storage._write_snapshot."""
+    _check_byteorder()
+    rows = sorted(nodes.values(), key=attrgetter("id"))
+    n = len(rows)
+    records = bytearray(n * RECORD.size)
+    child_ptr = array("Q", [0])
+    children = array("q")
+    name_index: Dict[str, int] = {}
+    name_ptr = array("Q", [0])
+    blob = bytearray()
+    for i, node in enumerate(rows):
+        k = name_index.get(node.name)
+        if k is None:
+            k = name_index[node.name] = len(name_index)
+            blob += node.name.encode("utf-8")
+            name_ptr.append(len(blob))
+        RECORD.pack_into(records, i * RECORD.size, node.id,
+                         NO_PARENT if node.parent_id is None else node.parent_id,
+                         node.prob or 0.0, node.loss_min or 0.0, node.loss_max or 0.0,
+                         1.0 if node.severity is None else node.severity, k)
+        children.extend(node.children)
+        child_ptr.append(len(children))
+
+    sections = [records, child_ptr, children, name_ptr, blob]
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offset = _align(offset)
+        offsets.append(offset)
+        offset += len(section) * (section.itemsize if isinstance(section, array) else 1)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n, len(children), len(name_index), len(blob), *offsets))
+        for start, section in zip(offsets, sections):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ----------------- Чтение -----------------
+class _IdColumn:
+    """id по номеру строки — последовательность для bisect без копирования колонки."""
+
+    def __init__(self, records: memoryview, size: int):
+        self._records = records
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, row: int) -> int:
+        return _ID.unpack_from(self._records, row * RECORD.size)[0]
+
+
+class Snapshot:
+    """Снимок, открытый через mmap: отображение id -> RiskNode только для чтения.
+
+    Открытие читает один заголовок. Узел собирается при обращении (snap[id]),
+    название декодируется тогда же; колонки записей доступны без копирования
+    через memoryview (children) и NumPy (records / column).
+    """
+
+    def __init__(self, path: str):
+        _check_byteorder()
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, version, n, n_children, n_names, n_bytes,
+             off_records, off_child_ptr, off_children, off_name_ptr, off_names) = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path}: это не снимок узлов")
+            if version != VERSION:
+                raise ValueError(f"{path}: неподдерживаемая версия снимка {version}")
+        except Exception:
+            self._file.close()
+            raise
+        view = memoryview(self._mm)
+        self._size = n
+        self._records = view[off_records:off_records + n * RECORD.size]
+        self.child_ptr = view[off_child_ptr:off_child_ptr + (n + 1) * 8].cast("Q")
+        self._children = view[off_children:off_children + n_children * 8].cast("q")
+        self._name_ptr = view[off_name_ptr:off_name_ptr + (n_names + 1) * 8].cast("Q")
+        self._names = view[off_names:off_names + n_bytes]
+        self._views = [self._records, self.child_ptr, self._children, self._name_ptr, self._names, view]
+        self._ids = _IdColumn(self._records, n)
+        self.name_count = n_names
+
+    def close(self):
+        try:
+            for view in self._views:
+                view.release()
+            self._mm.close()
+        except BufferError:
+            # Наружу отданы срезы или массивы NumPy поверх файла — mmap закроется вместе с ними
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----------------- Отображение id -> узел -----------------
+    def __len__(self):
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        for row in range(self._size):
+            yield self._ids[row]
+
+    def __contains__(self, node_id) -> bool:
+        return self.row(node_id) is not None
+
+    def __getitem__(self, node_id: int) -> RiskNode:
+        row = self.row(node_id)
+        if row is None:
+            raise KeyError(node_id)
+        return self.node(row)
+
+    def get(self, node_id: int, default=None) -> Optional[RiskNode]:
+        row = self.row(node_id)
+        return default if row is None else self.node(row)
+
+    def row(self, node_id: int) -> Optional[int]:
+        """Номер строки узла (бинарный поиск по id) или None."""
+        row = bisect_left(self._ids, node_id)
+        return row if row < self._size and self._ids[row] == node_id else None
+
+    # ----------------- Строки -----------------
+    def name(self, index: int) -> str:
+        """Название по номеру в строковой таблице (декодируется при каждом вызове)."""
+        return str(self._names[self._name_ptr[index]:self._name_ptr[index + 1]], "utf-8")
+
+    def children(self, row: int) -> memoryview:
+        """id детей строки — срез поверх файла, без копирования."""
+        return self._children[self.child_ptr[row]:self.child_ptr[row + 1]]
+
+    def _node(self, row: int, record: tuple, name: str) -> RiskNode:
+        node_id, parent_id, prob, loss_min, loss_max, severity, _ = record
+        start, stop = self.child_ptr[row], self.child_ptr[row + 1]
+        # bytes в array('q', ...) копируются одним memcpy, а не по элементу
+        children = self._children[start:stop].tobytes() if stop > start else ()
+        return RiskNode(node_id, name, prob, loss_min, loss_max, severity,
+                        None if parent_id == NO_PARENT else parent_id, children)
+
+    def node(self, row: int) -> RiskNode:
+        record = RECORD.unpack_from(self._records, row * RECORD.size)
+        return self._node(row, record, self.name(record[-1]))
+
+    def iter_nodes(self) -> Iterator[RiskNode]:
+        """Все узлы по возрастанию id; каждое название декодируется один раз."""
+        names: Dict[int, str] = {}
+        for row, record in enumerate(RECORD.iter_unpack(self._records)):
+            name = names.get(record[-1])
+            if name is None:
+                name = names[record[-1]] = self.name(record[-1])
+            yield self._node(row, record, name)
+
+    def to_nodes(self) -> Dict[int, RiskNode]:
+        """Словарь узлов, как storage.load_nodes (parent_id — тот же объект int, что id родителя)."""
+        from storage import _share_ids
+        return _share_ids({node.id: node for node in self.iter_nodes()})
+
+    # ----------------- Колонки NumPy -----------------
+    def records(self):
+        """Все записи как структурный массив NumPy поверх mmap (только чтение, без копии)."""
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy не установлен")
+        import numpy as np
+        return np.frombuffer(self._records, dtype=_record_dtype(), count=self._size)
+
+    def column(self, field: str):
+        """Колонка записей (id, parent_id, prob, loss_min, loss_max, severity, name) — вид без копии."""
+        if field not in FIELDS:
+            raise KeyError(f"Неизвестная колонка: {field}")
+        return self.records()[field]
+
+    def leaf_totals(self) -> Tuple[float, float]:
+        """Суммы ожидаемых мин./макс. потерь по листьям (как итоговая панель) — прямо по колонкам."""
+        import numpy as np
+        records = self.records()
+        leaf = np.diff(np.frombuffer(self.child_ptr, dtype=np.uint64)) == 0
+        prob = records["prob"][leaf]
+        return float(prob @ records["loss_min"][leaf]), float(prob @ records["loss_max"][leaf])
+
+    def rows_with_name_prefix(self, prefix: str):
+        """Номера строк, чьё название начинается с prefix: сравниваются байты строковой
+        таблицы, сами названия не декодируются."""
+        import numpy as np
+        key = prefix.encode("utf-8")
+        blob = np.frombuffer(self._names, dtype=np.uint8)
+        ptr = np.frombuffer(self._name_ptr, dtype=np.uint64).astype(np.int64)
+        starts = ptr[:-1]
+        match = ptr[1:] - starts >= len(key)
+        for i, byte in enumerate(key):
+            match[match] = blob[starts[match] + i] == byte
+        return np.nonzero(np.isin(self.column("name"), np.nonzero(match)[0]))[0]
+
+
+# ----------------- Преобразование JSON <-> снимок -----------------
+def json_to_snapshot(json_path: str, snap_path: str) -> int:
+    """nodes.json -> .snap; JSON читается потоком (storage.iter_records). Возвращает число узлов.
+
+    Файл данных программы (storage.DATA_FILE) читается вместе с журналом правок
+    (storage.iter_nodes). Другой nodes.json с несвёрнутым журналом рядом не
+    принимается: без журнала снимок потерял бы последние правки.
+    """
+    import storage
+    if os.path.abspath(json_path) == os.path.abspath(storage.DATA_FILE):
+        source = storage.iter_nodes()
+    else:
+        for journal in (storage._journal_file(json_path), storage._rotated_file(json_path)):
+            if os.path.exists(journal) and os.path.getsize(journal):
+                raise ValueError(f"У {json_path} есть несвёрнутый журнал правок ({journal})")
+        source = (RiskNode(**ndata) for _, ndata in storage.iter_records(json_path))
+    nodes = {}
+    for node in source:
+        nodes[node.id] = node
+    write_snapshot(nodes, snap_path)
+    return len(nodes)
+
+
+def _number(value) -> str:
+    # Как json.dumps для чисел, но без кодировщика на каждое значение
+    if isinstance(value, float) and not math.isfinite(value):
+        return json.dumps(value)
+    return repr(value)
+
+
+def write_json(nodes: Iterable[RiskNode], path: str):
+    """Узлы в формате data/nodes.json — тот же текст, что json.dump(..., indent=4) в
+    storage.save_nodes, но записью по одному узлу, без словаря всех записей."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("{")
+        sep = "\n"
+        for node in nodes:
+            children = ",\n            ".join(map(str, node.children))
+            children = f"[\n            {children}\n        ]" if children else "[]"
+            f.write(f'{sep}    "{node.id}": {{\n'
+                    f'        "id": {node.id},\n'
+                    f'        "name": {json.dumps(node.name, ensure_ascii=False)},\n'
+                    f'        "prob": {_number(node.prob)},\n'
+                    f'        "loss_min": {_number(node.loss_min)},\n'
+                    f'        "loss_max": {_number(node.loss_max)},\n'
+                    f'        "severity": {_number(node.severity)},\n'
+                    f'        "parent_id": {"null" if node.parent_id is None else node.parent_id},\n'
+                    f'        "children": {children}\n'
+                    f'    }}')
+            sep = ",\n"
+        f.write("\n}" if sep != "\n" else "}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def snapshot_to_json(snap_path: str, json_path: str) -> int:
+    """.snap -> nodes.json без сборки всего словаря узлов. Возвращает число узлов."""
+    with Snapshot(snap_path) as snap:
+        write_json(snap.iter_nodes(), json_path)
+        return len(snap)
+
+
+def main(argv=None) -> int:
+    args = sys.argv[1:] if argv is None else argv
+    if len(args) != 2:
+        print("Использование: python -m snapshot ИСТОЧНИК ЦЕЛЬ  (nodes.json -> .snap или .snap -> .json)",
+              file=sys.stderr)
+        return 2
+    src, dst = args
+    try:
+        if src.endswith(".snap"):
+            count = snapshot_to_json(src, dst)
+        else:
+            # Как cli.py: источник становится файлом данных — его журнал учитывается
+            import storage
+            storage.DATA_FILE = src
+            count = json_to_snapshot(src, dst)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    print(f"Записано узлов: {count} -> {dst}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
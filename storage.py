@@ -1,18 +1,422 @@
 import json
-from typing import Dict
-from models import RiskNode
+import os
+import threading
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from models import RiskNode, ChangeSet
+from perf import instrument
 
 DATA_FILE = "data/nodes.json"
 
-def save_nodes(nodes: Dict[int, RiskNode]):
-    serializable = {nid: node.__dict__ for nid, node in nodes.items()}
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(serializable, f, ensure_ascii=False, indent=4)
+# Куда сохраняются правки: "journal" — nodes.json + журнал, "sqlite" — база storage_sqlite.DB_FILE
+BACKEND = "journal"
 
-def load_nodes() -> Dict[int, RiskNode]:
+# Журнал изменений рядом со снимком DATA_FILE (nodes.json -> nodes.journal).
+# Каждая правка дописывает в него компактные записи upsert/delete/reorder,
+# а фоновое сворачивание переносит их в новый снимок.
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+
+# Снимок читается потоком кусками такого размера (символов)
+READ_CHUNK = 1 << 20
+_FIRST_CHAR = re.compile(r"\s*(\S)")
+_RECORD_KEY = re.compile(r'\s*(?:(\})|"((?:[^"\\]|\\.)*)"\s*:\s*)')
+_RECORD_END = re.compile(r"\s*([,}])")
+_ITEM_START = re.compile(r"\s*(?:(\])|(?=\S))")
+_ITEM_END = re.compile(r"\s*([,\]])")
+
+_lock = threading.RLock()
+_compaction = None  # поток текущего сворачивания журнала
+_sqlite_storage = None
+
+
+class _NeedMore(Exception):
+    """Кусок файла кончился посреди записи — нужно дочитать."""
+
+
+def _journal_file(data_file: str = None):
+    return os.path.splitext(data_file or DATA_FILE)[0] + ".journal"
+
+
+def _rotated_file(data_file: str = None):
+    # Журнал, который сейчас сворачивается (или остался после сбоя во время сворачивания)
+    return _journal_file(data_file) + ".1"
+
+
+def node_to_dict(node: RiskNode) -> dict:
+    return {
+        "id": node.id,
+        "name": node.name,
+        "prob": node.prob,
+        "loss_min": node.loss_min,
+        "loss_max": node.loss_max,
+        "severity": node.severity,
+        "parent_id": node.parent_id,
+        "children": list(node.children),
+    }
+
+
+# ----------------- Снимок -----------------
+def _read_snapshot() -> Dict[int, dict]:
     try:
         with open(DATA_FILE, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-            return {int(nid): RiskNode(**ndata) for nid, ndata in raw.items()}
+            return {int(nid): ndata for nid, ndata in json.load(f).items()}
     except FileNotFoundError:
         return {}
+
+
+def _dump_tmp(raw: Dict[int, dict]) -> str:
+    tmp = DATA_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(raw, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+
+def _write_snapshot(raw: Dict[int, dict]):
+    """Пишет снимок через временный файл и rename — старая копия не обрезается при сбое."""
+    os.replace(_dump_tmp(raw), DATA_FILE)
+
+
+@instrument
+def save_nodes(nodes: Dict[int, RiskNode]):
+    """Полный снимок всех узлов; журнал после него больше не нужен."""
+    if BACKEND == "sqlite":
+        _sqlite().replace_all(nodes)
+        return
+    _wait_compaction()
+    with _lock:
+        _write_snapshot({nid: node_to_dict(node) for nid, node in nodes.items()})
+        for path in (_rotated_file(), _journal_file()):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def load_nodes() -> Dict[int, RiskNode]:
+    """Снимок плюс все записи журнала поверх него (или всё дерево из SQLite)."""
+    if BACKEND == "sqlite":
+        return _sqlite().load_nodes()
+    return _load_json_nodes()
+
+
+def _load_json_nodes() -> Dict[int, RiskNode]:
+    return _share_ids({node.id: node for node in iter_nodes()})
+
+
+def iter_records(path: str, chunk_size: int = READ_CHUNK) -> Iterator[Tuple[str, dict]]:
+    """Пары (ключ, запись) верхнего объекта JSON по одной — файл читается кусками
+    по chunk_size, в памяти только текущий кусок и одна запись."""
+    for key, record in _iter_json(path, "{", chunk_size):
+        yield (json.loads(f'"{key}"') if "\\" in key else key), record
+
+
+def iter_json_list(path: str, chunk_size: int = READ_CHUNK) -> Iterator:
+    """Элементы верхнего списка JSON по одному — потоком, как iter_records."""
+    for _, item in _iter_json(path, "[", chunk_size):
+        yield item
+
+
+def _iter_json(path: str, opening: str, chunk_size: int) -> Iterator[Tuple[Optional[str], object]]:
+    """(ключ, значение) элементов верхнего объекта (opening "{") или списка ("[", ключ None)."""
+    if opening == "{":
+        item_start, item_end = _RECORD_KEY, _RECORD_END
+    else:
+        item_start, item_end = _ITEM_START, _ITEM_END
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf, pos, eof, started, count = "", 0, False, False, 0
+        while True:
+            # pos сдвигается только после целого элемента; элемент, оборванный на границе
+            # куска, разбирается заново после дочитывания
+            try:
+                if not started:
+                    m = _FIRST_CHAR.match(buf, pos)
+                    if m is None:
+                        raise _NeedMore
+                    if m.group(1) != opening:
+                        raise ValueError(f"{path}: ожидается {'объект' if opening == '{' else 'список'} JSON")
+                    pos, started = m.end(), True
+                m = item_start.match(buf, pos)
+                if m is None:
+                    raise _NeedMore
+                if m.group(1):
+                    return
+                value, p = decoder.raw_decode(buf, m.end())
+                end = item_end.match(buf, p)
+                if end is None:
+                    raise _NeedMore
+            except (_NeedMore, json.JSONDecodeError) as e:
+                if eof:
+                    raise ValueError(f"{path}: не удалось разобрать запись №{count + 1}") from e
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            pos = end.end()
+            count += 1
+            yield (m.group(2) if opening == "{" else None), value
+            if end.group(1) != ",":
+                return
+
+
+def iter_nodes() -> Iterator[RiskNode]:
+    """Узлы снимка DATA_FILE с журналом поверх, по одному в порядке файла.
+
+    Журнал (он небольшой — его сворачивает compact_journal) читается заранее,
+    а снимок разбирается потоком: записи не копятся в промежуточном словаре.
+    Пока генератор не исчерпан, держится _lock — журнал не сворачивается под ним.
+    """
+    with _lock:
+        upserts, deleted, reorders = _journal_overlay()
+        if os.path.exists(DATA_FILE):
+            for _, ndata in iter_records(DATA_FILE):
+                nid = ndata["id"]
+                if nid in deleted:
+                    continue
+                if nid in upserts:
+                    ndata = upserts.pop(nid)
+                elif nid in reorders:
+                    ndata["children"] = reorders[nid]
+                yield RiskNode(**ndata)
+        for ndata in upserts.values():
+            yield RiskNode(**ndata)
+        if os.path.exists(_journal_file()) and os.path.getsize(_journal_file()) >= JOURNAL_COMPACT_BYTES:
+            compact_journal(background=True)
+
+
+def _share_ids(nodes: Dict[int, RiskNode]) -> Dict[int, RiskNode]:
+    """parent_id узлов — тот же объект int, что и id родителя (после разбора JSON
+    это разные объекты по 32 байта на каждое упоминание)."""
+    for node in nodes.values():
+        parent = nodes.get(node.parent_id)
+        if parent is not None:
+            node.parent_id = parent.id
+    return nodes
+
+
+# ----------------- Загрузка в фоне -----------------
+# Сколько верхних уровней (корень, города) нужно для первого показа окна
+FIRST_LEVELS = 2
+
+
+class NodeLoader:
+    """Загрузка узлов в фоновом потоке прямо в словарь nodes.
+
+    first_levels взводится, как только загружены корень и FIRST_LEVELS уровней
+    под ним (по ним уже можно рисовать дерево), done — когда загружено всё.
+    finish(nodes) — необязательная долгая подготовка (например, RiskAggregator),
+    выполняется в том же потоке после загрузки; её итог — в result.
+    Словарь только пополняется, поэтому другой поток может читать из него
+    отдельные узлы (но не обходить целиком) до done.
+    """
+
+    def __init__(self, root_id: int = 1, levels: int = FIRST_LEVELS, finish=None):
+        self.nodes: Dict[int, RiskNode] = {}
+        self.root_id = root_id
+        self.levels = levels
+        self.finish = finish
+        self.count = 0
+        self.max_id = 0
+        self.result = None
+        self.error = None
+        self.first_levels = threading.Event()
+        self.done = threading.Event()
+        self._depth = {root_id: 0}  # глубина ещё не загруженных узлов верхних уровней
+        self._thread = threading.Thread(target=self._run, name="node-loader", daemon=True)
+
+    def start(self) -> "NodeLoader":
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.done.wait(timeout)
+
+    def _run(self):
+        try:
+            loaded = iter_nodes() if BACKEND != "sqlite" else iter(_sqlite().load_nodes().values())
+            for node in loaded:
+                self._add(node)
+            _share_ids(self.nodes)
+            if self.finish is not None:
+                self.result = self.finish(self.nodes)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.first_levels.set()
+            self.done.set()
+
+    def _add(self, node: RiskNode):
+        self.nodes[node.id] = node
+        self.count += 1
+        if node.id > self.max_id:
+            self.max_id = node.id
+        if self.first_levels.is_set() or node.id not in self._depth:
+            return
+        # Узел верхних уровней: ждём его детей (если он сам не последнего уровня)
+        stack = [node]
+        while stack:
+            top = stack.pop()
+            depth = self._depth.pop(top.id)
+            if depth + 1 < self.levels:
+                for cid in top.children:
+                    self._depth[cid] = depth + 1
+                    if cid in self.nodes:
+                        stack.append(self.nodes[cid])
+        if not self._depth:
+            self.first_levels.set()
+
+
+# ----------------- Журнал -----------------
+@instrument
+def snapshot_changes(nodes: Dict[int, RiskNode], changes: ChangeSet) -> Tuple[Dict[int, dict], List[int], Dict[int, List[int]]]:
+    """Копия изменённых узлов: (upserts, deletes, reorders).
+
+    Её можно записать позже и из другого потока — объём пропорционален правке.
+    """
+    upserts = dict.fromkeys(changes.inserted + changes.updated)
+    # у родителя нового узла изменился список детей
+    for nid in changes.inserted:
+        if nid in nodes and nodes[nid].parent_id is not None:
+            upserts[nodes[nid].parent_id] = None
+    upserts = {nid: node_to_dict(nodes[nid]) for nid in upserts if nid in nodes}
+    reorders = {pid: list(nodes[pid].children) for pid in changes.reordered if pid in nodes}
+    return upserts, list(changes.removed), reorders
+
+
+def journal_records(upserts: Dict[int, dict], deletes: List[int], reorders: Dict[int, List[int]]) -> list:
+    """Записи журнала: сначала удаления, затем новые состояния узлов, затем порядок детей."""
+    records = [{"op": "delete", "id": nid} for nid in deletes]
+    records += [{"op": "upsert", "node": data} for data in upserts.values()]
+    records += [{"op": "reorder", "id": pid, "children": children} for pid, children in reorders.items()]
+    return records
+
+
+def append_journal(records: Iterable[dict]):
+    """Дописывает записи в журнал; при превышении порога запускает сворачивание в фоне."""
+    data = "".join(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n" for rec in records)
+    if not data:
+        return
+    data = data.encode("utf-8")
+    with _lock:
+        with open(_journal_file(), "a+b") as f:
+            # после сбоя последняя запись может быть оборвана — начинаем с новой строки
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            f.write(data)
+            size = f.tell()
+    if size >= JOURNAL_COMPACT_BYTES:
+        compact_journal(background=True)
+
+
+@instrument
+def save_records(upserts: Dict[int, dict], deletes: List[int], reorders: Dict[int, List[int]]):
+    """Записывает снимок изменений (см. snapshot_changes) в выбранное хранилище."""
+    if BACKEND == "sqlite":
+        _sqlite().apply_records(upserts, deletes, reorders)
+        return
+    append_journal(journal_records(upserts, deletes, reorders))
+
+
+def save_changes(nodes: Dict[int, RiskNode], changes: ChangeSet):
+    """Сохраняет одну правку: объём записи пропорционален изменению, а не размеру дерева."""
+    save_records(*snapshot_changes(nodes, changes))
+
+
+def _journal_ops(path: str) -> Iterator[dict]:
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # оборванная запись после сбоя
+
+
+def _replay(raw: Dict[int, dict], path: str):
+    for rec in _journal_ops(path):
+        op = rec.get("op")
+        if op == "upsert":
+            raw[rec["node"]["id"]] = rec["node"]
+        elif op == "delete":
+            raw.pop(rec["id"], None)
+        elif op == "reorder" and rec["id"] in raw:
+            raw[rec["id"]]["children"] = rec["children"]
+
+
+def _journal_overlay() -> Tuple[Dict[int, dict], set, Dict[int, list]]:
+    """Итог обоих журналов без снимка: (новые состояния узлов, удалённые id, порядок детей
+    у узлов снимка) — то же, что _replay, но для наложения на снимок при потоковом чтении."""
+    upserts: Dict[int, dict] = {}
+    deleted = set()
+    reorders: Dict[int, list] = {}
+    for path in (_rotated_file(), _journal_file()):
+        for rec in _journal_ops(path):
+            op = rec.get("op")
+            if op == "upsert":
+                nid = rec["node"]["id"]
+                upserts[nid] = rec["node"]
+                deleted.discard(nid)
+                reorders.pop(nid, None)
+            elif op == "delete":
+                upserts.pop(rec["id"], None)
+                reorders.pop(rec["id"], None)
+                deleted.add(rec["id"])
+            elif op == "reorder" and rec["id"] not in deleted:
+                if rec["id"] in upserts:
+                    upserts[rec["id"]]["children"] = rec["children"]
+                else:
+                    reorders[rec["id"]] = rec["children"]
+    return upserts, deleted, reorders
+
+
+# ----------------- Сворачивание -----------------
+def compact_journal(background: bool = True):
+    """Сворачивает журнал в новый снимок (атомарно), по умолчанию в фоновом потоке."""
+    global _compaction
+    with _lock:
+        if _compaction is not None and _compaction.is_alive():
+            return _compaction
+        # Новые записи пойдут в свежий журнал, пока старый сворачивается
+        if not os.path.exists(_rotated_file()):
+            if not os.path.exists(_journal_file()):
+                return None
+            os.replace(_journal_file(), _rotated_file())
+        if not background:
+            _fold_rotated()
+            return None
+        _compaction = threading.Thread(target=_fold_rotated, name="journal-compaction", daemon=True)
+        _compaction.start()
+        return _compaction
+
+
+def _fold_rotated():
+    raw = _read_snapshot()
+    _replay(raw, _rotated_file())
+    tmp = _dump_tmp(raw)
+    with _lock:
+        os.replace(tmp, DATA_FILE)
+        os.remove(_rotated_file())
+
+
+def _wait_compaction():
+    thread = _compaction
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
+
+
+# ----------------- SQLite -----------------
+def _sqlite():
+    """База SQLite; при первом открытии пустая база заполняется из nodes.json."""
+    global _sqlite_storage
+    with _lock:
+        if _sqlite_storage is None:
+            from storage_sqlite import SQLiteStorage, DB_FILE
+            _sqlite_storage = SQLiteStorage(DB_FILE)
+            if _sqlite_storage.is_empty():
+                _sqlite_storage.migrate_from_json(_load_json_nodes())
+        return _sqlite_storage
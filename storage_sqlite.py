@@ -0,0 +1,208 @@
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+from models import RiskNode, ChangeSet
+
+DB_FILE = "data/nodes.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id        INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    position  INTEGER NOT NULL DEFAULT 0,
+    name      TEXT NOT NULL,
+    prob      REAL NOT NULL DEFAULT 0,
+    loss_min  REAL NOT NULL DEFAULT 0,
+    loss_max  REAL NOT NULL DEFAULT 0,
+    severity  REAL NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS nodes_parent_position ON nodes(parent_id, position);
+"""
+
+_COLUMNS = "id, parent_id, position, name, prob, loss_min, loss_max, severity"
+
+_UPSERT = f"""
+INSERT INTO nodes ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    parent_id = excluded.parent_id, name = excluded.name,
+    prob = excluded.prob, loss_min = excluded.loss_min,
+    loss_max = excluded.loss_max, severity = excluded.severity
+"""
+
+
+class SQLiteStorage:
+    """Узлы в локальном файле SQLite.
+
+    Порядок детей хранится колонкой position (индекс по parent_id, position)
+    вместо списка children, поэтому дерево можно читать по уровням, а правки
+    записывать отдельными строками в одной транзакции.
+    """
+
+    def __init__(self, path: str = DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM nodes LIMIT 1").fetchone() is None
+
+    # ----------------- Чтение -----------------
+    def load_nodes(self) -> Dict[int, RiskNode]:
+        """Всё дерево целиком (дети в порядке position)."""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {_COLUMNS} FROM nodes ORDER BY parent_id, position, id").fetchall()
+        return self._build(rows)
+
+    def load_root(self) -> Optional[RiskNode]:
+        """Только корневой узел со списком id его детей."""
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {_COLUMNS} FROM nodes WHERE parent_id IS NULL ORDER BY position, id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            node = self._node(row)
+            node.children = self._child_ids([node.id])[node.id]
+        return node
+
+    def load_children(self, parent_id: int) -> List[RiskNode]:
+        """Дети узла по порядку, у каждого — список id его собственных детей."""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {_COLUMNS} FROM nodes WHERE parent_id = ? ORDER BY position, id", (parent_id,)).fetchall()
+            nodes = [self._node(row) for row in rows]
+            grandchildren = self._child_ids([n.id for n in nodes])
+        for node in nodes:
+            node.children = grandchildren[node.id]
+        return nodes
+
+    def load_levels(self, depth: int) -> Dict[int, RiskNode]:
+        """Корень и depth уровней под ним — для первого показа очень больших деревьев."""
+        root = self.load_root()
+        if root is None:
+            return {}
+        nodes = {root.id: root}
+        level = [root.id]
+        for _ in range(depth):
+            next_level = []
+            for pid in level:
+                for child in self.load_children(pid):
+                    nodes[child.id] = child
+                    next_level.append(child.id)
+            level = next_level
+        return nodes
+
+    # ----------------- Запись -----------------
+    def upsert_nodes(self, nodes: Iterable[RiskNode]):
+        """Вставляет или обновляет узлы одной транзакцией.
+
+        Новые узлы встают в конец детей своего родителя, у существующих позиция сохраняется.
+        """
+        with self._lock, self.conn:
+            self._upsert(nodes)
+
+    def delete_subtree(self, root_id: int):
+        """Удаляет узел со всеми потомками одной транзакцией."""
+        with self._lock, self.conn:
+            self.conn.execute("""
+                WITH RECURSIVE sub(id) AS (
+                    SELECT ? UNION ALL SELECT n.id FROM nodes n JOIN sub ON n.parent_id = sub.id
+                )
+                DELETE FROM nodes WHERE id IN (SELECT id FROM sub)""", (root_id,))
+
+    def set_order(self, children: List[int]):
+        """Записывает порядок детей одного родителя."""
+        with self._lock, self.conn:
+            self._set_order(children)
+
+    def apply_changes(self, nodes: Dict[int, RiskNode], changes: ChangeSet):
+        """Записывает одну правку (ChangeSet) одной транзакцией."""
+        upserts = dict.fromkeys(changes.inserted + changes.updated)
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM nodes WHERE id = ?", [(nid,) for nid in changes.removed])
+            self._upsert(nodes[nid] for nid in upserts if nid in nodes)
+            for pid in changes.reordered:
+                if pid in nodes:
+                    self._set_order(nodes[pid].children)
+
+    def apply_records(self, upserts: Dict[int, dict], deletes: List[int], reorders: Dict[int, List[int]]):
+        """То же для снимка изменений из storage.snapshot_changes (словари вместо RiskNode)."""
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM nodes WHERE id = ?", [(nid,) for nid in deletes])
+            self._upsert(RiskNode(**data) for data in upserts.values())
+            for children in reorders.values():
+                self._set_order(children)
+
+    def replace_all(self, nodes: Dict[int, RiskNode]):
+        """Полная замена содержимого базы (аналог save_nodes)."""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM nodes")
+            self.conn.executemany(f"INSERT INTO nodes ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  self._rows(nodes))
+
+    def migrate_from_json(self, nodes: Dict[int, RiskNode]) -> int:
+        """Однократный перенос дерева из nodes.json; возвращает число перенесённых узлов."""
+        if not self.is_empty():
+            return 0
+        self.replace_all(nodes)
+        return len(nodes)
+
+    # ----------------- Внутреннее -----------------
+    @staticmethod
+    def _rows(nodes: Dict[int, RiskNode]):
+        positions = {}
+        for node in nodes.values():
+            for i, cid in enumerate(node.children):
+                positions[cid] = i
+        for nid, node in nodes.items():
+            yield (nid, node.parent_id, positions.get(nid, 0), node.name,
+                   node.prob, node.loss_min, node.loss_max, node.severity)
+
+    def _upsert(self, nodes: Iterable[RiskNode]):
+        for node in nodes:
+            position = self.conn.execute(
+                "SELECT COALESCE((SELECT position FROM nodes WHERE id = ?),"
+                " (SELECT MAX(position) + 1 FROM nodes WHERE parent_id IS ?), 0)",
+                (node.id, node.parent_id)).fetchone()[0]
+            self.conn.execute(_UPSERT, (node.id, node.parent_id, position, node.name,
+                                        node.prob, node.loss_min, node.loss_max, node.severity))
+
+    def _set_order(self, children: List[int]):
+        self.conn.executemany("UPDATE nodes SET position = ? WHERE id = ?",
+                              [(i, cid) for i, cid in enumerate(children)])
+
+    def _child_ids(self, parent_ids: List[int]) -> Dict[int, List[int]]:
+        result = {pid: [] for pid in parent_ids}
+        for start in range(0, len(parent_ids), 500):
+            chunk = parent_ids[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for pid, cid in self.conn.execute(
+                    f"SELECT parent_id, id FROM nodes WHERE parent_id IN ({marks}) ORDER BY parent_id, position, id",
+                    chunk):
+                result[pid].append(cid)
+        return result
+
+    @staticmethod
+    def _node(row) -> RiskNode:
+        nid, parent_id, _, name, prob, loss_min, loss_max, severity = row
+        return RiskNode(id=nid, name=name, prob=prob, loss_min=loss_min, loss_max=loss_max,
+                        severity=severity, parent_id=parent_id)
+
+    def _build(self, rows) -> Dict[int, RiskNode]:
+        nodes = {row[0]: self._node(row) for row in rows}
+        # строки отсортированы по (parent_id, position) — дети добавляются по порядку
+        for row in rows:
+            parent = nodes.get(row[1])
+            if parent is not None:
+                parent.append_child(row[0])
+                nodes[row[0]].parent_id = parent.id  # один объект int на id, как в storage
+        return nodes
+
@@ -1,8 +1,23 @@
+import bisect
+import os
+import threading
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-from models import RiskNode
-from storage import save_nodes
-from report import generate_pdf, REPORTLAB_AVAILABLE
+from tkinter import ttk, messagebox, filedialog
+from models import RiskNode, ChangeSet
+from history import EditParams, Rename, InsertSubtree, DeleteSubtree, MoveNode, ImportNodes
+from importer import read_rows, plan_import, write_rejected, rejected_path
+from storage import node_to_dict
+from saver import STATUS_SAVED, STATUS_PENDING, STATUS_SAVING
+from report import REPORTLAB_AVAILABLE, REPORT_FILE
+from export import format_of as export_format_of, OPENPYXL_AVAILABLE, PYARROW_AVAILABLE
+from report_jobs import JOB_QUEUED, JOB_DONE, JOB_FAILED
+from search import SearchIndex
+from simulation import NUMPY_AVAILABLE as SIMULATION_AVAILABLE, DEFAULT_SCENARIOS, LeafModel, simulate
+from metrics import UI_TO_KEY, KEY_FUNCS, sort_nodes
+from aggregate import column_store
+import perf
+from perf import instrument
 
 # ----------------- Стили -----------------
 def _init_style(app):
@@ -54,19 +69,145 @@ def _init_style(app):
 
 
 # ----------------- Вспомогательные функции -----------------
+# Текст фиктивного дочернего элемента: он нужен только для стрелки раскрытия,
+# настоящие дети вставляются при первом раскрытии узла (<<TreeviewOpen>>).
+_PLACEHOLDER_TEXT = "…"
+
+def _row_values(node):
+    return (f"{node.prob:.3f}", f"{node.loss_min:.2f}", f"{node.loss_max:.2f}",
+            f"{(node.prob or 0.0)*(node.loss_min or 0.0):.2f}",
+            f"{(node.prob or 0.0)*(node.loss_max or 0.0):.2f}",
+            f"{node.severity:.1f}",
+            f"{(node.prob or 0.0)*(node.severity or 1.0):.2f}")
+
+def _is_placeholder(app, item):
+    return "placeholder" in app.tree.item(item, "tags")
+
+# ----------------- Порядок показа -----------------
+# Больше стольких перемещений — дешевле одной командой set_children
+REORDER_MOVE_LIMIT = 8
+
+def _sort_key(app, key):
+    """Значение ключа сортировки по id узла — из модели, с кэшем по колонке."""
+    cache = app.sort_keys.setdefault(key, {})
+    getter = KEY_FUNCS[key]
+    nodes = app.nodes
+
+    def value(nid):
+        v = cache.get(nid)
+        if v is None:
+            v = cache[nid] = getter(nodes[nid])
+        return v
+    return value
+
+def _display_children(app, node_id):
+    """Дети узла в порядке показа: модельный или выбранная сортировка по колонке."""
+    children = app.nodes[node_id].children
+    if app.tree_sort is None or len(children) < 2:
+        return children
+    key, reverse = app.tree_sort
+    return sorted(children, key=_sort_key(app, key), reverse=reverse)
+
+def _items_to_move(current, wanted):
+    """Элементы, которые нужно переставить: все, кроме самой длинной уже упорядоченной подпоследовательности."""
+    pos = {item: i for i, item in enumerate(wanted)}
+    tails, tail_items, prev = [], [], {}
+    for item in current:
+        p = pos[item]
+        k = bisect.bisect_left(tails, p)
+        prev[item] = tail_items[k - 1] if k else None
+        if k == len(tails):
+            tails.append(p)
+            tail_items.append(item)
+        else:
+            tails[k] = p
+            tail_items[k] = item
+    keep = set()
+    item = tail_items[-1] if tail_items else None
+    while item is not None:
+        keep.add(item)
+        item = prev[item]
+    return set(current) - keep
+
+def _reorder_children(app, item, node_id):
+    """Приводит вставленных детей item к порядку показа, двигая только сместившиеся элементы."""
+    tree = app.tree
+    current = tree.get_children(item)
+    if not current or _is_placeholder(app, current[0]):
+        return
+    wanted = tuple(app.id_to_item[cid] for cid in _display_children(app, node_id) if cid in app.id_to_item)
+    if wanted == current:
+        return
+    moved = _items_to_move(current, wanted) if len(wanted) == len(current) else None
+    if moved is None or len(moved) > REORDER_MOVE_LIMIT:
+        tree.set_children(item, *wanted)
+        return
+    # Остальные уже стоят в нужном относительном порядке: отцепляем сдвинутые
+    # и возвращаем каждый на его место слева направо
+    tree.detach(*moved)
+    for index, child in enumerate(wanted):
+        if child in moved:
+            tree.move(child, item, index)
+
+def _is_materialized(app, node_id):
+    # Дети вставлены в дерево, если вставлен хотя бы первый из них
+    children = app.nodes[node_id].children
+    return bool(children) and children[0] in app.id_to_item
+
+def _insert_node(app, node_id, parent="", index="end", open_nodes=()):
+    """Вставляет узел; детей — сразу (если узел раскрыт или ленивый режим выключен) или заглушкой."""
+    node = app.nodes[node_id]
+    item = app.tree.insert(parent, index, text=node.name, values=_row_values(node))
+    app.item_to_id[item] = node_id
+    app.id_to_item[node_id] = item
+    if node.children:
+        if not app.lazy_tree or node_id in open_nodes:
+            for cid in _display_children(app, node_id):
+                _insert_node(app, cid, item, open_nodes=open_nodes)
+        else:
+            app.tree.insert(item, "end", text=_PLACEHOLDER_TEXT, tags=("placeholder",))
+    # восстанавливаем раскрытие по node_id
+    if node_id in open_nodes:
+        app.tree.item(item, open=True)
+    return item
+
+def _materialize_children(app, item):
+    """Заменяет заглушку настоящими дочерними элементами узла."""
+    children = app.tree.get_children(item)
+    if len(children) != 1 or not _is_placeholder(app, children[0]):
+        return
+    if app.loader is not None and not all(cid in app.nodes for cid in app.nodes[app.item_to_id[item]].children):
+        return  # дети ещё не загружены — заглушка останется до _finish_loading
+    app.tree.delete(children[0])
+    for cid in _display_children(app, app.item_to_id[item]):
+        _insert_node(app, cid, item)
+
+def _on_tree_open(app, event=None):
+    item = app.tree.focus()
+    if item in app.item_to_id:
+        _materialize_children(app, item)
+
+def _ensure_item(app, node_id):
+    """Гарантирует, что узел вставлен в дерево (раскрывая предков), и возвращает его item."""
+    if node_id in app.id_to_item:
+        return app.id_to_item[node_id]
+    path = []
+    nid = node_id
+    while nid is not None and nid not in app.id_to_item:
+        path.append(nid)
+        nid = app.nodes[nid].parent_id
+    if nid is None:
+        return None
+    for nid in [nid] + path[:0:-1]:
+        item = app.id_to_item[nid]
+        _materialize_children(app, item)
+        app.tree.item(item, open=True)
+    return app.id_to_item.get(node_id)
+
+@instrument
 def _refresh_tree(app):
-    # 1. Сохранить открытые узлы по node_id
-    open_nodes = set()
-
-    def collect(item):
-        node_id = app.item_to_id.get(item)
-        if node_id and app.tree.item(item, "open"):
-            open_nodes.add(node_id)
-        for c in app.tree.get_children(item):
-            collect(c)
-
-    for i in app.tree.get_children():
-        collect(i)
+    # 1. Сохранить открытые узлы по node_id (только вставленные — остальные заведомо закрыты)
+    open_nodes = {nid for nid, item in app.id_to_item.items() if app.tree.item(item, "open")}
 
     # 2. Сохранить выделение
     old_selection = app.tree.selection()
@@ -78,68 +219,130 @@ def _refresh_tree(app):
     app.item_to_id.clear()
     app.id_to_item.clear()
 
-    # 4. Вставка рекурсивно
-    def insert(node_id, parent=""):
-        node = app.nodes[node_id]
-        item = app.tree.insert(
-            parent, "end", text=node.name,
-            values=(f"{node.prob:.3f}", f"{node.loss_min:.2f}", f"{node.loss_max:.2f}",
-                    f"{(node.prob or 0.0)*(node.loss_min or 0.0):.2f}",
-                    f"{(node.prob or 0.0)*(node.loss_max or 0.0):.2f}",
-                    f"{node.severity:.1f}",
-                    f"{(node.prob or 0.0)*(node.severity or 1.0):.2f}")
-        )
-        app.item_to_id[item] = node_id
-        app.id_to_item[node_id] = item
-        for cid in node.children:
-            insert(cid, item)
-        # восстанавливаем раскрытие по node_id
-        if node_id in open_nodes:
-            app.tree.item(item, open=True)
-
-    insert(1)
+    # 4. Вставка: раскрытые уровни целиком, закрытые — заглушкой
+    _insert_node(app, 1, open_nodes=open_nodes)
 
     # 5. Восстановить выделение
     if old_selection_ids:
-        new_selection = [app.id_to_item[nid] for nid in old_selection_ids if nid in app.id_to_item]
+        new_selection = [item for item in (_ensure_item(app, nid) for nid in old_selection_ids if nid in app.nodes) if item]
         try:
             app.tree.selection_set(new_selection)
         except Exception:
             pass
 
-    # 6. Пересчёт и обновление итогов
-    _recalc_and_update_tree(app)
+    # 6. Итоги (значения строк уже актуальны после вставки)
     _update_total_label(app)
 
 def _recalc_and_update_tree(app):
-    def update_node_rec(node_id):
-        node = app.nodes[node_id]
-        lower = (node.prob or 0.0)*(node.loss_min or 0.0)
-        upper = (node.prob or 0.0)*(node.loss_max or 0.0)
-        risk = (node.prob or 0.0)*(node.severity or 1.0)
-        item = app.id_to_item.get(node_id)
-        if item:
-            app.tree.item(item, values=(f"{node.prob:.3f}",f"{node.loss_min:.2f}",f"{node.loss_max:.2f}",f"{lower:.2f}",f"{upper:.2f}",f"{node.severity:.1f}",f"{risk:.2f}"))
-        for cid in node.children:
-            update_node_rec(cid)
-    update_node_rec(1)
-
-def _update_total_label(app):
-    # Считаем только листья
-    def calc_lower(node_id):
-        node = app.nodes[node_id]
-        if not node.children:  # если нет детей — это лист
-            return (node.prob or 0.0)*(node.loss_min or 0.0)
-        return sum(calc_lower(cid) for cid in node.children)
-
-    def calc_upper(node_id):
-        node = app.nodes[node_id]
+    # Обновляем только строки, которые реально есть в дереве
+    for node_id, item in app.id_to_item.items():
+        app.tree.item(item, values=_row_values(app.nodes[node_id]))
+    # Значения могли измениться у всех родителей — пересортировываем вставленные уровни
+    app.sort_keys.clear()
+    if app.tree_sort is not None:
+        _resort_tree(app)
+
+def _resort_tree(app):
+    for node_id, item in list(app.id_to_item.items()):
+        if _is_materialized(app, node_id):
+            _reorder_children(app, item, node_id)
+
+# Правки больше стольких новых/удалённых узлов показываются полной перестройкой дерева
+FULL_REFRESH_CHANGES = 500
+
+@instrument
+def _apply_changes(app, changes):
+    """Применяет к дереву только изменившиеся узлы вместо полной перестройки."""
+    app.leaf_totals.apply(changes)
+    if len(changes.inserted) + len(changes.removed) > FULL_REFRESH_CHANGES:
+        # Импорт и его отмена — одна перестройка дешевле тысяч точечных вставок
+        app.sort_keys.clear()
+        _refresh_tree(app)
+        return
+    tree = app.tree
+
+    # 0. Кэш ключей сортировки — только для изменившихся узлов
+    for cache in app.sort_keys.values():
+        for nid in changes.removed:
+            cache.pop(nid, None)
+        for nid in changes.updated:
+            cache.pop(nid, None)
+
+    # 1. Удалённые узлы (Tk удаляет потомков вместе с элементом)
+    for nid in changes.removed:
+        item = app.id_to_item.pop(nid, None)
+        if item is None:
+            continue
+        app.item_to_id.pop(item, None)
+        if tree.exists(item):
+            tree.delete(item)
+
+    # 2. Новые узлы — только если их родитель уже раскрывался
+    for nid in changes.inserted:
+        if nid in app.id_to_item or nid not in app.nodes:
+            continue
+        parent_id = app.nodes[nid].parent_id
+        parent_item = app.id_to_item.get(parent_id)
+        if parent_item is None:
+            continue
+        children = tree.get_children(parent_item)
+        if children and _is_placeholder(app, children[0]):
+            continue
+        if not children and app.lazy_tree and not tree.item(parent_item, "open"):
+            # бывший лист получил первого ребёнка — достаточно стрелки раскрытия
+            tree.insert(parent_item, "end", text=_PLACEHOLDER_TEXT, tags=("placeholder",))
+            continue
+        _insert_node(app, nid, parent_item, _display_children(app, parent_id).index(nid))
+
+    # 3. Новый порядок детей; при сортировке по колонке порядок зависит и от новых значений
+    reorder = list(changes.reordered)
+    if app.tree_sort is not None:
+        reorder += [app.nodes[nid].parent_id for nid in changes.updated + changes.inserted
+                    if nid in app.nodes and app.nodes[nid].parent_id is not None]
+    for pid in dict.fromkeys(reorder):
+        item = app.id_to_item.get(pid)
+        if item is not None and pid in app.nodes:
+            _reorder_children(app, item, pid)
+
+    # 4. Новые значения и имена
+    for nid in dict.fromkeys(changes.updated):
+        item = app.id_to_item.get(nid)
+        if item is None or nid not in app.nodes:
+            continue
+        node = app.nodes[nid]
+        tree.item(item, text=node.name, values=_row_values(node))
         if not node.children:
-            return (node.prob or 0.0)*(node.loss_max or 0.0)
-        return sum(calc_upper(cid) for cid in node.children)
+            # у узла удалили последних детей — убираем оставшуюся заглушку
+            for c in tree.get_children(item):
+                tree.delete(c)
+
+    _update_total_label(app)
+
+def _commit_changes(app, changes):
+    """Показывает правку в дереве и ставит её в очередь на сохранение."""
+    _apply_changes(app, changes)
+    app.saver.mark(app.nodes, changes)
+    app.search_index.apply(app.nodes, changes)
+    _mark_simulation_stale(app)
 
-    total_lower = calc_lower(1)
-    total_upper = calc_upper(1)
+def _execute(app, command):
+    """Выполняет команду правки и запоминает её для отмены."""
+    changes = command.apply(app)
+    app.history.push(command)
+    _commit_changes(app, changes)
+    return changes
+
+def _update_total_label(app):
+    if app.loader is not None:
+        # Дерево ещё загружается (или загрузка прервалась) — итоги считать не по чему
+        if app.loader.error is not None:
+            text = f"Ошибка загрузки: {app.loader.error}\nЗагружено узлов: {app.loader.count}"
+        else:
+            text = f"Загрузка…\nЗагружено узлов: {app.loader.count}"
+        app.label_total.config(text=text)
+        return
+    # Итоги по листьям ведутся по правкам (LeafTotals), без обхода дерева
+    total_lower, total_upper = app.leaf_totals.totals()
 
     # Считаем города и улицы
     cities = sum(1 for cid in app.nodes[1].children)
@@ -152,6 +355,21 @@ def _update_total_label(app):
         f"Магазины (улицы): {streets}"
     ))
 
+# Подписи состояния фонового сохранения
+_SAVE_STATUS_TEXT = {
+    STATUS_SAVED: "Все изменения сохранены",
+    STATUS_PENDING: "Есть несохранённые изменения…",
+    STATUS_SAVING: "Сохранение…",
+}
+
+def _poll_save_status(app):
+    """Обновляет строку состояния сохранения (поток сохранения сам Tk не трогает)."""
+    status = app.saver.status
+    text = _SAVE_STATUS_TEXT.get(status) or f"Ошибка сохранения: {app.saver.error}"
+    if app.label_save_status.cget("text") != text:
+        app.label_save_status.config(text=text, foreground="#dc2626" if status not in _SAVE_STATUS_TEXT else "#6b7280")
+    app.root.after(200, lambda: _poll_save_status(app))
+
 def _sync_inputs_with_selection(app):
     node = app.nodes[app.selected_id]
     app.entry_name.delete(0, tk.END)
@@ -171,6 +389,39 @@ def _sync_inputs_with_selection(app):
         app.entry_severity.delete(0, tk.END)
         app.entry_severity.insert(0,str(node.severity))
 
+# ----------------- Загрузка -----------------
+def _loading_blocked(app):
+    """Правки, пересчёт и отчёты ждут конца загрузки: до неё дерево в памяти неполное."""
+    if app.loader is None:
+        return False
+    if app.loader.error is not None:
+        messagebox.showerror("Ошибка загрузки", f"Данные загружены не полностью: {app.loader.error}")
+    else:
+        messagebox.showinfo("Идёт загрузка", "Дерево ещё загружается, дождитесь окончания.")
+    return True
+
+def _poll_loading(app):
+    """Пока NodeLoader читает файл, показывает число узлов; по окончании достраивает приложение."""
+    loader = app.loader
+    if loader.done.is_set():
+        _finish_loading(app)
+        return
+    _update_total_label(app)
+    app.root.after(100, lambda: _poll_loading(app))
+
+def _finish_loading(app):
+    loader = app.loader
+    if loader.error is not None:
+        # Неполное дерево нельзя править и сохранять — остаётся только просмотр
+        _update_total_label(app)
+        messagebox.showerror("Ошибка загрузки", f"Данные загружены не полностью: {loader.error}")
+        return
+    app.next_id = max(loader.max_id, max(app.nodes)) + 1
+    app.aggregator, app.leaf_totals = loader.result
+    app.loader = None
+    # Раскрытые во время загрузки узлы могли остаться с заглушкой — вставляем заново
+    _refresh_tree(app)
+
 # ----------------- Дерево -----------------
 def _build_treeview(app):
     columns = ("P", "Lmin", "Lmax", "ExpectedMin", "ExpectedMax", "Severity", "Risk")
@@ -190,6 +441,7 @@ def _build_treeview(app):
         app.tree.heading(col, text=headers[col])
 
     app.tree.heading("#0", text="Объект")
+    app.tree_headings = {"#0": "Объект", **headers}
     app.tree.column("#0", width=260, anchor="w")
     app.tree.column("P", width=60, anchor="center")
     app.tree.column("Lmin", width=80, anchor="e")
@@ -202,6 +454,12 @@ def _build_treeview(app):
 
     app.item_to_id = {}
     app.id_to_item = {}
+    # Ленивый режим: поддерево вставляется только при раскрытии узла
+    app.lazy_tree = True
+    # Сортировка по колонке: (ключ из KEY_FUNCS, по убыванию?) или None — порядок модели
+    app.tree_sort = None
+    app.sort_keys = {}  # ключ -> {id узла: значение}
+    app.tree.bind("<<TreeviewOpen>>", lambda e: _on_tree_open(app, e))
 
     _refresh_tree(app)
 
@@ -215,41 +473,18 @@ def on_select(app, event=None):
     app.selected_id = node_id
     _sync_inputs_with_selection(app)
 
+@instrument
 def recalc_tree_up(app, node_id):
-    """Рекурсивно пересчитывает узлы от выбранного до корня по средним значениям детей."""
-    if node_id is None:
-        return
-    node = app.nodes[node_id]
-
-    if node.children:
-        total_prob = 0.0
-        total_loss_min = 0.0
-        total_loss_max = 0.0
-        total_severity = 0.0
-        count = 0
-        for cid in node.children:
-            child = app.nodes[cid]
-            total_prob += child.prob or 0.0
-            total_loss_min += child.loss_min or 0.0
-            total_loss_max += child.loss_max or 0.0
-            total_severity += child.severity or 1.0
-            count += 1
-        if count > 0:
-            node.prob = total_prob / count
-            node.loss_min = total_loss_min / count
-            node.loss_max = total_loss_max / count
-            node.severity = total_severity / count
-        else:
-            node.prob = 0.0
-            node.loss_min = 0.0
-            node.loss_max = 0.0
-            node.severity = 1.0
+    """Пересчитывает узлы от выбранного до корня по средним значениям детей.
 
-    # Рекурсивно поднимаемся к родителю
-    if node.parent_id:
-        recalc_tree_up(app, node.parent_id)
+    Работает через кэш сумм app.aggregator за O(глубины).
+    Возвращает id всех пересчитанных узлов (от node_id до корня).
+    """
+    return app.aggregator.refresh(node_id)
 
+@instrument
 def on_add(app):
+    if _loading_blocked(app): return
     if app.selected_id is None:
         messagebox.showwarning("Нет выбора","Сначала выберите узел в дереве.")
         return
@@ -260,27 +495,21 @@ def on_add(app):
 
     new_id = app.next_id
     app.next_id += 1
-    new_node = RiskNode(id=new_id, name=name, parent_id=app.selected_id)
-    app.nodes[new_id] = new_node
-    app.nodes[app.selected_id].children.append(new_id)
-
-    # Пересчёт родителя
-    recalc_tree_up(app, app.selected_id)
-
-    _refresh_tree(app)
-    save_nodes(app.nodes)
+    record = node_to_dict(RiskNode(id=new_id, name=name, parent_id=app.selected_id))
+    _execute(app, InsertSubtree([record], len(app.nodes[app.selected_id].children)))
 
 def on_rename(app):
+    if _loading_blocked(app): return
     if app.selected_id is None: return
     name = app.entry_name.get().strip()
     if not name:
         messagebox.showwarning("Пустое имя","Введите новое название.")
         return
-    app.nodes[app.selected_id].name = name
-    _refresh_tree(app)
-    save_nodes(app.nodes)
+    _execute(app, Rename(app.selected_id, app.nodes[app.selected_id].name, name))
 
+@instrument
 def on_delete(app):
+    if _loading_blocked(app): return
     if app.selected_id is None: return
     if app.selected_id == 1:
         messagebox.showinfo("Удаление запрещено","Нельзя удалить корневой узел группы.")
@@ -288,34 +517,64 @@ def on_delete(app):
     if not messagebox.askyesno("Подтверждение удаления","Удалить выбранный узел и все его дочерние элементы?"):
         return
 
-    def delete_rec(nid):
-        node = app.nodes[nid]
-        for cid in list(node.children):
-            delete_rec(cid)
-        del app.nodes[nid]
+    # Запоминаем поддерево целиком — его можно будет вернуть отменой
+    node = app.nodes[app.selected_id]
+    records = []
+    stack = [node.id]
+    while stack:
+        nid = stack.pop()
+        records.append(node_to_dict(app.nodes[nid]))
+        stack.extend(reversed(app.nodes[nid].children))
+    index = app.nodes[node.parent_id].children.index(node.id)
+    _execute(app, DeleteSubtree(records, index))
 
-    parent_id = app.nodes[app.selected_id].parent_id
-    if parent_id:
-        app.nodes[parent_id].children = [cid for cid in app.nodes[parent_id].children if cid != app.selected_id]
+    app.selected_id = 1
+    _sync_inputs_with_selection(app)
 
-    delete_rec(app.selected_id)
+# ----------------- Массовый импорт -----------------
+IMPORT_REASONS_SHOWN = 5
+
+@instrument
+def on_import(app):
+    """Импорт магазинов и систем из CSV/JSON (importer.py): одна проверка строк,
+    один пересчёт, одно обновление дерева и одна запись; отменяется одним Ctrl+Z."""
+    if _loading_blocked(app): return
+    filename = filedialog.askopenfilename(
+        title="Импорт магазинов и систем", initialdir="data",
+        filetypes=[("CSV", "*.csv"), ("JSON", "*.json *.jsonl"), ("Все файлы", "*.*")])
+    if not filename:
+        return
+    try:
+        result = plan_import(app.nodes, read_rows(filename), app.next_id)
+        report = None
+        if result.rejected:
+            report = rejected_path(filename)
+            write_rejected(result.rejected, report)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Ошибка импорта", str(e))
+        return
 
-    # После удаления сразу пересчитываем родителя
-    if parent_id:
-        recalc_tree_up(app, parent_id)
+    if result.records:
+        app.next_id = result.next_id
+        _execute(app, ImportNodes(result.records))
 
-    app.selected_id = 1
-    _refresh_tree(app)
-    _sync_inputs_with_selection(app)
-    save_nodes(app.nodes)
+    text = (f"Строк: {result.rows}\nДобавлено узлов: {len(result.records)}"
+            f" (из них уровней по пути: {result.created})\nОтклонено строк: {len(result.rejected)}")
+    if report:
+        reasons = "\n".join(f"  строка {r.line}: {r.reason}" for r in result.rejected[:IMPORT_REASONS_SHOWN])
+        more = "\n  …" if len(result.rejected) > IMPORT_REASONS_SHOWN else ""
+        text += f"\n\n{reasons}{more}\n\nВсе отклонённые строки: {report}"
+    (messagebox.showwarning if result.rejected else messagebox.showinfo)("Импорт", text)
 
 # ----------------- Кнопка "Обновить параметры" -----------------
 def on_recalc(app):
     """Принудительно пересчитывает средние значения по всем родителям."""
-    recalc_tree_up(app, 1)
-    _refresh_tree(app)
+    if _loading_blocked(app): return
+    _apply_changes(app, ChangeSet(updated=recalc_tree_up(app, 1)))
 
+@instrument
 def on_save_risk(app):
+    if _loading_blocked(app): return
     if app.selected_id is None or app.selected_id == 1: return
     try: p = float(app.entry_prob.get().replace(",","."))
     except: p=0.0
@@ -329,54 +588,162 @@ def on_save_risk(app):
     if lmax < lmin: lmin,lmax = lmax,lmin
     s = max(1.0,min(5.0,s))
     node = app.nodes[app.selected_id]
-    node.prob = max(0.0,p)
-    node.loss_min = max(0.0,lmin)
-    node.loss_max = max(0.0,lmax)
-    node.severity = s
-    recalc_tree_up(app, app.selected_id)
-    _recalc_and_update_tree(app)
-    _update_total_label(app)
-    save_nodes(app.nodes)
-
-UI_TO_KEY = {
-    "Объект": "Объект",
-    "Вероятность": "P",
-    "Мин. потери": "Lmin",
-    "Макс. потери": "Lmax",
-    "Ожидаемый мин. потери": "ExpectedMin",
-    "Ожидаемый макс. потери": "ExpectedMax",
-    "Вес": "Severity",
-    "Риск": "Risk"
-}
+    old = (node.prob, node.loss_min, node.loss_max, node.severity)
+    new = (max(0.0,p), max(0.0,lmin), max(0.0,lmax), s)
+    _execute(app, EditParams(app.selected_id, old, new))
 
 def on_report(app, sort_column="Risk", sort_order="Убыванию"):
-    try:
-        nodes_list = list(app.nodes.values())
-
-        sort_key = UI_TO_KEY.get(sort_column, "Risk")
-        reverse = sort_order == "Убыванию"
-
-        def get_key(n):
-            mapping = {
-                "Объект": n.name.lower(),
-                "P": n.prob,
-                "Lmin": n.loss_min,
-                "Lmax": n.loss_max,
-                "ExpectedMin": (n.prob or 0.0) * (n.loss_min or 0.0),
-                "ExpectedMax": (n.prob or 0.0) * (n.loss_max or 0.0),
-                "Severity": n.severity,
-                "Risk": (n.prob or 0.0) * (n.severity or 1.0)
-            }
-            return mapping.get(sort_key, 0)
-
-        nodes_list.sort(key=get_key, reverse=reverse)
-        print("sort_column combobox:", sort_column)
-        print("mapped key:", sort_key)
-        print("sort_order:", sort_order)
-        generate_pdf(nodes_list, sort_column=sort_column, sort_order=sort_order)
-        messagebox.showinfo("Готово","Файл risk_report_magnit.pdf успешно создан.")
-    except Exception as e:
-        messagebox.showerror("Ошибка", str(e))
+    """Ставит отчёт в очередь: PDF строится в отдельном процессе, окно не блокируется."""
+    if _loading_blocked(app):
+        return
+    if not REPORTLAB_AVAILABLE:
+        messagebox.showerror("Ошибка", "ReportLab не установлен")
+        return
+    # VaR/CVaR попадают в отчёт, только если посчитаны по текущему дереву
+    options = {"simulation": app.simulation} if app.simulation is not None and not app.simulation_stale else None
+    _submit_report_job(app, sort_column, sort_order, REPORT_FILE, "pdf", options)
+
+def on_export(app, sort_column="Risk", sort_order="Убыванию"):
+    """Выгрузка таблицы рисков (CSV/XLSX/Parquet) — в том же порядке и с той же группировкой, что PDF."""
+    if _loading_blocked(app):
+        return
+    filename = filedialog.asksaveasfilename(
+        title="Выгрузка таблицы рисков", defaultextension=".csv", initialdir="data",
+        filetypes=[("CSV", "*.csv"), ("Excel", "*.xlsx"), ("Parquet", "*.parquet")])
+    if not filename:
+        return
+    fmt = export_format_of(filename)
+    if fmt is None:
+        messagebox.showerror("Ошибка", "Поддерживаются файлы .csv, .xlsx и .parquet")
+        return
+    if fmt == "xlsx" and not OPENPYXL_AVAILABLE:
+        messagebox.showerror("Ошибка", "Для XLSX установите openpyxl: pip install openpyxl")
+        return
+    if fmt == "parquet" and not PYARROW_AVAILABLE:
+        messagebox.showerror("Ошибка", "Для Parquet установите pyarrow: pip install pyarrow")
+        return
+    _submit_report_job(app, sort_column, sort_order, filename, fmt)
+
+def _submit_report_job(app, sort_column, sort_order, filename, kind, options=None):
+    sort_key = UI_TO_KEY.get(sort_column, "Risk")
+    reverse = sort_order == "Убыванию"
+
+    nodes_list = sort_nodes(list(app.nodes.values()), sort_key, reverse)
+    polling = bool(app.report_jobs.active())
+    app.report_jobs.submit(nodes_list, sort_column, sort_order, filename,
+                           on_done=lambda job: _on_report_done(app, job), kind=kind, options=options)
+    _show_report_status(app)
+    if not polling:
+        _poll_report_jobs(app)
+
+def on_cancel_reports(app):
+    app.report_jobs.cancel_all()
+    _show_report_status(app)
+
+def _poll_report_jobs(app):
+    """Пока идут отчёты, раз в 100 мс забирает их прогресс (процессы сами Tk не трогают)."""
+    app.report_jobs.poll()
+    _show_report_status(app)
+    if app.report_jobs.active():
+        app.root.after(100, lambda: _poll_report_jobs(app))
+
+def _on_report_done(app, job):
+    if job.status == JOB_DONE:
+        app.report_result = (f"Готово: {job.filename}", "#16a34a")
+    elif job.status == JOB_FAILED:
+        app.report_result = (f"Ошибка отчёта: {job.error}", "#dc2626")
+    else:
+        app.report_result = ("Отчёт отменён", "#6b7280")
+
+def _show_report_status(app):
+    jobs = app.report_jobs.active()
+    if jobs:
+        lines = []
+        for job in jobs:
+            if job.status == JOB_QUEUED:
+                lines.append(f"Отчёт {job.id}: в очереди")
+            elif job.kind != "pdf":
+                lines.append(f"Выгрузка {job.id} ({job.kind}): строк {job.rows_done}")
+            else:
+                lines.append(f"Отчёт {job.id}: таблиц {job.tables_done}/{job.tables_total or '?'}, стр. {job.pages_done}")
+        text, color = "\n".join(lines), "#111827"
+    else:
+        text, color = app.report_result
+    app.label_report_status.config(text=text, foreground=color)
+    if jobs:
+        app.btn_cancel_report.grid()
+    else:
+        app.btn_cancel_report.grid_remove()
+
+# ----------------- Моделирование потерь -----------------
+class _SimulationCancelled(Exception):
+    pass
+
+def on_simulate(app):
+    """Монте-Карло по листьям в фоновом потоке (сценарии считает пул процессов).
+
+    Поток работает со снимком параметров листьев, Tk не трогает: результат и
+    прогресс забирает _poll_simulation.
+    """
+    if not SIMULATION_AVAILABLE:
+        messagebox.showerror("Ошибка", "Для моделирования установите numpy: pip install numpy")
+        return
+    if app.simulation_job is not None or _loading_blocked(app):
+        return
+    job = app.simulation_job = {"model": LeafModel(app.nodes), "done": 0, "result": None,
+                                "error": None, "cancel": False, "stale": False, "finished": False}
+
+    def progress(done, total):
+        if job["cancel"]:
+            raise _SimulationCancelled()
+        job["done"] = done
+
+    def run():
+        try:
+            job["result"] = simulate(job["model"], DEFAULT_SCENARIOS, workers=os.cpu_count() or 1, progress=progress)
+        except _SimulationCancelled:
+            pass
+        except Exception as e:
+            job["error"] = str(e) or type(e).__name__
+        job["finished"] = True
+
+    app.btn_simulate.state(["disabled"])
+    threading.Thread(target=run, name="simulation", daemon=True).start()
+    _poll_simulation(app)
+
+def cancel_simulation(app):
+    if app.simulation_job is not None:
+        app.simulation_job["cancel"] = True
+
+def _poll_simulation(app):
+    job = app.simulation_job
+    if not job["finished"]:
+        app.label_var.config(text=f"Моделирование: {job['done']}/{DEFAULT_SCENARIOS} сценариев…", foreground="#6b7280")
+        app.root.after(200, lambda: _poll_simulation(app))
+        return
+    app.simulation_job = None
+    app.btn_simulate.state(["!disabled"])
+    if job["error"] is not None:
+        app.label_var.config(text=f"Ошибка моделирования: {job['error']}", foreground="#dc2626")
+    elif job["result"] is not None:
+        app.simulation = job["result"]
+        app.simulation_stale = job["stale"]
+        _show_simulation(app)
+
+def _show_simulation(app):
+    sim = app.simulation
+    lines = [f"{sim.scenarios} сценариев (Монте-Карло)" + (" — до последних правок" if app.simulation_stale else "")]
+    for q, var, cvar in zip(sim.quantiles, sim.total.var, sim.total.cvar):
+        lines.append(f"VaR {q:.0%}: {var:.2f} руб.\nCVaR {q:.0%}: {cvar:.2f} руб.")
+    app.label_var.config(text="\n".join(lines), foreground="#9ca3af" if app.simulation_stale else "#111827")
+
+def _mark_simulation_stale(app):
+    # После правки прежние VaR/CVaR показываются серым и в PDF не попадают
+    if app.simulation_job is not None:
+        app.simulation_job["stale"] = True
+    elif app.simulation is not None and not app.simulation_stale:
+        app.simulation_stale = True
+        _show_simulation(app)
 
 def build_ui(app):
     main_frame = ttk.Frame(app.root)
@@ -404,6 +771,7 @@ def build_ui(app):
     ttk.Button(frame_manage, text="Переименовать", style="Ghost.TButton", command=lambda: on_rename(app)).grid(row=3, column=0, sticky="we", pady=1)
     ttk.Button(frame_manage, text="Удалить выбранный", style="Danger.TButton", command=lambda: on_delete(app)).grid(row=4, column=0, sticky="we", pady=1)
     ttk.Button(frame_manage, text="Обновить параметры", style="Accent.TButton", command=lambda: on_recalc(app)).grid(row=5, column=0, sticky="we", pady=1)
+    ttk.Button(frame_manage, text="Импорт из файла…", style="Ghost.TButton", command=lambda: on_import(app)).grid(row=6, column=0, sticky="we", pady=1)
 
     # ----------- 2. Параметры -----------
     frame_params = ttk.Frame(top_panel, style="TopPanel.TFrame", padding=6)
@@ -444,12 +812,25 @@ def build_ui(app):
                command=lambda: on_report(app, sort_column=app.pdf_sort_column.get(), sort_order=app.pdf_sort_order.get())) \
         .grid(row=4, column=0, sticky="we", pady=2)
 
+    # --- Выгрузка той же таблицы для BI ---
+    ttk.Button(frame_report, text="Выгрузить таблицу…",
+               command=lambda: on_export(app, sort_column=app.pdf_sort_column.get(), sort_order=app.pdf_sort_order.get())) \
+        .grid(row=5, column=0, sticky="we", pady=2)
+
+    # --- Ход построения отчётов и отмена ---
+    app.report_result = ("", "#6b7280")
+    app.label_report_status = ttk.Label(frame_report, text="", foreground="#6b7280", background="#ffffff", wraplength=220)
+    app.label_report_status.grid(row=7, column=0, sticky="w", pady=(2, 0))
+    app.btn_cancel_report = ttk.Button(frame_report, text="Отменить отчёты", command=lambda: on_cancel_reports(app))
+    app.btn_cancel_report.grid(row=8, column=0, sticky="we", pady=2)
+    app.btn_cancel_report.grid_remove()
+
     # Проверка наличия reportlab
     if not REPORTLAB_AVAILABLE:
         ttk.Label(frame_report,
                   text="(для PDF установите reportlab: pip install reportlab)",
                   foreground="#dc2626",
-                  background="#ffffff").grid(row=5, column=0, sticky="w", pady=(2, 6))
+                  background="#ffffff").grid(row=6, column=0, sticky="w", pady=(2, 6))
 
     # ----------- 4. Итоговая оценка -----------
     frame_total = ttk.Frame(top_panel, style="TopPanel.TFrame", padding=6)
@@ -458,87 +839,104 @@ def build_ui(app):
     ttk.Label(frame_total, text="Итоговая оценка группы", style="Section.TLabel").grid(row=0, column=0, sticky="w")
     app.label_total = ttk.Label(frame_total, text="ΣLower: 0.00 руб.\nΣUpper: 0.00 руб.", font=("Segoe UI",10,"bold"), background="#ffffff", foreground="#111827")
     app.label_total.grid(row=1, column=0, sticky="w", pady=2)
+    app.label_save_status = ttk.Label(frame_total, text=_SAVE_STATUS_TEXT[STATUS_SAVED], foreground="#6b7280", background="#ffffff")
+    app.label_save_status.grid(row=2, column=0, sticky="w", pady=(4, 0))
+    _poll_save_status(app)
+
+    # --- VaR/CVaR по Монте-Карло ---
+    app.simulation = None
+    app.simulation_stale = False
+    app.simulation_job = None
+    app.btn_simulate = ttk.Button(frame_total, text="Смоделировать потери (VaR)", command=lambda: on_simulate(app))
+    app.btn_simulate.grid(row=3, column=0, sticky="we", pady=(6, 1))
+    app.label_var = ttk.Label(frame_total, text="" if SIMULATION_AVAILABLE else "(для VaR установите numpy: pip install numpy)",
+                              foreground="#6b7280" if SIMULATION_AVAILABLE else "#dc2626", background="#ffffff")
+    app.label_var.grid(row=4, column=0, sticky="w", pady=2)
 
     # -------------------- НИЖНЯЯ ПАНЕЛЬ (дерево) --------------------
     bottom_panel = ttk.Frame(main_frame, padding=10)
     bottom_panel.grid(row=1, column=0, sticky="nsew")
     app.right_frame = bottom_panel
+
+    # --- Поиск по названию (Ctrl+F): Enter / ↓ — следующее, Shift+Enter / ↑ — предыдущее ---
+    app.search_index = SearchIndex()
+    app.search_after = None
+    app.search_position = 0
+    search_bar = ttk.Frame(bottom_panel)
+    search_bar.pack(fill="x", pady=(0, 6))
+    ttk.Label(search_bar, text="Поиск:").pack(side="left")
+    app.entry_search = ttk.Entry(search_bar, width=40)
+    app.entry_search.pack(side="left", padx=4)
+    ttk.Button(search_bar, text="▲", width=3, command=lambda: ui_on_search(app, -1)).pack(side="left")
+    ttk.Button(search_bar, text="▼", width=3, command=lambda: ui_on_search(app, 1)).pack(side="left", padx=(2, 0))
+    app.label_search = ttk.Label(search_bar, text="", foreground="#6b7280")
+    app.label_search.pack(side="left", padx=6)
+    app.entry_search.bind("<KeyRelease>", lambda e: None if e.keysym in _SEARCH_NAV_KEYS else _on_search_typed(app))
+    for key, step in (("<Return>", 1), ("<Down>", 1), ("<Shift-Return>", -1), ("<Up>", -1)):
+        app.entry_search.bind(key, lambda e, step=step: ui_on_search(app, step))
     _build_treeview(app)
-    enable_tree_sorting(app.tree)
+    enable_tree_sorting(app)
 
     app.tree.bind("<<TreeviewSelect>>", lambda e: on_select(app))
     on_select(app)
 
-def enable_tree_sorting(tree):
-    """Сортировка Treeview по колонкам, включая #0 (Объект), с рекурсией и сохранением иерархии."""
-    sort_states = {"#0": False}  # состояние сортировки для #0
-    for col in tree["columns"]:
-        sort_states[col] = False
-
-    def sort_column(col):
-        reverse = sort_states[col]
-
-        def get_value(iid):
-            if col == "#0":
-                return tree.item(iid, "text").lower()
-            else:
-                val = tree.set(iid, col)
-                try:
-                    return float(val)
-                except ValueError:
-                    return val.lower()
-
-        def sort_level(item_ids):
-            arr = [(get_value(iid), iid) for iid in item_ids]
-            arr.sort(key=lambda x: x[0], reverse=reverse)
-
-            for index, (_, iid) in enumerate(arr):
-                tree.move(iid, tree.parent(iid), index)
-                sort_level(tree.get_children(iid))
-
-        sort_level(tree.get_children(""))
-        sort_states[col] = not reverse
-
-    # Навесить колбэки
-    tree.heading("#0", text="Объект", command=lambda: sort_column("#0"))
-    for col in tree["columns"]:
-        tree.heading(col, command=lambda c=col: sort_column(c))
+def enable_tree_sorting(app):
+    """Сортировка дерева по клику на заголовок: по возрастанию → по убыванию → исходный порядок.
+
+    Порядок берётся из модели (KEY_FUNCS), а не из текста ячеек, сохраняется при
+    перестройке дерева и правках, а переставляются только сместившиеся элементы.
+    """
+    app.tree.heading("#0", command=lambda: _sort_by_column(app, "#0"))
+    for col in app.tree["columns"]:
+        app.tree.heading(col, command=lambda c=col: _sort_by_column(app, c))
+
+def _sort_by_column(app, column):
+    key = "Объект" if column == "#0" else column
+    if app.tree_sort is None or app.tree_sort[0] != key:
+        app.tree_sort = (key, False)
+    elif not app.tree_sort[1]:
+        app.tree_sort = (key, True)
+    else:
+        app.tree_sort = None
+    for col, text in app.tree_headings.items():
+        mark = ""
+        if app.tree_sort is not None and ("Объект" if col == "#0" else col) == app.tree_sort[0]:
+            mark = " ▼" if app.tree_sort[1] else " ▲"
+        app.tree.heading(col, text=text + mark)
+    _resort_tree(app)
 
 def _recalc_parents_only(app):
-    """Пересчитывает только родительские узлы от всех листьев вверх."""
-    for node_id in app.nodes:
-        recalc_tree_up(app, node_id)
-    _refresh_tree(app)
+    """Пересчитывает только родительские узлы от всех листьев вверх (один обход)."""
+    if _loading_blocked(app): return
+    columns = column_store(app.nodes)
+    app.aggregator.rebuild(columns)
+    app.leaf_totals.rebuild(columns)
+    _recalc_and_update_tree(app)
+    _update_total_label(app)
 
 def ui_on_duplicate(app):
+    if _loading_blocked(app): return
     if app.selected_id is None or app.selected_id == 1:
         return
-    import copy
-    old_node = app.nodes[app.selected_id]
+    records = []
 
     def duplicate_node(node_id, parent_id):
-        nonlocal app
         old = app.nodes[node_id]
         new_id = app.next_id
         app.next_id += 1
-        new_node = copy.deepcopy(old)
-        new_node.id = new_id
-        new_node.parent_id = parent_id
-        new_node.children = []
-        app.nodes[new_id] = new_node
-
-        if parent_id:
-            app.nodes[parent_id].children.append(new_id)
-
+        record = node_to_dict(old)
+        record.update(id=new_id, parent_id=parent_id, children=[])
+        records.append(record)
         for cid in old.children:
-            duplicate_node(cid, new_id)
-
+            record["children"].append(duplicate_node(cid, new_id))
         return new_id
 
-    new_root_id = duplicate_node(app.selected_id, app.nodes[app.selected_id].parent_id)
-    _refresh_tree(app)
+    parent_id = app.nodes[app.selected_id].parent_id
+    duplicate_node(app.selected_id, parent_id)
+    _execute(app, InsertSubtree(records, len(app.nodes[parent_id].children)))
 
 def ui_on_move_up(app):
+    if _loading_blocked(app): return
     if app.selected_id is None or app.selected_id == 1:
         return
     node = app.nodes[app.selected_id]
@@ -547,10 +945,10 @@ def ui_on_move_up(app):
         return
     idx = parent.children.index(node.id)
     if idx > 0:
-        parent.children[idx], parent.children[idx-1] = parent.children[idx-1], parent.children[idx]
-        _refresh_tree(app)
+        _execute(app, MoveNode(parent.id, idx, idx-1))
 
 def ui_on_move_down(app):
+    if _loading_blocked(app): return
     if app.selected_id is None or app.selected_id == 1:
         return
     node = app.nodes[app.selected_id]
@@ -559,8 +957,7 @@ def ui_on_move_down(app):
         return
     idx = parent.children.index(node.id)
     if idx < len(parent.children) - 1:
-        parent.children[idx], parent.children[idx+1] = parent.children[idx+1], parent.children[idx]
-        _refresh_tree(app)
+        _execute(app, MoveNode(parent.id, idx, idx+1))
 
 def ui_on_toggle_expand(app):
     selected = app.tree.selection()
@@ -568,25 +965,183 @@ def ui_on_toggle_expand(app):
         return
     for item in selected:
         is_open = app.tree.item(item, "open")
+        if not is_open and item in app.item_to_id:
+            # программное раскрытие не генерирует <<TreeviewOpen>>
+            _materialize_children(app, item)
         app.tree.item(item, open=not is_open)
 
-def ui_on_search(app):
-    query = app.entry_name.get().strip().lower()
-    if not query:
+# ----------------- Поиск -----------------
+# Пауза в наборе, после которой запускается поиск
+SEARCH_DELAY_MS = 150
+# Клавиши перехода по результатам не перезапускают поиск
+_SEARCH_NAV_KEYS = {"Return", "Up", "Down", "Shift_L", "Shift_R", "Control_L", "Control_R"}
+
+def _search_index(app):
+    # Индекс строится при первом поиске, а не при запуске
+    if not app.search_index.built:
+        app.search_index.rebuild(app.nodes)
+    return app.search_index
+
+def _on_search_typed(app, event=None):
+    """Поиск по мере ввода: после паузы переходим к первому совпадению."""
+    if app.search_after is not None:
+        app.root.after_cancel(app.search_after)
+    app.search_after = app.root.after(SEARCH_DELAY_MS, lambda: _search_jump(app, 0))
+
+def _search_jump(app, position):
+    """Выделяет совпадение номер position (по кругу), раскрывая его предков."""
+    app.search_after = None
+    query = app.entry_search.get().strip()
+    if app.loader is not None:
+        app.label_search.config(text="Дерево ещё загружается…" if query else "")
         return
-    for item, node_id in app.item_to_id.items():
-        node = app.nodes[node_id]
-        if query in node.name.lower():
-            app.tree.selection_set(item)
-            app.tree.see(item)
-            app.selected_id = node_id
-            _sync_inputs_with_selection(app)
-            break
+    index = _search_index(app)
+    total = index.count(query) if query else 0
+    app.search_position = 0
+    if not total:
+        app.label_search.config(text="Не найдено" if query else "")
+        return
+    app.search_position = position % total
+    node_id = index.result_at(query, app.search_position)
+    item = _ensure_item(app, node_id)
+    app.tree.selection_set(item)
+    app.tree.focus(item)
+    app.tree.see(item)
+    app.selected_id = node_id
+    _sync_inputs_with_selection(app)
+    app.label_search.config(text=f"{app.search_position + 1} из {total}")
+
+def ui_on_search(app, step=1):
+    """Следующее (step=1) или предыдущее (step=-1) совпадение поиска."""
+    if app.search_after is not None:
+        # ввод ещё не обработан — начинаем с первого совпадения
+        app.root.after_cancel(app.search_after)
+        _search_jump(app, 0)
+    else:
+        _search_jump(app, app.search_position + step)
+    return "break"
 
 def ui_on_undo(app):
-    # Заглушка
-    print("Undo not implemented yet")
+    if _loading_blocked(app): return
+    changes = app.history.undo(app)
+    if changes is not None:
+        _after_history_step(app, changes)
 
 def ui_on_redo(app):
-    # Заглушка
-    print("Redo not implemented yet")
+    if _loading_blocked(app): return
+    changes = app.history.redo(app)
+    if changes is not None:
+        _after_history_step(app, changes)
+
+def _after_history_step(app, changes):
+    _commit_changes(app, changes)
+    if app.selected_id not in app.nodes:
+        app.selected_id = 1
+    _sync_inputs_with_selection(app)
+
+# ----------------- Замеры (F12) -----------------
+PERF_REFRESH_MS = 500
+PERF_RECENT_SHOWN = 50
+_PERF_COLUMNS = (("name", "Операция", 170), ("count", "Вызовов", 70), ("mean", "Среднее, мс", 90),
+                 ("p95", "p95, мс", 80), ("max", "Макс., мс", 80), ("tk", "Tk на вызов", 90), ("errors", "Ошибок", 60))
+
+def toggle_perf_panel(app):
+    """Окно замеров: итоги по обработчикам, последние операции, профиль одного действия.
+
+    Пока окно открыто, замеры включены; при закрытии выключаются, если программа
+    не запущена с RISK_PERF=1.
+    """
+    if getattr(app, "perf_panel", None) is not None:
+        _close_perf_panel(app)
+        return
+    win = tk.Toplevel(app.root)
+    win.title("Замеры")
+    win.geometry("720x560")
+    win.protocol("WM_DELETE_WINDOW", lambda: _close_perf_panel(app))
+    win.bind('<F12>', lambda e: _close_perf_panel(app))
+    app.perf_panel = win
+    app.perf_keep = perf.is_enabled()
+    app.perf_enabled = tk.BooleanVar(value=True)
+    app.perf_profile_shown = None
+    _set_perf_enabled(app)
+
+    bar = ttk.Frame(win, padding=6)
+    bar.pack(fill="x")
+    ttk.Checkbutton(bar, text="Замерять", variable=app.perf_enabled, command=lambda: _set_perf_enabled(app)).pack(side="left")
+    ttk.Button(bar, text="Сбросить", command=perf.reset).pack(side="left", padx=4)
+    ttk.Button(bar, text="Профиль следующего действия", command=perf.profile_next).pack(side="left", padx=4)
+    ttk.Button(bar, text="Экспорт…", command=lambda: _export_perf(app)).pack(side="left", padx=4)
+
+    app.perf_stats = ttk.Treeview(win, columns=[c for c, _, _ in _PERF_COLUMNS], show="headings", height=8)
+    for column, title, width in _PERF_COLUMNS:
+        app.perf_stats.heading(column, text=title)
+        app.perf_stats.column(column, width=width, anchor="w" if column == "name" else "e")
+    app.perf_stats.pack(fill="x", padx=6)
+
+    ttk.Label(win, text=f"Последние {PERF_RECENT_SHOWN} операций (вложенные — с отступом):").pack(anchor="w", padx=6, pady=(6, 0))
+    app.perf_recent = tk.Listbox(win, height=12, font=("Consolas", 9))
+    app.perf_recent.pack(fill="both", expand=True, padx=6)
+
+    app.label_perf_profile = ttk.Label(win, text="", foreground="#6b7280")
+    app.label_perf_profile.pack(anchor="w", padx=6, pady=(6, 0))
+    app.perf_profile_text = tk.Text(win, height=10, font=("Consolas", 8), wrap="none", state="disabled")
+    app.perf_profile_text.pack(fill="both", expand=True, padx=6, pady=(0, 6))
+    _refresh_perf_panel(app)
+
+def _set_perf_enabled(app):
+    if app.perf_enabled.get():
+        perf.enable()
+        perf.count_tk(app.root)
+    else:
+        perf.disable()
+        perf.uncount_tk(app.root)
+
+def _close_perf_panel(app):
+    if not app.perf_keep:
+        app.perf_enabled.set(False)
+        _set_perf_enabled(app)
+    app.root.after_cancel(app.perf_after)
+    app.perf_panel.destroy()
+    app.perf_panel = None
+
+def _export_perf(app):
+    path = filedialog.asksaveasfilename(parent=app.perf_panel, title="Выгрузить замеры", defaultextension=".json",
+                                        initialfile="perf.json", filetypes=[("JSON", "*.json")])
+    if not path:
+        return
+    try:
+        perf.export(path)
+    except OSError as e:
+        messagebox.showerror("Ошибка", f"Не удалось выгрузить замеры:\n{e}", parent=app.perf_panel)
+
+def _refresh_perf_panel(app):
+    if app.perf_panel is None:
+        return
+    app.perf_stats.delete(*app.perf_stats.get_children())
+    for s in perf.stats():
+        app.perf_stats.insert("", "end", values=(
+            s.name, s.count, f"{s.mean_ms:.1f}", f"{s.percentile(0.95):.1f}", f"{s.max_ms:.1f}",
+            f"{s.tk_calls / s.count:.0f}", s.errors or ""))
+
+    app.perf_recent.delete(0, "end")
+    for r in perf.recent(PERF_RECENT_SHOWN):
+        line = (f"{time.strftime('%H:%M:%S', time.localtime(r.started))}  {'  ' * r.depth}{r.name:<24} "
+                f"{r.ms:9.1f} мс  Tk {r.tk_calls:<6}")
+        if r.thread != "MainThread":
+            line += f" [{r.thread}]"
+        if r.error:
+            line += f" ошибка: {r.error}"
+        app.perf_recent.insert("end", line)
+
+    profile = perf.last_profile
+    if perf.profile_armed():
+        app.label_perf_profile.config(text="Профиль: ждёт следующего действия…")
+    elif profile is not None:
+        app.label_perf_profile.config(text=f"Профиль {profile['name']}: {profile['path']}")
+    if profile is not None and profile is not app.perf_profile_shown:
+        app.perf_profile_shown = profile
+        app.perf_profile_text.config(state="normal")
+        app.perf_profile_text.delete("1.0", "end")
+        app.perf_profile_text.insert("1.0", profile["summary"])
+        app.perf_profile_text.config(state="disabled")
+    app.perf_after = app.root.after(PERF_REFRESH_MS, lambda: _refresh_perf_panel(app))